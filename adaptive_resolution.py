@@ -0,0 +1,243 @@
+"""
+Adaptive input resolution: one network at several input sizes, and a controller picking the size to infer at.
+
+The YOLOv3 IR is fully convolutional, so it can be reshaped to any input size that is a multiple of 32; its output
+grids are the input size divided by 32, 16 and 8. A smaller input is cheaper (inference time grows about with the
+number of pixels) but misses small objects. SizedNetworks loads the network once per size through a NetworkCache
+(so every size has a cache entry of its own) and keeps the executable networks, ResolutionController picks the size
+from the measured frame rate and the number of detected objects.
+
+    python adaptive_resolution.py    latency and FPS against input size on the stub engine, and the controller
+                                     converging on a target FPS from either end
+"""
+from __future__ import print_function, division
+
+import sys
+import time
+
+
+class SizedNetworks:
+    """Executable networks of one IR at square input sizes, loaded through `cache` the first time a size is asked for.
+
+    get(size) returns (exec_net, net); None or the input size of the IR itself loads the IR as it is, other sizes
+    reshape the single input blob to size x size. Each executable network has num_requests infer requests.
+    """
+
+    def __init__(self, cache, model_xml, model_bin, num_requests=1, batch_size=None):
+        self.cache = cache
+        self.model_xml = model_xml
+        self.model_bin = model_bin
+        self.num_requests = num_requests
+        self.batch_size = batch_size
+        self.networks = dict()
+        self.native_size = None
+        self._input_shape = None
+
+    def get(self, size=None):
+        if self.native_size is None:
+            exec_net, net = self.cache.load(self.model_xml, self.model_bin, self.num_requests, self.batch_size)
+            self._input_shape = list(net.inputs[next(iter(net.inputs))].shape)
+            self.native_size = self._input_shape[2]
+            self.networks[self.native_size] = exec_net, net
+        size = self.native_size if size is None else size
+        if size not in self.networks:
+            assert size % 32 == 0, "Input sizes should be multiples of 32, got {}".format(size)
+            n, c = self._input_shape[:2]
+            input_blob = next(iter(self.networks[self.native_size][1].inputs))
+            self.networks[size] = self.cache.load(self.model_xml, self.model_bin, self.num_requests, self.batch_size,
+                                                  input_shapes={input_blob: (n, c, size, size)})
+        return self.networks[size]
+
+
+class ResolutionController:
+    """Picks one of `sizes` (input sizes, smallest to largest) for the next frames.
+
+    record(size, frame_time, num_objects) is called for every inferred frame with the size it was inferred at and the
+    time it took the loop (the interval between results, so a pipelined loop measures its throughput). Frame times
+    are averaged per size, leaving out the first frame after a change of size (its interval spans both sizes); sizes
+    not measured yet are estimated from the nearest measured size, scaled by the number of pixels. With target_fps
+    the controller keeps to the largest size that reaches it, moving up only while the estimate leaves `headroom` (a
+    fraction of the frame budget) to spare. With dense_objects and/or sparse_objects it moves one size up when the
+    average number of objects reaches dense_objects and one size down when it falls to sparse_objects, small objects
+    in crowded scenes need the resolution; without them it aims for the largest size that keeps the frame rate.
+    After a switch the size is kept for min_frames frames. The current choice is `size`.
+    """
+
+    def __init__(self, sizes, size=None, target_fps=None, dense_objects=None, sparse_objects=None, min_frames=30,
+                 smoothing=0.1, headroom=0.1):
+        self.sizes = sorted(sizes)
+        self.size = self.sizes[-1] if size is None else size
+        assert self.size in self.sizes, "Initial size {} is not one of {}".format(self.size, self.sizes)
+        self.target_fps = target_fps
+        self.dense_objects = dense_objects
+        self.sparse_objects = sparse_objects
+        self.min_frames = min_frames
+        self.smoothing = smoothing
+        self.headroom = headroom
+        self.frame_times = dict()
+        self.objects = None
+        self.switches = 0
+        self._frames = 0
+        self._last_size = None
+
+    def _average(self, average, value):
+        return value if average is None else average + self.smoothing * (value - average)
+
+    def record(self, size, frame_time, num_objects=None):
+        # Returns the size for the next frames
+        if size == self._last_size:
+            self.frame_times[size] = self._average(self.frame_times.get(size), frame_time)
+        self._last_size = size
+        if num_objects is not None:
+            self.objects = self._average(self.objects, num_objects)
+        if size == self.size:
+            self._frames += 1
+        return self.update()
+
+    def estimate(self, size):
+        # Average frame time at size, None before any frame was measured
+        if size in self.frame_times:
+            return self.frame_times[size]
+        if not self.frame_times:
+            return None
+        measured = min(self.frame_times, key=lambda other: abs(other - size))
+        return self.frame_times[measured] * (size / measured) ** 2
+
+    def fps_cap(self):
+        # Largest size reaching target_fps, the smallest size when none does
+        if self.target_fps is None:
+            return self.sizes[-1]
+        budget = 1.0 / self.target_fps
+        cap = self.sizes[0]
+        for size in self.sizes:
+            estimate = self.estimate(size)
+            if estimate is None:
+                break
+            # Going up needs headroom, staying at the current size or below only the budget
+            if estimate <= (budget if size <= self.size else budget * (1 - self.headroom)):
+                cap = size
+        return cap
+
+    def update(self):
+        if self._frames < self.min_frames:
+            return self.size
+        index = self.sizes.index(self.size)
+        if self.dense_objects is None and self.sparse_objects is None:
+            desired = self.sizes[-1]
+        elif self.objects is not None and self.dense_objects is not None and self.objects >= self.dense_objects:
+            desired = self.sizes[min(index + 1, len(self.sizes) - 1)]
+        elif self.objects is not None and self.sparse_objects is not None and self.objects <= self.sparse_objects:
+            desired = self.sizes[max(index - 1, 0)]
+        else:
+            desired = self.size
+        size = min(desired, self.fps_cap())
+        # One step at a time upwards, down straight to the size that keeps the frame rate
+        if size > self.size:
+            size = self.sizes[index + 1]
+        if size != self.size:
+            self.size = size
+            self.switches += 1
+            self._frames = 0
+        return self.size
+
+    def summary(self):
+        times = ', '.join("{} {:.1f} ms".format(size, frame_time * 1e3)
+                          for size, frame_time in sorted(self.frame_times.items()))
+        return "size {}, {} switches; mean frame time {}".format(self.size, self.switches, times or "-")
+
+
+# ----------------------------------------------------- Benchmark ------------------------------------------------------
+def benchmark(sizes=(320, 416, 512, 608), num_frames=24, target_fps=10.0, controller_frames=90):
+    # The YOLOv3 stub network at every size on a device running one request at a time (inference time grows with the
+    # pixels, see benchmark.yolo_network), then the controller from the smallest and from the largest size; a run
+    # keeps 4 requests in flight, frames of the previous size drain while the next size is already being submitted
+    from collections import deque
+
+    import benchmark as stub_models
+    from capture import SyntheticCapture
+    from model_cache import NetworkCache
+    from preprocess import FramePreprocessor
+    from request_pool import AsyncRequestPool
+    from stub_engine import FakeIEPlugin
+    from yolo_parser import detect_objects
+
+    cache = NetworkCache(FakeIEPlugin(parallel=1), None, read_network=lambda model_xml, model_bin:
+                         stub_models.yolo_network())
+    networks = SizedNetworks(cache, 'yolo.xml', 'yolo.bin', num_requests=4)
+    models = dict()
+
+    def model(size):
+        if size not in models:
+            exec_net, net = networks.get(size)
+            input_blob = next(iter(net.inputs))
+            shape = net.inputs[input_blob].shape
+            layers_params = {layer_name: net.layers[layer_name].params for layer_name in net.outputs}
+            models[size] = exec_net, AsyncRequestPool(exec_net), input_blob, shape, layers_params, \
+                FramePreprocessor(shape)
+        return models[size]
+
+    def run(frames, controller=None, size=None, depth=4):
+        # Returns frames per second, mean inference latency, mean parse time and the mean number of objects
+        for _, pool, _, _, _, _ in models.values():
+            pool.max_in_flight = depth
+        cap = SyntheticCapture(frames, 1280, 720)
+        pending = deque()
+        latencies, parse_times, counts = list(), list(), list()
+        end_of_stream = False
+        start_time = last_result = time.time()
+        while True:
+            if controller is not None:
+                size = controller.size
+            exec_net, pool, input_blob, shape, layers_params, preprocess = model(size)
+            pool.max_in_flight = depth
+            if not end_of_stream and not pool.full():
+                ret, frame = cap.read()
+                if ret:
+                    preprocess(frame, pool.next_request().inputs[input_blob])
+                    pool.submit(None)
+                    pending.append((size, time.time()))
+                    continue
+                end_of_stream = True
+            if not pending:
+                break
+            frame_size, submit_time = pending.popleft()
+            _, pool, _, shape, layers_params, _ = model(frame_size)
+            _, outputs, _ = pool.get()
+            result_time = time.time()
+            objects = detect_objects(outputs, layers_params, shape[2:], (720, 1280))
+            parse_times.append(time.time() - result_time)
+            latencies.append(result_time - submit_time)
+            counts.append(len(objects))
+            if controller is not None:
+                controller.record(frame_size, result_time - last_result, len(objects))
+            last_result = result_time
+        mean = lambda values: sum(values) / len(values)
+        return frames / (time.time() - start_time), mean(latencies), mean(parse_times), mean(counts)
+
+    # Latency with one request in flight, FPS with four
+    print("{:>6} {:>14} {:>12} {:>10} {:>8} {:>9}".format("size", "grids", "latency ms", "parse ms", "FPS",
+                                                          "objects"))
+    for size in sizes:
+        _, latency, parse_time, objects = run(num_frames // 2, size=size, depth=1)
+        fps, _, _, _ = run(num_frames, size=size)
+        print("{:>6} {:>14} {:>12.1f} {:>10.2f} {:>8.1f} {:>9.1f}".format(
+            size, "/".join(str(size // stride) for stride in (32, 16, 8)), latency * 1e3, parse_time * 1e3, fps,
+            objects))
+
+    print("\nController, target {:.0f} FPS, {} frames:".format(target_fps, controller_frames))
+    for start in (sizes[0], sizes[-1]):
+        controller = ResolutionController(sizes, start, target_fps, min_frames=8)
+        fps, _, _, _ = run(controller_frames, controller)
+        print("  from {}: {:.1f} FPS overall, {}".format(start, fps, controller.summary()))
+
+    # Scene density alone (fast frames): crowded frames raise the size a step at a time, empty ones lower it
+    controller = ResolutionController(sizes, sizes[1], dense_objects=30, sparse_objects=5, min_frames=8)
+    trace = list()
+    for num_objects in [10] * 20 + [60] * 40 + [2] * 40:
+        trace.append(controller.record(controller.size, 0.01, num_objects))
+    print("Density 10 -> 60 -> 2 objects: sizes {}".format(
+        " -> ".join(str(size) for i, size in enumerate(trace) if i == 0 or size != trace[i - 1])))
+
+
+if __name__ == '__main__':
+    sys.exit(benchmark() or 0)
@@ -0,0 +1,322 @@
+"""
+Offline processing of video archives with a pool of worker processes.
+
+The input is either a directory of videos, every video being one shard, or a single long video that is cut into
+frame ranges. Every worker process owns its own plugin and executable network, decodes the frames of its shard itself
+and writes the results to a part file, so neither frames nor results are pickled between processes; the parent only
+hands out shard descriptions and merges the part files of every video in frame order. Road segmentation writes the
+class maps of MaskWriter, YOLOv3 the detections as JSON Lines, the same formats as the headless demos.
+
+With batch_size > 1 the network is loaded with a batch of that many images and every infer request carries
+batch_size consecutive frames of a shard as one (B, C, H, W) input; the output blobs are split back into per-frame
+results. The last batch of a shard may be partial, the images of the previous batch left in the unused slots are
+ignored. Batching trades latency, which offline processing does not care about, for throughput on CPUs.
+
+    python batch_process.py road|yolo <video directory or file> <output directory or file> [num_workers [batch_size]]
+    python batch_process.py benchmark [batch]
+"""
+from __future__ import print_function, division
+
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import cv2
+
+from capture import FrameReader
+from preprocess import FramePreprocessor
+from request_pool import AsyncRequestPool
+from result_writer import JsonLinesWriter, MaskWriter
+from road_utils import RoadPostprocessor
+from yolo_parser import detect_objects
+
+num_workers = os.cpu_count() or 1
+# A single video is cut into num_workers * segments_per_worker frame ranges, so that workers finishing early get more
+segments_per_worker = 2
+num_requests = 2
+# Frames per infer request
+batch_size = 1
+prefetch_frames = 8
+video_extensions = ('.mp4', '.avi', '.mkv', '.mov')
+result_extensions = dict(road='.rle', yolo='.jsonl')
+
+
+# ------------------------------------------------------- Pipelines ----------------------------------------------------
+def load_network(pipeline, stub, batch):
+    # Plugin and network of one worker, the stub networks of the benchmark need no OpenVINO installation
+    if stub:
+        import benchmark
+        from stub_engine import FakeIEPlugin
+        build = dict(road=benchmark.road_network, yolo=benchmark.yolo_network)[pipeline]
+        net = build()
+        net.batch_size = batch
+        return FakeIEPlugin(), net
+
+    from openvino.inference_engine import IENetwork, IEPlugin
+    if pipeline == 'road':
+        import road as config
+        model_xml, model_bin, device = config.model_xml, config.model_bin, 'CPU' if config.use_CPU else 'GPU'
+    else:
+        import yoloV3 as config
+        model_xml, model_bin, device = config.yolo_model_xml, config.yolo_model_bin, config.device
+    plugin = IEPlugin(device=device, plugin_dirs=config.plugin_dir)
+    if config.cpu_extension and 'CPU' in device:
+        plugin.add_cpu_extension(config.cpu_extension)
+    net = IENetwork(model=model_xml, weights=model_bin)
+    net.batch_size = batch
+    return plugin, net
+
+
+def road_pipeline(plugin, net):
+    input_blob = next(iter(net.inputs))
+    out_blob = next(iter(net.outputs))
+    frame_preprocessor = FramePreprocessor(net.inputs[input_blob].shape)
+    postprocess = RoadPostprocessor()
+    exec_net = plugin.load(network=net, num_requests=num_requests)
+
+    def preprocess(frame, request, batch_index):
+        frame_preprocessor(frame, request.inputs[input_blob], batch_index)
+
+    def write(writer, frame_index, frame, outputs):
+        writer.write(frame_index, postprocess.class_map(outputs[out_blob]))
+
+    return exec_net, preprocess, MaskWriter, write
+
+
+def yolo_pipeline(plugin, net, labels_map=None, iou_threshold=0.5, class_agnostic=False, top_k=None):
+    input_blob = next(iter(net.inputs))
+    shape = net.inputs[input_blob].shape
+    frame_preprocessor = FramePreprocessor(shape)
+    layers_params = {layer_name: net.layers[layer_name].params for layer_name in net.outputs}
+    exec_net = plugin.load(network=net, num_requests=num_requests)
+
+    def preprocess(frame, request, batch_index):
+        frame_preprocessor(frame, request.inputs[input_blob], batch_index)
+
+    def write(writer, frame_index, frame, outputs):
+        objects = detect_objects(outputs, layers_params, shape[2:], frame.shape[:-1], 0.5, iou_threshold,
+                                 class_agnostic, top_k)
+        writer.write(frame_index, objects=objects.to_dicts(with_labels=True, labels_map=labels_map))
+
+    return exec_net, preprocess, JsonLinesWriter, write
+
+
+def build_pipeline(pipeline, stub, batch=1):
+    plugin, net = load_network(pipeline, stub, batch)
+    if pipeline == 'road':
+        return road_pipeline(plugin, net)
+    if stub:
+        return yolo_pipeline(plugin, net)
+    import yoloV3 as config
+    with open(config.labels, 'r') as f:
+        labels_map = [x.strip() for x in f]
+    return yolo_pipeline(plugin, net, labels_map, config.iou_threshold, config.class_agnostic_nms, config.nms_top_k)
+
+
+# -------------------------------------------------------- Shards ------------------------------------------------------
+def frame_count(path):
+    cap = cv2.VideoCapture(path)
+    count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return count
+
+
+def make_shards(input_path, output_path, pipeline, workers):
+    # (video, first frame, end frame or None, part file, output file) of every shard, in merge order
+    if os.path.isdir(input_path):
+        if not os.path.isdir(output_path):
+            os.makedirs(output_path)
+        videos = sorted(name for name in os.listdir(input_path) if name.lower().endswith(video_extensions))
+        return [(os.path.join(input_path, name), 0, None, None,
+                 os.path.join(output_path, os.path.splitext(name)[0] + result_extensions[pipeline]))
+                for name in videos]
+    # The frame count of many containers is an estimate: the last shard reads to the end of the video, and a video
+    # without a count is one shard
+    count = frame_count(input_path)
+    if count <= 0:
+        return [(input_path, 0, None, None, output_path)]
+    num_segments = max(min(workers * segments_per_worker, count), 1)
+    bounds = [count * i // num_segments for i in range(num_segments)] + [None]
+    return [(input_path, start, end, None, output_path) for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+_worker = None
+
+
+def _init_worker(pipeline, stub, batch):
+    global _worker
+    _worker = build_pipeline(pipeline, stub, batch) + (batch,)
+
+
+def split_outputs(outputs, batch_index):
+    # Outputs of one frame of a batch, as the network would return them for a batch of one
+    return {name: blob[batch_index:batch_index + 1] for name, blob in outputs.items()}
+
+
+def open_at(source, start):
+    # Capture of source whose next frame is frame `start`. Seeks in compressed video (keyframes, B-frames, variable
+    # frame rate) may land off the frame asked for: frames short of start are decoded and dropped, a capture that
+    # landed past it or does not know its position is opened again and decoded from the first frame
+    cap = cv2.VideoCapture(source)
+    if not start:
+        return cap
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    position = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+    if not 0 <= position <= start:
+        cap.release()
+        cap = cv2.VideoCapture(source)
+        position = 0
+    for _ in range(start - position):
+        if not cap.grab():
+            break
+    return cap
+
+
+def process_shard(shard):
+    # Runs in a worker: decodes the frame range of the shard and writes its results to the part file
+    source, start, end, part_path, _ = shard
+    exec_net, preprocess, writer_class, write, batch = _worker
+    cap = open_at(source, start)
+    # Frames of the requests in flight and of the batch being filled stay valid, with room to decode the next batch
+    keep = (num_requests + 1) * batch
+    reader = FrameReader(cap, max(prefetch_frames, keep + batch), keep=keep)
+    pool = AsyncRequestPool(exec_net)
+    writer = writer_class(part_path)
+    num_frames = 0
+    end_of_stream = False
+    # (frame, frame index) of every image of the batch being filled
+    frames = list()
+    while True:
+        if not end_of_stream and not pool.full():
+            ret, frame = reader.read() if end is None or start + reader.frame_index + 1 < end else (False, None)
+            if ret:
+                preprocess(frame, pool.next_request(), len(frames))
+                frames.append((frame, start + reader.frame_index))
+            else:
+                end_of_stream = True
+            # A full batch is submitted, a partial one only at the end of the shard
+            if len(frames) == batch or (end_of_stream and frames):
+                pool.submit(None, frames)
+                frames = list()
+        if pool.empty():
+            if end_of_stream:
+                break
+            continue
+        if not end_of_stream and not pool.full():
+            continue
+        _, outputs, batch_frames = pool.get()
+        if outputs is not None:
+            for batch_index, (frame, frame_index) in enumerate(batch_frames):
+                write(writer, frame_index, frame, split_outputs(outputs, batch_index))
+        num_frames += len(batch_frames)
+    writer.close()
+    reader.release()
+    return num_frames
+
+
+def merge_parts(shards):
+    # Part files are concatenated per output file in shard order; both result formats are plain record streams
+    outputs = dict()
+    for shard in shards:
+        outputs.setdefault(shard[4], list()).append(shard[3])
+    for output_path, part_paths in outputs.items():
+        with open(output_path, 'wb') as output:
+            for part_path in part_paths:
+                with open(part_path, 'rb') as part:
+                    shutil.copyfileobj(part, output)
+                os.remove(part_path)
+
+
+def process(pipeline, input_path, output_path, workers=None, stub=False, batch=None):
+    workers = workers or num_workers
+    batch = batch or batch_size
+    shards = make_shards(input_path, output_path, pipeline, workers)
+    part_dir = tempfile.mkdtemp()
+    shards = [(source, start, end, os.path.join(part_dir, '{}.part'.format(i)), output)
+              for i, (source, start, end, _, output) in enumerate(shards)]
+    try:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(pipeline, stub, batch))
+        try:
+            num_frames = sum(pool.imap_unordered(process_shard, shards))
+        finally:
+            pool.close()
+            pool.join()
+        merge_parts(shards)
+    finally:
+        shutil.rmtree(part_dir)
+    return num_frames
+
+
+def benchmark(worker_counts=(1, 2, 4), num_videos=4, frames_per_video=60):
+    # Throughput of the YOLOv3 pipeline on the stub engine for several worker counts; YOLO parsing and NMS run in
+    # Python, so they only scale with processes. Every run has to produce the same merged results
+    from multistream import write_synthetic_video
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        video_dir = os.path.join(work_dir, 'videos')
+        os.makedirs(video_dir)
+        for i in range(num_videos):
+            write_synthetic_video(os.path.join(video_dir, 'video_{}.avi'.format(i)), frames_per_video)
+        print("{:>8} {:>10} {:>10}".format("workers", "frames", "FPS"))
+        reference = None
+        for workers in worker_counts:
+            output_dir = os.path.join(work_dir, 'results_{}'.format(workers))
+            start_time = time.time()
+            num_frames = process('yolo', video_dir, output_dir, workers, stub=True)
+            elapsed = time.time() - start_time
+            results = list()
+            for name in sorted(os.listdir(output_dir)):
+                with open(os.path.join(output_dir, name), 'rb') as f:
+                    results.append(f.read())
+            assert reference is None or results == reference, "Results depend on the number of workers"
+            reference = results
+            print("{:>8} {:>10} {:>10.1f}".format(workers, num_frames, num_frames / elapsed))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def benchmark_batch(batch_sizes=(1, 2, 4, 8), num_frames=101):
+    # Throughput of one worker against the batch size on the stub engine, where every further frame of a batch costs
+    # a quarter of a single inference (see benchmark.batch_ratio). The video is cut into two shards whose lengths are
+    # no multiple of the batch sizes, so partial batches are covered; every batch size has to produce the same results
+    from multistream import write_synthetic_video
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        video_path = write_synthetic_video(os.path.join(work_dir, 'video.avi'), num_frames)
+        print("{:>8} {:>6} {:>10} {:>10} {:>8}".format("pipeline", "batch", "frames", "FPS", "speedup"))
+        for pipeline in ('yolo', 'road'):
+            reference = None
+            for batch in batch_sizes:
+                output_path = os.path.join(work_dir, '{}_{}{}'.format(pipeline, batch, result_extensions[pipeline]))
+                start_time = time.time()
+                frames = process(pipeline, video_path, output_path, 1, stub=True, batch=batch)
+                fps = frames / (time.time() - start_time)
+                with open(output_path, 'rb') as f:
+                    results = f.read()
+                assert reference is None or results == reference[0], "Results depend on the batch size"
+                reference = reference or (results, fps)
+                print("{:>8} {:>6} {:>10} {:>10.1f} {:>7.2f}x".format(pipeline, batch, frames, fps, fps / reference[1]))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        return benchmark_batch() if sys.argv[2:] == ['batch'] else benchmark()
+    if len(sys.argv) < 4 or sys.argv[1] not in result_extensions:
+        print(__doc__)
+        return 1
+    workers = int(sys.argv[4]) if len(sys.argv) > 4 else None
+    batch = int(sys.argv[5]) if len(sys.argv) > 5 else None
+    start_time = time.time()
+    num_frames = process(sys.argv[1], sys.argv[2], sys.argv[3], workers, batch=batch)
+    print("Processed {} frames in {:.3f} s".format(num_frames, time.time() - start_time))
+
+
+if __name__ == '__main__':
+    sys.exit(main() or 0)
@@ -0,0 +1,281 @@
+"""
+Per-stage benchmark of the road segmentation, face landmark and YOLOv3 pipelines.
+
+Every pipeline runs the same stage functions as the demos on synthetic frames against the deterministic stub
+inference engine, so no OpenVINO installation or model files are needed. Latency percentiles and throughput of
+decode, preprocess, infer-wait, postprocess and render are printed and written to result_file as JSON, together
+with the current git commit, so that runs on different commits can be compared.
+
+    python benchmark.py [result_file]
+"""
+from __future__ import print_function, division
+
+import json
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from capture import SyntheticCapture
+from face_utils import detect_faces, draw_faces
+from preprocess import FramePreprocessor
+from request_pool import AsyncRequestPool
+from road_utils import RoadPostprocessor
+from stub_engine import FakeIENetwork, FakeIEPlugin, batched_outputs
+from yolo_parser import detect_objects, draw_objects
+
+num_frames = 200
+num_requests = 4
+frame_width = 1280
+frame_height = 720
+result_file = './benchmark.json'
+
+# Simulated inference latency of every model in seconds
+infer_times = dict(road=0.030, face=0.015, landmark=0.002, yolo=0.080)
+# Every further frame of a batch costs this fraction of a single inference, as batching amortizes the per-request
+# overhead on CPUs
+batch_ratio = 0.25
+
+STAGES = ('decode', 'preprocess', 'infer_wait', 'postprocess', 'render')
+
+
+class StageTimes:
+    def __init__(self):
+        self.samples = OrderedDict((stage, list()) for stage in STAGES)
+
+    def record(self, stage, seconds):
+        self.samples[stage].append(seconds)
+
+    def summary(self):
+        result = OrderedDict()
+        for stage, samples in self.samples.items():
+            if not samples:
+                continue
+            samples = np.asarray(samples) * 1e3
+            result[stage] = OrderedDict([
+                ('count', len(samples)),
+                ('mean_ms', float(samples.mean())),
+                ('p50_ms', float(np.percentile(samples, 50))),
+                ('p95_ms', float(np.percentile(samples, 95))),
+                ('p99_ms', float(np.percentile(samples, 99))),
+                # Frames per second the stage could sustain on its own
+                ('throughput_fps', float(1e3 * len(samples) / samples.sum()) if samples.sum() else None),
+            ])
+        return result
+
+
+# ---------------------------------------------- Deterministic model outputs -------------------------------------------
+def road_outputs_fn(shape):
+    _, classes, h, w = shape
+    logits = np.zeros(shape, dtype=np.float32)
+    logits[0, 0, :h // 2] = 1  # sky and buildings are background
+    logits[0, 1, h // 2:] = 1  # road
+    logits[0, 2, h // 2:, :w // 16] = 2  # curb
+    logits[0, 3, h // 2:, w // 2 - w // 64:w // 2 + w // 64] = 2  # lane mark
+    return lambda inputs: {'out': logits.copy()}
+
+
+def face_outputs_fn(num_faces=3):
+    detections = np.zeros((1, 1, 200, 7), dtype=np.float32)
+    for i in range(num_faces):
+        xmin = 0.1 + 0.8 * i / num_faces
+        detections[0, 0, i] = (0, 1, 0.9, xmin, 0.3, xmin + 0.15, 0.6)
+    return lambda inputs: {'detection_out': detections.copy()}
+
+
+def landmark_outputs_fn(batch_size):
+    points = np.tile(np.array([0.3, 0.4, 0.7, 0.4, 0.5, 0.6, 0.35, 0.8, 0.65, 0.8], dtype=np.float32), batch_size)
+    return lambda inputs: {'landmarks': points.reshape((batch_size, 10, 1, 1)).copy()}
+
+
+def yolo_outputs_fn(sides=(13, 26, 52), num_objects=20, seed=0):
+    rng = np.random.RandomState(seed)
+    blobs = dict()
+    # Blobs keep the names of the 416x416 IR at other input sizes, as a reshaped network does
+    for side, name_side in zip(sides, (13, 26, 52)):
+        blob = rng.uniform(0, 0.3, size=(1, 255, side, side)).astype(np.float32)
+        for _ in range(num_objects):
+            n, row, col, class_id = rng.randint(3), rng.randint(side), rng.randint(side), rng.randint(80)
+            blob[0, n * 85 + 4, row, col] = 0.9
+            blob[0, n * 85 + 5 + class_id, row, col] = 0.95
+        blobs['detector/yolo-v3/Conv_{}/BiasAdd/YoloRegion'.format(name_side)] = blob
+    return lambda inputs: {name: blob.copy() for name, blob in blobs.items()}
+
+
+# ------------------------------------------------------- Pipelines ----------------------------------------------------
+def road_network():
+    return FakeIENetwork({'data': (1, 3, 512, 896)}, {'out': (1, 4, 512, 896)}, infer_time=infer_times['road'],
+                         outputs_fn=batched_outputs(road_outputs_fn((1, 4, 512, 896))),
+                         batch_time=infer_times['road'] * batch_ratio)
+
+
+def yolo_network(size=416):
+    # Other multiple-of-32 sizes scale the output grids, and the inference time with the number of pixels
+    outputs_fn = yolo_outputs_fn((size // 32, size // 16, size // 8))
+    output_shapes = {name: blob.shape for name, blob in outputs_fn(None).items()}
+    infer_time = infer_times['yolo'] * (size / 416) ** 2
+
+    def reshape(input_shapes):
+        net = yolo_network(next(iter(input_shapes.values()))[2])
+        net.batch_size = next(iter(input_shapes.values()))[0]
+        return net
+
+    return FakeIENetwork({'inputs': (1, 3, size, size)}, output_shapes, infer_time=infer_time,
+                         outputs_fn=batched_outputs(outputs_fn), batch_time=infer_time * batch_ratio,
+                         reshape_fn=reshape)
+
+
+def face_network():
+    return FakeIENetwork({'data': (1, 3, 384, 672)}, {'detection_out': (1, 1, 200, 7)},
+                         infer_time=infer_times['face'], outputs_fn=face_outputs_fn())
+
+
+def landmark_network(landmark_batch_size=4):
+    return FakeIENetwork({'0': (1, 3, 48, 48)}, {'landmarks': (1, 10, 1, 1)}, infer_time=infer_times['landmark'],
+                         outputs_fn=landmark_outputs_fn(landmark_batch_size))
+
+
+def road_pipeline(plugin):
+    net = road_network()
+    input_blob = next(iter(net.inputs))
+    out_blob = next(iter(net.outputs))
+    shape = net.inputs[input_blob].shape
+    frame_preprocessor = FramePreprocessor(shape)
+    road_postprocessor = RoadPostprocessor(output_scale=0.5)
+    exec_net = plugin.load(network=net, num_requests=num_requests)
+
+    def preprocess(frame, request):
+        frame_preprocessor(frame, request.inputs[input_blob])
+
+    def postprocess(outputs, frame):
+        return road_postprocessor.colorize(road_postprocessor.class_map(outputs[out_blob]))
+
+    def render(frame, mask):
+        road_postprocessor.blend(frame, mask)
+
+    return exec_net, preprocess, postprocess, render
+
+
+def face_pipeline(plugin, landmark_batch_size=4):
+    net = face_network()
+    landmark_net = landmark_network(landmark_batch_size)
+    input_blob = next(iter(net.inputs))
+    out_blob = next(iter(net.outputs))
+    lm_input_blob = next(iter(landmark_net.inputs))
+    lm_output_blob = next(iter(landmark_net.outputs))
+    shape = net.inputs[input_blob].shape
+    frame_preprocessor = FramePreprocessor(shape)
+    exec_net = plugin.load(network=net, num_requests=num_requests)
+    landmark_net.batch_size = landmark_batch_size
+    lm_exec_net = plugin.load(network=landmark_net)
+    lm_preprocess = FramePreprocessor(landmark_net.inputs[lm_input_blob].shape)
+
+    def preprocess(frame, request):
+        frame_preprocessor(frame, request.inputs[input_blob])
+
+    def postprocess(outputs, frame):
+        return detect_faces(outputs[out_blob], frame, lm_exec_net, lm_input_blob, lm_output_blob, lm_preprocess)
+
+    def render(frame, faces):
+        draw_faces(frame, faces)
+
+    return exec_net, preprocess, postprocess, render
+
+
+def yolo_pipeline(plugin):
+    net = yolo_network()
+    input_blob = next(iter(net.inputs))
+    shape = net.inputs[input_blob].shape
+    frame_preprocessor = FramePreprocessor(shape)
+    layers_params = {layer_name: net.layers[layer_name].params for layer_name in net.outputs}
+    labels_map = ['car' if i == 2 else str(i) for i in range(80)]
+    exec_net = plugin.load(network=net, num_requests=num_requests)
+
+    def preprocess(frame, request):
+        frame_preprocessor(frame, request.inputs[input_blob])
+
+    def postprocess(outputs, frame):
+        return detect_objects(outputs, layers_params, shape[2:], frame.shape[:-1])
+
+    def render(frame, objects):
+        draw_objects(frame, objects, labels_map)
+
+    return exec_net, preprocess, postprocess, render
+
+
+PIPELINES = OrderedDict([('road', road_pipeline), ('face', face_pipeline), ('yolo', yolo_pipeline)])
+
+
+def run_pipeline(exec_net, preprocess, postprocess, render):
+    # Same submission scheme as the demos: keep the request pool full and collect results in frame order
+    timings = StageTimes()
+    cap = SyntheticCapture(num_frames, frame_width, frame_height)
+    pool = AsyncRequestPool(exec_net)
+    end_of_stream = False
+    run_start = time.perf_counter()
+    while True:
+        if not end_of_stream and not pool.full():
+            start_time = time.perf_counter()
+            ret, frame = cap.read()
+            if ret:
+                timings.record('decode', time.perf_counter() - start_time)
+                start_time = time.perf_counter()
+                preprocess(frame, pool.next_request())
+                timings.record('preprocess', time.perf_counter() - start_time)
+                pool.submit(None, frame)
+            else:
+                end_of_stream = True
+        if pool.empty():
+            break
+        if not end_of_stream and not pool.full():
+            continue
+
+        start_time = time.perf_counter()
+        _, outputs, frame = pool.get()
+        timings.record('infer_wait', time.perf_counter() - start_time)
+        start_time = time.perf_counter()
+        results = postprocess(outputs, frame)
+        timings.record('postprocess', time.perf_counter() - start_time)
+        start_time = time.perf_counter()
+        render(frame, results)
+        timings.record('render', time.perf_counter() - start_time)
+    elapsed = time.perf_counter() - run_start
+    return OrderedDict([('fps', num_frames / elapsed), ('stages', timings.summary())])
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    output_path = sys.argv[1] if len(sys.argv) > 1 else result_file
+    report = OrderedDict([
+        ('commit', git_commit()),
+        ('time', time.strftime('%Y-%m-%dT%H:%M:%S')),
+        ('num_frames', num_frames),
+        ('num_requests', num_requests),
+        ('frame_size', [frame_width, frame_height]),
+        ('infer_times', infer_times),
+        ('pipelines', OrderedDict()),
+    ])
+    for name, build in PIPELINES.items():
+        result = run_pipeline(*build(FakeIEPlugin()))
+        report['pipelines'][name] = result
+        print("{}: {:.1f} FPS".format(name, result['fps']))
+        print("    {:<12} {:>10} {:>10} {:>10} {:>12}".format('stage', 'p50, ms', 'p95, ms', 'p99, ms', 'max FPS'))
+        for stage, stats in result['stages'].items():
+            print("    {:<12} {:>10.3f} {:>10.3f} {:>10.3f} {:>12.1f}".format(
+                stage, stats['p50_ms'], stats['p95_ms'], stats['p99_ms'], stats['throughput_fps'] or float('inf')))
+
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print("Results are written to {}".format(output_path))
+
+
+if __name__ == '__main__':
+    sys.exit(main() or 0)
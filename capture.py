@@ -0,0 +1,173 @@
+from __future__ import print_function, division
+
+import queue
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+
+class FrameReader:
+    """Decodes frames on a background thread into a ring of preallocated buffers.
+
+    read() is a drop-in replacement for cv2.VideoCapture.read(). The returned frame is a ring buffer, it stays valid
+    until `keep` more frames have been read, so keep must cover every frame the caller still uses (e.g. frames
+    waiting in an AsyncRequestPool). The decoder blocks when all other buffers are filled and not yet read.
+    index and timestamp of the last returned frame are available as frame_index and frame_time.
+
+    For live sources (live=True) the decoder never waits for the caller: when no buffer is free it overwrites the
+    oldest frame nobody has read yet, and read() returns the newest decoded frame, skipping older ones. Frames lost
+    either way are counted in `dropped`, frame_index keeps counting them.
+
+    get() answers the frame size, FPS and frame count from values read before the decoder starts; other properties
+    wait for the decoder to finish the frame it is reading, captures are not safe to use from two threads at once.
+    """
+
+    STATIC_PROPERTIES = (cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT, cv2.CAP_PROP_FPS,
+                         cv2.CAP_PROP_FRAME_COUNT)
+
+    def __init__(self, source, buffer_size=8, keep=1, live=False):
+        assert buffer_size > keep, "buffer_size should be larger than the number of frames kept by the caller"
+        # A live decoder needs a buffer to decode into while the newest frame waits to be read
+        assert not live or buffer_size > keep + 1, "live sources need two buffers besides the kept frames"
+        self._cap = source if hasattr(source, 'read') else cv2.VideoCapture(source)
+        self._properties = {prop_id: self._cap.get(prop_id) for prop_id in self.STATIC_PROPERTIES}
+        self._cap_lock = threading.Lock()
+        self.buffer_size = buffer_size
+        self.keep = keep
+        self.live = live
+        self.frame_index = -1
+        self.frame_time = None
+        self._buffers = [None] * buffer_size
+        self._free = queue.Queue()
+        for slot in range(buffer_size):
+            self._free.put(slot)
+        self._ready = queue.Queue()
+        self._held = deque()
+        self._overwritten = 0
+        self._skipped = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._decode, daemon=True)
+        self._thread.start()
+
+    def _decode(self):
+        index = 0
+        while not self._stopped.is_set():
+            slot = self._next_slot()
+            if slot is None:
+                continue
+            with self._cap_lock:
+                if self._buffers[slot] is None:
+                    ret, frame = self._cap.read()
+                else:
+                    ret, frame = self._cap.read(self._buffers[slot])
+            if not ret:
+                break
+            # Only the first frames and resolution changes allocate, later reads decode in place
+            self._buffers[slot] = frame
+            self._ready.put((slot, index, time.time()))
+            index += 1
+        self._ready.put(None)
+
+    def _next_slot(self):
+        if self.live:
+            try:
+                return self._free.get_nowait()
+            except queue.Empty:
+                pass
+            if self._ready.qsize() > 1:
+                try:
+                    slot = self._ready.get_nowait()[0]
+                    self._overwritten += 1
+                    return slot
+                except queue.Empty:
+                    pass
+        try:
+            return self._free.get(timeout=0.1)
+        except queue.Empty:
+            return None
+
+    @property
+    def dropped(self):
+        return self._overwritten + self._skipped
+
+    def read(self):
+        if len(self._held) >= self.keep:
+            self._free.put(self._held.popleft())
+        item = self._ready.get()
+        while self.live and item is not None:
+            try:
+                newer = self._ready.get_nowait()
+            except queue.Empty:
+                break
+            if newer is None:
+                self._ready.put(None)
+                break
+            self._free.put(item[0])
+            self._skipped += 1
+            item = newer
+        if item is None:
+            # End of stream stays signalled for every later read
+            self._ready.put(None)
+            return False, None
+        slot, self.frame_index, self.frame_time = item
+        self._held.append(slot)
+        return True, self._buffers[slot]
+
+    def ready(self):
+        # True when read() returns without waiting for the decoder, i.e. a frame or the end of the stream is queued
+        return not self._ready.empty()
+
+    def get(self, prop_id):
+        if prop_id in self._properties:
+            return self._properties[prop_id]
+        with self._cap_lock:
+            return self._cap.get(prop_id)
+
+    def isOpened(self):
+        with self._cap_lock:
+            return self._cap.isOpened()
+
+    def release(self):
+        self._stopped.set()
+        self._thread.join()
+        self._cap.release()
+
+
+class SyntheticCapture:
+    # cv2.VideoCapture look-alike producing num_frames deterministic frames with a moving box, used without video files
+    def __init__(self, num_frames=100, width=1280, height=720, fps=30.0, decode_time=0.0):
+        self.num_frames = num_frames
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.decode_time = decode_time
+        self._index = 0
+        self._opened = True
+
+    def read(self, image=None):
+        if not self._opened or self._index >= self.num_frames:
+            return False, None
+        if image is None or image.shape != (self.height, self.width, 3):
+            image = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        if self.decode_time:
+            time.sleep(self.decode_time)
+        image[:] = (self._index * 3) % 256
+        x = (self._index * 8) % max(self.width - self.width // 8, 1)
+        y = self.height // 3
+        image[y:y + self.height // 6, x:x + self.width // 8] = (0, 200, 0)
+        self._index += 1
+        return True, image
+
+    def get(self, prop_id):
+        return {cv2.CAP_PROP_FRAME_WIDTH: self.width, cv2.CAP_PROP_FRAME_HEIGHT: self.height,
+                cv2.CAP_PROP_FPS: self.fps, cv2.CAP_PROP_FRAME_COUNT: self.num_frames,
+                cv2.CAP_PROP_POS_FRAMES: self._index}.get(prop_id, 0)
+
+    def isOpened(self):
+        return self._opened
+
+    def release(self):
+        self._opened = False
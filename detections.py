@@ -0,0 +1,229 @@
+"""
+Detections of one frame in a NumPy structured array instead of a dict per box.
+
+    python detections.py    allocations and memory of the YOLO path for crowded scenes, dicts against records, and
+                            the time of the steps that take the boxes as arrays or write them out
+"""
+from __future__ import print_function, division
+
+import sys
+
+import numpy as np
+
+BOX_FIELDS = ('xmin', 'ymin', 'xmax', 'ymax')
+# Key order of the dicts written by the demos, optional fields are left out when absent
+DICT_FIELDS = ('xmin', 'xmax', 'ymin', 'ymax', 'class_id', 'track_id', 'confidence')
+
+
+def detection_dtype(track_id=False, landmarks=False):
+    fields = [(name, np.int32) for name in BOX_FIELDS] + [('class_id', np.int32), ('confidence', np.float32)]
+    if track_id:
+        fields.append(('track_id', np.int32))
+    if landmarks:
+        # Five (x, y) points normalized to the box, NaN for boxes without landmarks
+        fields.append(('landmarks', np.float32, (5, 2)))
+    return np.dtype(fields)
+
+
+class Detections:
+    """Boxes of one frame, one record of a structured array per box.
+
+    Every record has xmin, ymin, xmax, ymax (int32 pixels), class_id (int32) and confidence (float32), optionally
+    track_id and landmarks (see detection_dtype). Fields read as arrays (detections.xmin, detections.boxes);
+    indexing with a slice, boolean mask or index array returns Detections, an integer index returns the record.
+    Validation, filtering and serialization are vectorized, so a frame costs a handful of arrays however crowded it
+    is. to_dicts() gives the per-box dicts the result files have always contained.
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    @classmethod
+    def empty(cls, size=0, track_id=False, landmarks=False):
+        data = np.zeros(size, dtype=detection_dtype(track_id, landmarks))
+        if landmarks:
+            data['landmarks'] = np.nan
+        return cls(data)
+
+    @classmethod
+    def from_arrays(cls, xmin, ymin, xmax, ymax, class_id, confidence, track_id=None, landmarks=None):
+        detections = cls.empty(len(xmin), track_id is not None, landmarks is not None)
+        data = detections.data
+        # Coordinates of degenerate boxes saturate instead of wrapping around
+        info = np.iinfo(np.int32)
+        for name, values in zip(BOX_FIELDS, (xmin, ymin, xmax, ymax)):
+            data[name] = np.clip(values, info.min, info.max)
+        data['class_id'] = class_id
+        data['confidence'] = confidence
+        if track_id is not None:
+            data['track_id'] = track_id
+        if landmarks is not None:
+            data['landmarks'] = landmarks
+        return detections
+
+    @classmethod
+    def from_dicts(cls, objects):
+        return cls.from_arrays(*[[obj[name] for obj in objects] for name in BOX_FIELDS + ('class_id', 'confidence')],
+                               track_id=[obj['track_id'] for obj in objects]
+                               if objects and 'track_id' in objects[0] else None)
+
+    @classmethod
+    def concatenate(cls, parts):
+        parts = [part for part in parts if len(part)]
+        if len(parts) == 1:
+            return parts[0]
+        return cls(np.concatenate([part.data for part in parts])) if parts else cls.empty()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return self.data[index]
+        return Detections(self.data[index])
+
+    def __getattr__(self, name):
+        data = self.__dict__.get('data')
+        if data is not None and name in data.dtype.names:
+            return data[name]
+        raise AttributeError(name)
+
+    def has(self, field):
+        return field in self.data.dtype.names
+
+    @property
+    def boxes(self):
+        # (N, 4) array of xmin, ymin, xmax, ymax
+        return np.stack([self.data[name] for name in BOX_FIELDS], axis=1) if len(self.data) else \
+            np.empty((0, 4), dtype=np.int32)
+
+    def inside(self, width, height, strict=False):
+        # Boxes within the frame; strict excludes boxes touching the border
+        if strict:
+            return (self.xmin > 0) & (self.ymin > 0) & (self.xmax < width) & (self.ymax < height)
+        return (self.xmin >= 0) & (self.ymin >= 0) & (self.xmax <= width) & (self.ymax <= height)
+
+    def clip(self, width, height):
+        data = self.data.copy()
+        for name, limit in zip(BOX_FIELDS, (width, height, width, height)):
+            np.clip(data[name], 0, limit, out=data[name])
+        return Detections(data)
+
+    def filter(self, min_confidence=None, class_ids=None):
+        mask = np.ones(len(self.data), dtype=bool)
+        if min_confidence is not None:
+            mask &= self.confidence >= min_confidence
+        if class_ids is not None:
+            mask &= np.isin(self.class_id, list(class_ids))
+        return Detections(self.data[mask])
+
+    def with_field(self, name, values):
+        # Copy with an optional field (track_id or landmarks) added or replaced
+        names = self.data.dtype.names
+        detections = Detections.empty(len(self), track_id=name == 'track_id' or 'track_id' in names,
+                                      landmarks=name == 'landmarks' or 'landmarks' in names)
+        for field in names:
+            detections.data[field] = self.data[field]
+        detections.data[name] = values
+        return detections
+
+    def labels(self, labels_map):
+        return [class_label(class_id, labels_map) for class_id in self.class_id.tolist()]
+
+    def to_dicts(self, with_labels=False, labels_map=None):
+        # Landmarks are left out, see face_utils.face_records()
+        fields = [name for name in DICT_FIELDS if name in self.data.dtype.names]
+        columns = [self.data[name].tolist() for name in fields]
+        objects = [dict(zip(fields, values)) for values in zip(*columns)]
+        if with_labels:
+            for obj, label in zip(objects, self.labels(labels_map)):
+                obj['label'] = label
+        return objects
+
+    def tobytes(self):
+        return self.data.tobytes()
+
+    @classmethod
+    def frombytes(cls, buffer, track_id=False, landmarks=False):
+        return cls(np.frombuffer(buffer, dtype=detection_dtype(track_id, landmarks)).copy())
+
+    def __repr__(self):
+        return "Detections({})".format(self.to_dicts())
+
+
+def class_label(class_id, labels_map):
+    return labels_map[class_id] if labels_map and len(labels_map) > class_id else str(class_id)
+
+
+# ----------------------------------------------------- Benchmark ------------------------------------------------------
+def benchmark(num_objects=(20, 200, 1000), repeats=20):
+    # Crowded stub YOLO outputs through parse, NMS and confidence filter, with the per-box dicts of the previous
+    # implementation rebuilt from the records; tracemalloc gives the peak memory of one frame and the number of
+    # memory blocks its result keeps alive
+    import time
+    import tracemalloc
+
+    from benchmark import yolo_outputs_fn
+    from nms import nms
+    from yolo_parser import detect_objects, parse_yolo_output
+
+    def dict_path(outputs):
+        objects = parse_yolo_output(outputs, layers, (416, 416), (720, 1280), 0.5).to_dicts()
+        boxes = [(obj['xmin'], obj['ymin'], obj['xmax'], obj['ymax']) for obj in objects]
+        keep = nms(boxes, [obj['confidence'] for obj in objects], [obj['class_id'] for obj in objects], 0.5)
+        return [obj for obj in (objects[i] for i in keep) if obj['confidence'] >= 0.5]
+
+    def record_path(outputs):
+        return detect_objects(outputs, layers, (416, 416), (720, 1280))
+
+    print("{:>8} {:>7} | {:>9} {:>9} | {:>9} {:>9} | {:>9} {:>9}".format(
+        "objects", "boxes", "dicts ms", "recs ms", "dicts KiB", "recs KiB", "dicts blk", "recs blk"))
+    for n in num_objects:
+        outputs = yolo_outputs_fn(num_objects=n)(None)
+        layers = {name: {} for name in outputs}
+        timings = list()
+        peaks = list()
+        blocks = list()
+        for path in (dict_path, record_path):
+            start_time = time.time()
+            for _ in range(repeats):
+                path(outputs)
+            timings.append((time.time() - start_time) / repeats * 1e3)
+            tracemalloc.start()
+            result = path(outputs)
+            # Peak memory of the frame and the memory blocks its result keeps alive
+            peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+            blocks.append(sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename')))
+            tracemalloc.stop()
+        print("{:>8} {:>7} | {:>9.2f} {:>9.2f} | {:>9.1f} {:>9.1f} | {:>9} {:>9}".format(
+            n, len(result), timings[0], timings[1], peaks[0], peaks[1], blocks[0], blocks[1]))
+
+    # Per step, parse output of 1000 objects: the NMS and tracker inputs (boxes, scores and class ids as arrays), the
+    # confidence filter and the JSON Lines record of a frame, which needs dicts again
+    import json
+
+    objects = parse_yolo_output(yolo_outputs_fn(num_objects=num_objects[-1])(None), layers, (416, 416), (720, 1280),
+                                0.5)
+    dicts = objects.to_dicts()
+    steps = [
+        ("nms/tracker input", lambda: (np.array([[obj[name] for name in BOX_FIELDS] for obj in dicts]),
+                                       np.array([obj['confidence'] for obj in dicts]),
+                                       np.array([obj['class_id'] for obj in dicts])),
+         lambda: (objects.boxes, objects.confidence, objects.class_id)),
+        ("confidence filter", lambda: [obj for obj in dicts if obj['confidence'] >= 0.6],
+         lambda: objects.filter(min_confidence=0.6)),
+        ("json record", lambda: json.dumps(dicts), lambda: json.dumps(objects.to_dicts())),
+    ]
+    print("\n{:>18} {:>9} {:>9}   ({} boxes)".format("step", "dicts ms", "recs ms", len(objects)))
+    for name, dict_step, record_step in steps:
+        step_timings = list()
+        for step in (dict_step, record_step):
+            start_time = time.time()
+            for _ in range(repeats * 10):
+                step()
+            step_timings.append((time.time() - start_time) / (repeats * 10) * 1e3)
+        print("{:>18} {:>9.3f} {:>9.3f}".format(name, step_timings[0], step_timings[1]))
+
+
+if __name__ == '__main__':
+    sys.exit(benchmark() or 0)
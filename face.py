@@ -1,9 +1,21 @@
 ﻿import sys
-import numpy as np
 import cv2
 import time
+import numpy as np
 import logging as log
-from openvino.inference_engine import IENetwork, IEPlugin
+from collections import deque
+from openvino.inference_engine import IEPlugin
+
+from capture import FrameReader
+from face_utils import parse_face_detections, infer_landmarks, face_records, draw_faces, LandmarkCache
+from latency_budget import LatencyBudget
+from model_cache import NetworkCache, UnsupportedLayersError
+from motion_gate import MotionGate
+from preprocess import FramePreprocessor
+from render_stage import RenderStage
+from request_pool import AsyncRequestPool
+from result_writer import JsonLinesWriter
+from telemetry import Telemetry
 
 cpu_extension = "./models/cpu_extension.dll"
 plugin_dir = r"C:\Program Files (x86)\IntelSWTools\openvino\deployment_tools\inference_engine\bin\intel64\Release"
@@ -14,9 +26,38 @@ model_bin = "./models/face-detection-adas-0001.bin"
 # landmark
 landmark_xml = "./models/landmarks-regression-retail-0009.xml"
 landmark_bin = "./models/landmarks-regression-retail-0009.bin"
+# 网络加载缓存目录, 按模型文件哈希、设备和扩展库缓存层检查结果(设备支持时也缓存编译好的网络), None表示不缓存
+model_cache_dir = "./model_cache"
 
 code = 0  # "./input/face.avi"
 is_async_mode = True
+num_requests = 4
+prefetch_frames = 8
+landmark_batch_size = 4
+# 关键点缓存: 人脸框与上一帧的IoU不低于landmark_cache_iou时复用关键点, 同一结果最多复用landmark_cache_max_age帧,
+# 为0时每帧都推理
+landmark_cache_iou = 0.9
+landmark_cache_max_age = 30
+# 无界面模式: 不绘制不显示, 人脸框和关键点(像素坐标)按帧写入JSON Lines文件
+headless = False
+result_file = "./faces.jsonl"
+# 渲染线程: 画图、显示或写视频在单独的线程上进行, 不占用推理循环; output_video非空时标注后的画面写入该视频文件, 不显示
+output_video = None
+# 渲染线程跟不上时: 'drop'丢弃新的帧, 'block'等待; None表示写视频时等待(每帧都写入), 显示时丢弃
+render_policy = None
+render_queue = 4
+# 运动门限: 缩小后的灰度图与上次推理的帧平均相差不到motion_threshold个灰度级时不推理, 沿用上次的结果, 0表示每帧
+# 都推理; 至少每motion_refresh_every帧推理一次
+motion_threshold = 0
+motion_refresh_every = 30
+# 实时模式: 摄像头不排队, 总是处理最新的帧; 从采集到出结果超过latency_budget秒的帧被丢弃, 持续超时先不做关键点,
+# 仍然超时再隔帧推理
+live = False
+latency_budget = 0.15
+# 运行指标: metrics_port非空时在该端口提供Prometheus文本格式的/metrics, metrics_file非空时每metrics_interval秒写一次JSON
+metrics_port = None
+metrics_file = None
+metrics_interval = 5.0
 
 
 def face_landmark_demo():
@@ -26,28 +67,19 @@ def face_landmark_demo():
     plugin = IEPlugin(device="CPU", plugin_dirs=plugin_dir)
     plugin.add_cpu_extension(cpu_extension)
 
-    # LUT
-    lut = []
-    lut.append((0, 0, 255))
-    lut.append((255, 0, 0))
-    lut.append((0, 255, 0))
-    lut.append((0, 255, 255))
-    lut.append((255, 0, 255))
-
-    # Read IR
-    log.info("Reading IR...")
-    net = IENetwork(model=model_xml, weights=model_bin)
-    landmark_net = IENetwork(model=landmark_xml, weights=landmark_bin)
-
-    if plugin.device == "CPU":
-        supported_layers = plugin.get_supported_layers(net)
-        not_supported_layers = [l for l in net.layers.keys() if l not in supported_layers]
-        if len(not_supported_layers) != 0:
-            log.error("Following layers are not supported by the plugin for specified device {}:\n {}".
-                      format(plugin.device, ', '.join(not_supported_layers)))
-            log.error("Please try to specify cpu extensions library path in demo's command line parameters using -l "
-                      "or --cpu_extension command line argument")
-            sys.exit(1)
+    # 读取IR并加载到插件, 缓存命中时跳过层检查
+    log.info("Loading IR to the plugin...")
+    cache = NetworkCache(plugin, model_cache_dir, cpu_extension)
+    try:
+        exec_net, net = cache.load(model_xml, model_bin, num_requests)
+        # 关键点网络按批推理, 一帧内的人脸一次提交
+        lm_exec_net, landmark_net = cache.load(landmark_xml, landmark_bin, batch_size=landmark_batch_size)
+    except UnsupportedLayersError as e:
+        log.error(str(e))
+        log.error("Please try to specify cpu extensions library path in demo's command line parameters using -l "
+                  "or --cpu_extension command line argument")
+        sys.exit(1)
+    log.info(cache.report())
     assert len(net.inputs.keys()) == 1, "Demo supports only single input topologies"
     assert len(net.outputs) == 1, "Demo supports only single output topologies"
 
@@ -58,108 +90,179 @@ def face_landmark_demo():
     lm_input_blob = next(iter(landmark_net.inputs))
     lm_output_blob = next(iter(landmark_net.outputs))
 
-    log.info("Loading IR to the plugin...")
-    exec_net = plugin.load(network=net, num_requests=2)
-    lm_exec_net = plugin.load(network=landmark_net)
     # Read and pre-process input image
     n, c, h, w = net.inputs[input_blob].shape
-    mn, mc, mh, mw = landmark_net.inputs[lm_input_blob].shape
+    lm_preprocess = FramePreprocessor(landmark_net.inputs[lm_input_blob].shape)
 
     # 释放网络
     del net
     del landmark_net
 
-    cap = cv2.VideoCapture(code)
-
-    cur_request_id = 0
-    next_request_id = 1
+    # 不推理的帧不占用推理请求, 等待处理的帧最多为推理请求数的两倍
+    max_pending = 2 * num_requests
+    # 后台线程解码, 推理循环只从环形缓冲区取帧
+    cap = FrameReader(code, max(prefetch_frames, max_pending + 3), keep=max_pending + 1, live=live)
 
     log.info("Starting inference in async mode...")
     log.info("To switch between sync and async modes press Tab button")
     log.info("To stop the demo execution press Esc button")
 
-    render_time = 0
-    ret, frame = cap.read()
+    end_of_stream = False
+    pool = AsyncRequestPool(exec_net, num_requests if is_async_mode else 1)
+    preprocess = FramePreprocessor((n, c, h, w))
+    result_writer = JsonLinesWriter(result_file) if headless else None
+    lm_cache = LandmarkCache(landmark_cache_iou, landmark_cache_max_age)
+    gate = MotionGate(motion_threshold, motion_refresh_every)
+    budget = LatencyBudget(latency_budget) if live else None
+    telemetry = Telemetry('face').export(metrics_port, metrics_file, metrics_interval)
+    telemetry.watch('dropped', lambda: cap.dropped)
+    if budget is not None:
+        telemetry.watch('dropped', lambda: sum(budget.dropped.values()))
+    telemetry.watch('reused', lambda: gate.skipped)
+
+    def render(frame, result):
+        # 在渲染线程上执行
+        faces, messages = result
+        if faces is None:
+            return frame
+        draw_faces(frame, faces)
+
+        inf_time_message, render_time_message, async_mode_message = messages
+        cv2.putText(frame, inf_time_message, (15, 15), cv2.FONT_HERSHEY_COMPLEX, 0.5, (200, 10, 10), 1)
+        cv2.putText(frame, render_time_message, (15, 30), cv2.FONT_HERSHEY_COMPLEX, 0.5, (10, 10, 200), 1)
+        cv2.putText(frame, async_mode_message, (10, int(frame.shape[0] - 20)), cv2.FONT_HERSHEY_COMPLEX, 0.5,
+                    (10, 10, 200), 1)
+        return frame
+
+    renderer = None if headless else RenderStage(render, None if output_video else "face detection", output_video,
+                                                 cap.get(cv2.CAP_PROP_FPS) or 25.0, max_queue=render_queue,
+                                                 policy=render_policy)
+    if renderer is not None:
+        telemetry.watch('dropped', lambda: renderer.dropped)
+    pending = deque()
+    result = None
+    cur_request_id = None
+    num_frames = 0
+    run_start = time.time()
+    last_result_time = None
 
     print("To close the application, press 'CTRL+C' or any key with focus on the output window")
-    while cap.isOpened():
-        if is_async_mode:
+    while True:
+        # 异步模式下保持多个推理请求同时执行, 同步模式下只有一个
+        if not end_of_stream and not pool.full() and len(pending) < max_pending and \
+                (not live or not pending or cap.ready()):
+            capture_start = time.time()
             ret, next_frame = cap.read()
-        else:
-            ret, frame = cap.read()
-        if not ret:
+            telemetry.observe('capture', time.time() - capture_start)
+            if ret:
+                # 实时模式下已经赶不上期限的帧直接丢弃, 再取更新的帧
+                if budget is not None and not budget.admit(cap.frame_time):
+                    continue
+                # 与上次推理的帧相比几乎没有变化时不推理
+                infer = gate.changed(next_frame)
+                if infer:
+                    # 缩放后直接写入下一个推理请求的输入blob
+                    preprocess_start = time.time()
+                    preprocess(next_frame, pool.next_request().inputs[input_blob])
+                    telemetry.observe('preprocess', time.time() - preprocess_start)
+                    pool.submit(None)
+                pending.append((infer, next_frame, cap.frame_index, time.time(), cap.frame_time))
+            else:
+                end_of_stream = True
+        if not pending:
             break
+        if not end_of_stream and not pool.full() and len(pending) < max_pending:
+            # 实时模式下不等推理请求占满, 最早的结果一出来就处理
+            if not live or (pending[0][0] and not pool.ready(1)):
+                continue
         initial_w = cap.get(3)
         initial_h = cap.get(4)
 
-        # 开启同步或者异步执行模式
-        inf_start = time.time()
-        if is_async_mode:
-            in_frame = cv2.resize(next_frame, (w, h))
-            in_frame = in_frame.transpose((2, 0, 1))  # Change data layout from HWC to CHW
-            in_frame = in_frame.reshape((n, c, h, w))
-            exec_net.start_async(request_id=next_request_id, inputs={input_blob: in_frame})
-        else:
-            in_frame = cv2.resize(frame, (w, h))
-            in_frame = in_frame.transpose((2, 0, 1))  # Change data layout from HWC to CHW
-            in_frame = in_frame.reshape((n, c, h, w))
-            exec_net.start_async(request_id=cur_request_id, inputs={input_blob: in_frame})
-        if exec_net.requests[cur_request_id].wait(-1) == 0:
-            # 获取网络输出
-            res = exec_net.requests[cur_request_id].outputs[out_blob]
-
-            # 解析DetectionOut
-            for obj in res[0][0]:
-                if obj[2] > 0.5:
-                    xmin = int(obj[3] * initial_w)
-                    ymin = int(obj[4] * initial_h)
-                    xmax = int(obj[5] * initial_w)
-                    ymax = int(obj[6] * initial_h)
-                    if xmin > 0 and ymin > 0 and (xmax < initial_w) and (ymax < initial_h):
-                        roi = frame[ymin:ymax, xmin:xmax, :]
-                        rh, rw = roi.shape[:2]
-                        face_roi = cv2.resize(roi, (mw, mh))
-                        face_roi = face_roi.transpose((2, 0, 1))
-                        face_roi = face_roi.reshape((mn, mc, mh, mw))
-                        lm_exec_net.infer(inputs={'0': face_roi})
-                        landmark_res = lm_exec_net.requests[0].outputs[lm_output_blob]
-                        landmark_res = np.reshape(landmark_res, (5, 2))
-                        for m in range(len(landmark_res)):
-                            x = landmark_res[m][0] * rw
-                            y = landmark_res[m][1] * rh
-                            cv2.circle(roi, (np.int32(x), np.int32(y)), 3, lut[m], 2, 8, 0)
-                    cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (0, 0, 255), 2, 8, 0)
+        # 按顺序处理最早的帧, 推理的帧按提交顺序取回推理结果, 其余帧沿用上次的结果
+        infer, frame, frame_index, inf_start, capture_time = pending.popleft()
+        num_frames += 1
+        telemetry.count('frames')
+        if infer:
+            wait_start = time.time()
+            cur_request_id, outputs, _ = pool.get()
+            result_time = time.time()
+            telemetry.observe('queue_wait', result_time - wait_start)
+            telemetry.observe('inference', result_time - inf_start)
+            result = None
+            if outputs is not None:
+                # 获取网络输出
+                res = outputs[out_blob]
+
+                # 解析DetectionOut, 先收集整帧完整位于画面内的人脸ROI
+                faces = parse_face_detections(res, initial_w, initial_h)
+                face_ids = np.flatnonzero(faces.inside(initial_w, initial_h, strict=True))
+
+                # 超时降级时不做关键点
+                if budget is not None and not budget.optional:
+                    face_ids = face_ids[:0]
+
+                # 缓存未命中的人脸一起做关键点推理, 再画回各自的ROI
+                face_boxes = faces.boxes[face_ids]
+                landmarks, missing = lm_cache.lookup(face_boxes)
+                if missing:
+                    rois = [frame[ymin:ymax, xmin:xmax, :] for xmin, ymin, xmax, ymax in face_boxes[missing].tolist()]
+                    landmarks[missing] = infer_landmarks(lm_exec_net, lm_input_blob, lm_output_blob, rois,
+                                                         lm_preprocess)
+                    lm_cache.store(face_boxes[missing], landmarks[missing])
+                faces.landmarks[face_ids] = landmarks
+                result = faces
+                telemetry.count('detections', len(faces))
+            telemetry.observe('postprocess', time.time() - result_time)
+            gate.record(time.time() - inf_start)
+            if budget is not None:
+                budget.record(capture_time, inf_start)
+        output_start = time.time()
+        messages = None
+        if result is not None:
+            faces = result
+            if headless:
+                result_writer.write(frame_index, faces=face_records(faces))
+                telemetry.observe('render', time.time() - output_start)
+                continue
 
             inf_end = time.time()
             det_time = inf_end - inf_start
+            # FPS按相邻两帧结果的时间间隔计算
+            fps = 1 / (inf_end - last_result_time) if last_result_time else 0
+            last_result_time = inf_end
             # Draw performance stats
-            inf_time_message = "Inference time: {:.3f} ms, FPS:{:.3f}".format(det_time * 1000,
-                                                                              1000 / (det_time * 1000 + 1))
-            render_time_message = "OpenCV rendering time: {:.3f} ms".format(render_time * 1000)
+            inf_time_message = "Inference time: {:.3f} ms, FPS:{:.3f}".format(det_time * 1000, fps)
+            render_time_message = "OpenCV rendering time: {:.3f} ms".format(renderer.render_time * 1000)
             async_mode_message = "Async mode is on. Processing request {}".format(cur_request_id) if is_async_mode else \
                 "Async mode is off. Processing request {}".format(cur_request_id)
+            messages = inf_time_message, render_time_message, async_mode_message
 
-            cv2.putText(frame, inf_time_message, (15, 15), cv2.FONT_HERSHEY_COMPLEX, 0.5, (200, 10, 10), 1)
-            cv2.putText(frame, render_time_message, (15, 30), cv2.FONT_HERSHEY_COMPLEX, 0.5, (10, 10, 200), 1)
-            cv2.putText(frame, async_mode_message, (10, int(initial_h - 20)), cv2.FONT_HERSHEY_COMPLEX, 0.5,
-                        (10, 10, 200), 1)
-
-        #
-        render_start = time.time()
-        cv2.imshow("face detection", frame)
-        render_end = time.time()
-        render_time = render_end - render_start
+        if headless:
+            continue
 
-        if is_async_mode:
-            cur_request_id, next_request_id = next_request_id, cur_request_id
-            frame = next_frame
+        # 画图、显示或写视频交给渲染线程
+        renderer.submit(frame, (result, messages))
+        telemetry.observe('render', time.time() - output_start)
 
-        key = cv2.waitKey(1)
+        key = renderer.key()
         if key == 27:
             break
 
     # 释放资源
-    cv2.destroyAllWindows()
+    log.info("Processed {} frames in {:.3f} s".format(num_frames, time.time() - run_start))
+    log.info("Motion gate: {}".format(gate.summary()))
+    if budget is not None:
+        log.info("Live: {}, {} stale frames dropped by the capture".format(budget.summary(), cap.dropped))
+    log.info("Landmark cache: {} hits, {} misses, hit rate {:.1%}".format(lm_cache.hits, lm_cache.misses,
+                                                                           lm_cache.hit_rate()))
+    log.info("Telemetry: {}".format(telemetry.summary()))
+    telemetry.close()
+    cap.release()
+    if headless:
+        result_writer.close()
+    else:
+        renderer.close()
+        log.info("Render: {}".format(renderer.summary()))
     del exec_net
     del lm_exec_net
     del plugin
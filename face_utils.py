@@ -0,0 +1,137 @@
+import cv2
+import numpy as np
+
+from detections import Detections
+from nms import box_iou
+
+# LUT
+LANDMARK_COLORS = [(0, 0, 255), (255, 0, 0), (0, 255, 0), (0, 255, 255), (255, 0, 255)]
+
+
+def parse_face_detections(res, initial_w, initial_h, threshold=0.5):
+    # 解析DetectionOut, 返回所有置信度大于阈值的人脸(Detections, 关键点为NaN);
+    # 完整位于画面内、需要做关键点检测的人脸由faces.inside(initial_w, initial_h, strict=True)选出
+    rows = res[0][0]
+    rows = rows[rows[:, 2] > threshold]
+    coords = np.trunc(rows[:, 3:7] * np.array([initial_w, initial_h, initial_w, initial_h], dtype=rows.dtype))
+    return Detections.from_arrays(coords[:, 0], coords[:, 1], coords[:, 2], coords[:, 3], rows[:, 1], rows[:, 2],
+                                  landmarks=np.full((len(rows), 5, 2), np.nan, dtype=np.float32))
+
+
+def infer_landmarks(lm_exec_net, lm_input_blob, lm_output_blob, rois, lm_preprocess):
+    # 人脸数超过batch大小时分块推理, ROI直接写入推理请求的输入blob, 返回每个ROI的5个归一化关键点
+    request = lm_exec_net.requests[0]
+    lm_batch = request.inputs[lm_input_blob]
+    batch_size = lm_batch.shape[0]
+    landmarks = np.empty((len(rois), 5, 2), dtype=np.float32)
+    for start in range(0, len(rois), batch_size):
+        chunk = rois[start:start + batch_size]
+        for i, roi in enumerate(chunk):
+            lm_preprocess(roi, lm_batch, i)
+        request.infer()
+        res = request.outputs[lm_output_blob]
+        landmarks[start:start + len(chunk)] = np.reshape(res, (batch_size, 5, 2))[:len(chunk)]
+    return landmarks
+
+
+def detect_faces(res, frame, lm_exec_net, lm_input_blob, lm_output_blob, lm_preprocess, threshold=0.5):
+    # 解析人脸检测结果, 完整位于画面内的人脸做关键点检测, 其余人脸的关键点为NaN
+    h, w = frame.shape[:2]
+    faces = parse_face_detections(res, w, h, threshold)
+    inside = faces.inside(w, h, strict=True)
+    rois = [frame[ymin:ymax, xmin:xmax, :] for xmin, ymin, xmax, ymax in faces.boxes[inside].tolist()]
+    faces.landmarks[inside] = infer_landmarks(lm_exec_net, lm_input_blob, lm_output_blob, rois, lm_preprocess)
+    return faces
+
+
+def landmarks_to_frame(face_boxes, landmarks):
+    # 归一化关键点转换为原图像素坐标
+    boxes = np.asarray(face_boxes, dtype=np.float32).reshape(-1, 4)
+    return landmarks * (boxes[:, None, 2:] - boxes[:, None, :2]) + boxes[:, None, :2]
+
+
+def has_landmarks(faces):
+    return ~np.isnan(faces.landmarks[:, 0, 0])
+
+
+def face_records(faces):
+    # 做了关键点检测的人脸: 人脸框和像素坐标关键点, 用于写结果文件
+    faces = faces[has_landmarks(faces)]
+    boxes = faces.boxes
+    return [dict(box=box, landmarks=points)
+            for box, points in zip(boxes.tolist(), landmarks_to_frame(boxes, faces.landmarks).tolist())]
+
+
+def draw_faces(frame, faces):
+    # 关键点画回各自的ROI, 最后画人脸框
+    with_landmarks = faces[has_landmarks(faces)]
+    for (xmin, ymin, xmax, ymax), landmark_res in zip(with_landmarks.boxes.tolist(), with_landmarks.landmarks):
+        roi = frame[ymin:ymax, xmin:xmax, :]
+        rh, rw = roi.shape[:2]
+        for m in range(len(landmark_res)):
+            x = landmark_res[m][0] * rw
+            y = landmark_res[m][1] * rh
+            cv2.circle(roi, (np.int32(x), np.int32(y)), 3, LANDMARK_COLORS[m], 2, 8, 0)
+    for xmin, ymin, xmax, ymax in faces.boxes.tolist():
+        cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), (0, 0, 255), 2, 8, 0)
+
+
+class LandmarkCache:
+    """人脸关键点缓存, 人脸框基本不动时复用上次的推理结果.
+
+    lookup()把当前帧的人脸框按IoU与缓存的人脸框配对, IoU不低于iou_threshold即命中, 返回命中的归一化关键点和未命中的
+    人脸序号; 未命中的人脸推理后用store()存入. 比较的始终是推理时的人脸框, 缓慢移动不会累积误差. 结果最多复用
+    max_age帧, 连续max_missed帧没有配对的缓存被淘汰, 超过max_entries时淘汰最久未配对的. max_age为0时不缓存.
+    hits/misses统计命中和推理的人脸数.
+    """
+
+    def __init__(self, iou_threshold=0.9, max_age=30, max_missed=2, max_entries=16):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.max_missed = max_missed
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._frame = 0
+        # 每项为[人脸框, 关键点, 推理时的帧号, 最近配对的帧号]
+        self._entries = list()
+
+    def lookup(self, face_boxes):
+        self._frame += 1
+        self._entries = [entry for entry in self._entries
+                         if self._frame - entry[2] <= self.max_age and self._frame - entry[3] <= self.max_missed + 1]
+        landmarks = np.empty((len(face_boxes), 5, 2), dtype=np.float32)
+        # 贪心配对, IoU最大的先配
+        pairs = list()
+        if self._entries and len(face_boxes):
+            cached_boxes = np.array([entry[0] for entry in self._entries], dtype=np.float64)
+            for i, box in enumerate(face_boxes):
+                ious = box_iou(np.asarray(box, dtype=np.float64), cached_boxes)
+                pairs += [(ious[j], i, j) for j in np.flatnonzero(ious >= self.iou_threshold)]
+        pairs.sort(key=lambda pair: -pair[0])
+        found = set()
+        used = set()
+        for _, i, j in pairs:
+            if i in found or j in used:
+                continue
+            landmarks[i] = self._entries[j][1]
+            self._entries[j][3] = self._frame
+            found.add(i)
+            used.add(j)
+        missing = [i for i in range(len(face_boxes)) if i not in found]
+        self.hits += len(found)
+        self.misses += len(missing)
+        return landmarks, missing
+
+    def store(self, face_boxes, landmarks):
+        if self.max_age <= 0:
+            return
+        for box, points in zip(face_boxes, landmarks):
+            self._entries.append([tuple(box), np.array(points), self._frame, self._frame])
+        if len(self._entries) > self.max_entries:
+            self._entries.sort(key=lambda entry: entry[3])
+            del self._entries[:len(self._entries) - self.max_entries]
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
@@ -0,0 +1,203 @@
+"""
+Driver-assist pipeline: road segmentation, YOLOv3 vehicle detection and face landmarks on the same video.
+
+Every frame is decoded once and handed to all stages. Each stage runs on its own thread with its own request pool,
+so the models infer concurrently, and the results are joined per frame index before the frame is rendered.
+
+    python fanout.py              run the demo with the models configured in road.py, yoloV3.py and face.py
+    python fanout.py benchmark    compare fan-out and one-after-another processing on the stub engine
+"""
+from __future__ import print_function, division
+
+import queue
+import sys
+import time
+from collections import OrderedDict
+
+import cv2
+
+from capture import FrameReader
+
+code = r"C:\Users\lin\Videos\ruanjianbei.mp4"
+num_requests = 4
+prefetch_frames = 8
+# Frames decoded but not yet joined, this bounds how far the fastest stage runs ahead of the slowest one
+max_pending_frames = 8
+output_scale = 0.5
+# Headless mode skips drawing and display, the joined results are dropped after counting
+headless = False
+
+
+class FanOutPipeline:
+    """Decodes a source once and fans every frame out to several stages (see stages.Stage).
+
+    get() returns (frame index, frame, {stage name: result}) in frame order once every stage has finished the frame,
+    and None at the end of the stream. The frame stays valid until the next get().
+    """
+
+    def __init__(self, source, stages, max_pending_frames=8, prefetch_frames=8):
+        self.stages = list(stages)
+        self.max_pending_frames = max_pending_frames
+        self.reader = FrameReader(source, max(prefetch_frames, max_pending_frames + 2), keep=max_pending_frames + 1)
+        self._results = queue.Queue()
+        self._frames = [queue.Queue() for _ in self.stages]
+        self._threads = [stage.start(frames, self._results) for stage, frames in zip(self.stages, self._frames)]
+        self._pending = OrderedDict()
+        self._end_of_stream = False
+
+    def _fan_out(self):
+        while not self._end_of_stream and len(self._pending) < self.max_pending_frames:
+            ret, frame = self.reader.read()
+            if not ret:
+                self._end_of_stream = True
+                for frames in self._frames:
+                    frames.put(None)
+                break
+            frame_index = self.reader.frame_index
+            self._pending[frame_index] = (frame, dict())
+            for frames in self._frames:
+                frames.put((frame_index, frame))
+
+    def get(self):
+        while True:
+            self._fan_out()
+            if not self._pending:
+                return None
+            frame_index, (frame, results) = next(iter(self._pending.items()))
+            if len(results) == len(self.stages):
+                del self._pending[frame_index]
+                return frame_index, frame, results
+            name, result_index, result = self._results.get()
+            if result_index is None:
+                raise RuntimeError("Stage {} failed: {}".format(name, result))
+            self._pending[result_index][1][name] = result
+
+    def render(self, frame, results):
+        # Stages draw in the order they were given, a stage may return a new frame (e.g. the blended road mask)
+        for stage in self.stages:
+            if results[stage.name] is not None:
+                frame = stage.render(frame, results[stage.name])
+        return frame
+
+    def release(self):
+        if not self._end_of_stream:
+            self._end_of_stream = True
+            for frames in self._frames:
+                frames.put(None)
+        for thread in self._threads:
+            thread.join()
+        self.reader.release()
+
+
+def build_stages(plugin):
+    from openvino.inference_engine import IENetwork
+    from stages import road_stage, yolo_stage, face_stage
+    import face
+    import road
+    import yoloV3
+
+    with open(yoloV3.labels, 'r') as f:
+        labels_map = [x.strip() for x in f]
+    return [
+        road_stage(plugin, IENetwork(model=road.model_xml, weights=road.model_bin), num_requests),
+        yolo_stage(plugin, IENetwork(model=yoloV3.yolo_model_xml, weights=yoloV3.yolo_model_bin), num_requests,
+                   labels_map, iou_threshold=yoloV3.iou_threshold, class_agnostic=yoloV3.class_agnostic_nms,
+                   top_k=yoloV3.nms_top_k),
+        face_stage(plugin, IENetwork(model=face.model_xml, weights=face.model_bin),
+                   IENetwork(model=face.landmark_xml, weights=face.landmark_bin), num_requests,
+                   face.landmark_batch_size),
+    ]
+
+
+def run(pipeline):
+    num_frames = 0
+    run_start = time.time()
+    while True:
+        result = pipeline.get()
+        if result is None:
+            break
+        frame_index, frame, results = result
+        num_frames += 1
+        if headless:
+            continue
+        frame = pipeline.render(frame, results)
+        fps = num_frames / (time.time() - run_start)
+        cv2.putText(frame, "FPS: {:.3f}".format(fps), (15, 15), cv2.FONT_HERSHEY_COMPLEX, 0.5, (200, 10, 10), 1)
+        cv2.imshow("driver assist demo", cv2.resize(frame, (0, 0), fx=output_scale, fy=output_scale))
+        key = cv2.waitKey(1)
+        if key == 27:
+            break
+    pipeline.release()
+    if not headless:
+        cv2.destroyAllWindows()
+    return num_frames, time.time() - run_start
+
+
+def main():
+    from openvino.inference_engine import IEPlugin
+    import road
+
+    plugin = IEPlugin(device="CPU", plugin_dirs=road.plugin_dir)
+    plugin.add_cpu_extension(road.cpu_extension)
+    pipeline = FanOutPipeline(code, build_stages(plugin), max_pending_frames, prefetch_frames)
+    num_frames, elapsed = run(pipeline)
+    print("Processed {} frames in {:.3f} s".format(num_frames, elapsed))
+
+
+def benchmark(num_frames=100):
+    # All three stub models on the same synthetic frames: every stage in turn on one thread, decoding and resizing
+    # per model as the separate demos do, against one decode fanned out to concurrently running stages
+    import benchmark as stub_models
+    from capture import SyntheticCapture
+    from request_pool import AsyncRequestPool
+    from stages import road_stage, yolo_stage, face_stage
+    from stub_engine import FakeIEPlugin
+
+    def build():
+        plugin = FakeIEPlugin()
+        return [road_stage(plugin, stub_models.road_network(), num_requests),
+                yolo_stage(plugin, stub_models.yolo_network(), num_requests),
+                face_stage(plugin, stub_models.face_network(), stub_models.landmark_network())]
+
+    start_time = time.time()
+    for stage in build():
+        cap = FrameReader(SyntheticCapture(num_frames), prefetch_frames, keep=num_requests + 1)
+        pool = AsyncRequestPool(stage.exec_net)
+        end_of_stream = False
+        while True:
+            if not end_of_stream and not pool.full():
+                ret, frame = cap.read()
+                if ret:
+                    stage.preprocess(frame, pool.next_request())
+                    pool.submit(None, frame)
+                else:
+                    end_of_stream = True
+            if pool.empty():
+                break
+            if not end_of_stream and not pool.full():
+                continue
+            _, outputs, frame = pool.get()
+            stage.render(frame, stage.postprocess(outputs, frame))
+        cap.release()
+    sequential_fps = num_frames / (time.time() - start_time)
+
+    pipeline = FanOutPipeline(SyntheticCapture(num_frames), build(), max_pending_frames, prefetch_frames)
+    start_time = time.time()
+    expected_index = 0
+    while True:
+        result = pipeline.get()
+        if result is None:
+            break
+        frame_index, frame, results = result
+        assert frame_index == expected_index, "Joined results are out of order"
+        expected_index += 1
+        pipeline.render(frame, results)
+    pipeline.release()
+    fanout_fps = num_frames / (time.time() - start_time)
+
+    print("one model after another: {:.1f} FPS".format(sequential_fps))
+    print("fan-out:                 {:.1f} FPS".format(fanout_fps))
+
+
+if __name__ == '__main__':
+    sys.exit((benchmark() if len(sys.argv) > 1 and sys.argv[1] == 'benchmark' else main()) or 0)
@@ -0,0 +1,90 @@
+from __future__ import print_function, division
+
+import time
+from collections import deque
+
+import numpy as np
+
+
+class LatencyBudget:
+    """End-to-end latency budget of a live pipeline, from frame capture to the displayed result.
+
+    admit(capture_time) is asked before a frame is submitted: a frame whose age plus the expected processing time
+    already exceeds the budget is dropped, a fresher frame will make it. record(capture_time, submit_time) takes every
+    result. When results keep missing the budget (degrade_after in a row) the pipeline degrades one level, when they
+    keep arriving well within it (recover_after in a row under recover_ratio * budget) it recovers one level:
+
+        0 (full)           everything runs
+        1 (no landmarks)   optional work is skipped, ask `optional`
+        2 (half rate)      additionally only every other admitted frame is inferred
+
+    The percentiles of summary() cover the latencies of the last `window` results, so a pipeline running without end
+    keeps a bounded history.
+    """
+
+    LEVELS = ('full', 'no landmarks', 'half rate')
+
+    def __init__(self, budget=0.15, degrade_after=5, recover_after=30, recover_ratio=0.6, smoothing=0.2,
+                 window=3000):
+        self.budget = budget
+        self.degrade_after = degrade_after
+        self.recover_after = recover_after
+        self.recover_ratio = recover_ratio
+        self.smoothing = smoothing
+        self.level = 0
+        self.dropped = dict(deadline=0, degraded=0)
+        self.latencies = deque(maxlen=window)
+        self.processing_time = None
+        self._over = 0
+        self._under = 0
+        self._odd = False
+
+    @property
+    def optional(self):
+        return self.level == 0
+
+    def admit(self, capture_time, now=None):
+        now = time.time() if now is None else now
+        processing_time = self.processing_time or 0.0
+        # When processing alone takes longer than the budget no frame can make it, degrading has to help instead
+        if processing_time < self.budget and now - capture_time + processing_time > self.budget:
+            self.dropped['deadline'] += 1
+            return False
+        if self.level >= 2:
+            self._odd = not self._odd
+            if self._odd:
+                self.dropped['degraded'] += 1
+                return False
+        return True
+
+    def record(self, capture_time, submit_time, now=None):
+        now = time.time() if now is None else now
+        latency = now - capture_time
+        self.latencies.append(latency)
+        processing_time = now - submit_time
+        self.processing_time = processing_time if self.processing_time is None else \
+            (1 - self.smoothing) * self.processing_time + self.smoothing * processing_time
+        if latency > self.budget:
+            self._over += 1
+            self._under = 0
+            if self._over >= self.degrade_after and self.level < len(self.LEVELS) - 1:
+                self.level += 1
+                self._over = 0
+        else:
+            self._over = 0
+            self._under = self._under + 1 if latency < self.recover_ratio * self.budget else 0
+            if self._under >= self.recover_after and self.level > 0:
+                self.level -= 1
+                self._under = 0
+        return latency
+
+    def percentiles(self, q=(50, 90, 99)):
+        if not self.latencies:
+            return [0.0] * len(q)
+        return np.percentile(list(self.latencies), q).tolist()
+
+    def summary(self):
+        p50, p90, p99 = self.percentiles()
+        return "latency p50 {:.1f} ms, p90 {:.1f} ms, p99 {:.1f} ms, dropped {} past the deadline, {} degraded, " \
+               "level {}".format(p50 * 1e3, p90 * 1e3, p99 * 1e3, self.dropped['deadline'], self.dropped['degraded'],
+                                 self.LEVELS[self.level])
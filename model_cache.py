@@ -0,0 +1,267 @@
+"""
+On-disk cache for loading networks, to cut the start-up time of the demos.
+
+A cold start parses the IR, checks every layer against the plugin and compiles the network. NetworkCache.load()
+remembers the result of the layer check and what the demos read from the parsed network (input and output shapes,
+output layer params), and exports the compiled network when the plugin supports it (ExecutableNetwork.export and
+import_network, e.g. MYRIAD/HDDL; the CPU plugin of the IEPlugin API compiles on every start). A warm start then
+skips the layer check and, with a compiled blob, the parse and the compile as well.
+
+Entries are keyed by the SHA-256 of the .xml and .bin files, the device, the extension library, the batch size and
+the input shapes of a reshaped network, so every input size of a network has an entry of its own.
+A changed model, a corrupt entry or a blob the plugin refuses to import falls back to a cold load, which rewrites
+the entry.
+
+    python model_cache.py    cold against warm start of the demo networks on a stub plugin with slow compilation
+"""
+from __future__ import print_function, division
+
+import hashlib
+import json
+import os
+import sys
+import time
+
+# Bump when the layout of the entries changes, older entries are then ignored
+CACHE_VERSION = 1
+
+
+class UnsupportedLayersError(RuntimeError):
+    def __init__(self, device, layers):
+        super(UnsupportedLayersError, self).__init__(
+            "Following layers are not supported by the plugin for specified device {}:\n {}".format(
+                device, ', '.join(layers)))
+        self.device = device
+        self.layers = layers
+
+
+class _Port:
+    def __init__(self, shape):
+        self.shape = list(shape)
+
+
+class _Layer:
+    def __init__(self, params):
+        self.params = dict(params)
+
+
+class NetworkInfo:
+    # The parts of an IENetwork the demos read after loading, restored from a cache entry without parsing the IR
+    def __init__(self, inputs, outputs, layers, batch_size=1):
+        self.inputs = {name: _Port(shape) for name, shape in inputs.items()}
+        self.outputs = {name: _Port(shape) for name, shape in outputs.items()}
+        self.layers = {name: _Layer(params) for name, params in layers.items()}
+        self.batch_size = batch_size
+
+    @staticmethod
+    def describe(net):
+        return dict(inputs={name: list(port.shape) for name, port in net.inputs.items()},
+                    outputs={name: list(port.shape) for name, port in net.outputs.items()},
+                    layers={name: dict(net.layers[name].params) for name in net.outputs if name in net.layers},
+                    batch_size=net.batch_size)
+
+
+def read_ir(model_xml, model_bin):
+    from openvino.inference_engine import IENetwork
+    return IENetwork(model=model_xml, weights=model_bin)
+
+
+class NetworkCache:
+    """Loads networks through `plugin`, caching under cache_dir (None disables the cache).
+
+    load(model_xml, model_bin, num_requests, batch_size, input_shapes) returns (exec_net, net), net being the parsed
+    IENetwork on a cold load and a NetworkInfo when the compiled network was imported; input_shapes ({input name:
+    NCHW shape}) reshapes the network before it is compiled. It raises UnsupportedLayersError when the
+    CPU plugin does not support every layer. read_network(model_xml, model_bin) parses an IR. Every load is recorded
+    as (model name, 'cold' or 'warm', seconds, seconds of the last cold load) in `loads`, see report().
+    """
+
+    def __init__(self, plugin, cache_dir='./model_cache', extension=None, read_network=read_ir):
+        self.plugin = plugin
+        self.cache_dir = cache_dir
+        self.extension = extension
+        self.read_network = read_network
+        self.loads = list()
+        self._hashes = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    # ------------------------------------------------------ Keys ------------------------------------------------------
+    def _hash_index_path(self):
+        return os.path.join(self.cache_dir, 'hashes.json')
+
+    def file_hash(self, path):
+        # Hashing a large .bin takes a while, hashes are reused while size and modification time stay the same
+        if self._hashes is None:
+            self._hashes = self._read_json(self._hash_index_path()) or dict()
+        stat = os.stat(path)
+        abs_path = os.path.abspath(path)
+        known = self._hashes.get(abs_path)
+        if known and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2]
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+        self._hashes[abs_path] = [stat.st_size, stat.st_mtime_ns, sha.hexdigest()]
+        self._write_json(self._hash_index_path(), self._hashes)
+        return sha.hexdigest()
+
+    def key(self, model_xml, model_bin, batch_size=None, input_shapes=None):
+        extension = self.file_hash(self.extension) if self.extension and os.path.isfile(self.extension) else \
+            self.extension
+        key = dict(version=CACHE_VERSION, xml=self.file_hash(model_xml), bin=self.file_hash(model_bin),
+                   device=self.plugin.device, extension=extension, batch_size=batch_size)
+        if input_shapes is not None:
+            # Left out otherwise, the entries written before reshaping was supported stay valid
+            key['input_shapes'] = {name: list(shape) for name, shape in sorted(input_shapes.items())}
+        return key
+
+    # ---------------------------------------------------- Entries -----------------------------------------------------
+    @staticmethod
+    def _read_json(path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_json(path, data):
+        # Written next to the target and renamed, a crash never leaves a partial entry
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _entry_path(self, key):
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:32]
+        return os.path.join(self.cache_dir, digest + '.json'), os.path.join(self.cache_dir, digest + '.blob')
+
+    # ----------------------------------------------------- Loading ----------------------------------------------------
+    def check_layers(self, net):
+        if self.plugin.device != 'CPU':
+            return
+        supported_layers = self.plugin.get_supported_layers(net)
+        not_supported_layers = [l for l in net.layers.keys() if l not in supported_layers]
+        if not_supported_layers:
+            raise UnsupportedLayersError(self.plugin.device, not_supported_layers)
+
+    def _cold(self, model_xml, model_bin, num_requests, batch_size, input_shapes=None, check=True):
+        net = self.read_network(model_xml, model_bin)
+        if input_shapes is not None:
+            net.reshape(input_shapes)
+        if batch_size is not None:
+            net.batch_size = batch_size
+        if check:
+            self.check_layers(net)
+        return self.plugin.load(network=net, num_requests=num_requests), net
+
+    def load(self, model_xml, model_bin, num_requests=1, batch_size=None, input_shapes=None):
+        name = os.path.splitext(os.path.basename(model_xml))[0]
+        if input_shapes is not None:
+            name += ' ' + ','.join('x'.join(str(d) for d in shape[2:]) for shape in input_shapes.values())
+        start_time = time.time()
+        if not self.cache_dir:
+            exec_net, net = self._cold(model_xml, model_bin, num_requests, batch_size, input_shapes)
+            self.loads.append((name, 'cold', time.time() - start_time, None))
+            return exec_net, net
+
+        key = self.key(model_xml, model_bin, batch_size, input_shapes)
+        entry_path, blob_path = self._entry_path(key)
+        entry = self._read_json(entry_path)
+        if entry is not None and entry.get('key') == key:
+            if entry.get('blob') and os.path.isfile(blob_path) and hasattr(self.plugin, 'import_network'):
+                try:
+                    exec_net = self.plugin.import_network(blob_path, num_requests=num_requests)
+                except Exception:
+                    # A blob of another plugin version, load cold and export again
+                    pass
+                else:
+                    self.loads.append((name, 'warm', time.time() - start_time, entry['cold_time']))
+                    return exec_net, NetworkInfo(**entry['network'])
+            else:
+                # The layers passed the check for exactly these files, device and extension
+                exec_net, net = self._cold(model_xml, model_bin, num_requests, batch_size, input_shapes, check=False)
+                self.loads.append((name, 'warm', time.time() - start_time, entry['cold_time']))
+                return exec_net, net
+
+        exec_net, net = self._cold(model_xml, model_bin, num_requests, batch_size, input_shapes)
+        cold_time = time.time() - start_time
+        blob = False
+        if hasattr(exec_net, 'export') and hasattr(self.plugin, 'import_network'):
+            try:
+                exec_net.export(blob_path)
+                blob = True
+            except Exception:
+                pass
+        self._write_json(entry_path, dict(key=key, blob=blob, cold_time=cold_time, network=NetworkInfo.describe(net)))
+        self.loads.append((name, 'cold', cold_time, None))
+        return exec_net, net
+
+    def report(self):
+        lines = list()
+        for name, kind, seconds, cold_time in self.loads:
+            line = "{}: {} load {:.3f} s".format(name, kind, seconds)
+            if cold_time:
+                line += " (cold {:.3f} s)".format(cold_time)
+            lines.append(line)
+        return '; '.join(lines)
+
+
+# ----------------------------------------------------- Benchmark ------------------------------------------------------
+def benchmark(compile_time=1.0, layer_check_time=0.3, parse_time=0.2, cache_dir=None):
+    # The four demo networks as stub IR files; every "start" uses a fresh plugin and cache object, as a restarted
+    # process would. Parsing an IR, the layer check and compilation are simulated with sleeps, importing a compiled
+    # network takes a twentieth of compiling it
+    import shutil
+    import tempfile
+
+    import benchmark as stub_models
+    from stub_engine import FakeIEPlugin
+
+    factories = dict(road=stub_models.road_network, yolo=stub_models.yolo_network, face=stub_models.face_network,
+                     landmark=stub_models.landmark_network)
+    work_dir = tempfile.mkdtemp()
+    cache_dir = cache_dir or os.path.join(work_dir, 'cache')
+    models = list()
+    for name in factories:
+        model_xml, model_bin = os.path.join(work_dir, name + '.xml'), os.path.join(work_dir, name + '.bin')
+        with open(model_xml, 'w') as f:
+            f.write('<net name="{}"/>'.format(name))
+        with open(model_bin, 'wb') as f:
+            f.write(os.urandom(1 << 20))
+        models.append((model_xml, model_bin))
+
+    def read_network(model_xml, model_bin):
+        time.sleep(parse_time)
+        return factories[os.path.splitext(os.path.basename(model_xml))[0]]()
+
+    def start(plugin_kwargs):
+        cache = NetworkCache(FakeIEPlugin(**plugin_kwargs), cache_dir, read_network=read_network)
+        start_time = time.time()
+        for model_xml, model_bin in models:
+            cache.load(model_xml, model_bin, num_requests=4)
+        return time.time() - start_time, cache
+
+    timings = dict(compile_time=compile_time, import_time=compile_time / 20, layer_check_time=layer_check_time)
+    try:
+        for label, plugin_kwargs in (("compiled blob import", dict(timings)),
+                                     ("layer check only", dict(timings, exportable=False))):
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            os.makedirs(cache_dir)
+            cold, _ = start(plugin_kwargs)
+            warm, cache = start(plugin_kwargs)
+            assert all(kind == 'warm' for _, kind, _, _ in cache.loads), cache.report()
+            # A changed model file misses the cache, only that network is loaded cold again
+            with open(models[0][1], 'ab') as f:
+                f.write(b'\0')
+            changed, cache = start(plugin_kwargs)
+            print("{:<22} cold {:.2f} s, warm {:.2f} s, one model changed {:.2f} s ({})".format(
+                label, cold, warm, changed, ', '.join(kind for _, kind, _, _ in cache.loads)))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(benchmark() or 0)
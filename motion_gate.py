@@ -0,0 +1,62 @@
+from __future__ import print_function, division
+
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """Cheap pre-inference check whether a frame changed since the last frame that was inferred.
+
+    Frames are shrunk to `size` grayscale thumbnails; changed() returns False when the mean absolute difference to the
+    thumbnail of the last inferred frame stays below threshold (in gray levels), so the caller can reuse the last
+    results. Every refresh_every-th frame is inferred regardless, so results never go stale for longer. threshold 0
+    infers every frame. record(seconds) takes the processing time of inferred frames, time_saved() multiplies their
+    mean by the number of skipped frames.
+    """
+
+    def __init__(self, threshold=0.0, refresh_every=30, size=(64, 36)):
+        self.threshold = threshold
+        self.refresh_every = refresh_every
+        self.size = tuple(size)
+        self.processed = 0
+        self.skipped = 0
+        self._small = np.empty((self.size[1], self.size[0], 3), dtype=np.uint8)
+        self._thumbnails = [np.empty(self.size[::-1], dtype=np.uint8) for _ in range(2)]
+        self._diff = np.empty(self.size[::-1], dtype=np.uint8)
+        self._reference = None
+        self._skipped_in_row = 0
+        self._cost = 0.0
+        self._cost_samples = 0
+
+    def changed(self, frame):
+        if self.threshold > 0 and self._reference is not None and self._skipped_in_row + 1 < self.refresh_every:
+            thumbnail = self._thumbnails[1 - self._reference]
+            cv2.cvtColor(cv2.resize(frame, self.size, dst=self._small, interpolation=cv2.INTER_AREA),
+                         cv2.COLOR_BGR2GRAY, dst=thumbnail)
+            if cv2.absdiff(thumbnail, self._thumbnails[self._reference], dst=self._diff).mean() < self.threshold:
+                self.skipped += 1
+                self._skipped_in_row += 1
+                return False
+            self._reference = 1 - self._reference
+        elif self.threshold > 0:
+            self._reference = 0
+            cv2.cvtColor(cv2.resize(frame, self.size, dst=self._small, interpolation=cv2.INTER_AREA),
+                         cv2.COLOR_BGR2GRAY, dst=self._thumbnails[0])
+        self.processed += 1
+        self._skipped_in_row = 0
+        return True
+
+    def record(self, seconds):
+        self._cost += seconds
+        self._cost_samples += 1
+
+    def skip_ratio(self):
+        total = self.processed + self.skipped
+        return self.skipped / total if total else 0.0
+
+    def time_saved(self):
+        return self.skipped * self._cost / self._cost_samples if self._cost_samples else 0.0
+
+    def summary(self):
+        return "skipped {} of {} frames ({:.1%}), saved about {:.3f} s".format(
+            self.skipped, self.processed + self.skipped, self.skip_ratio(), self.time_saved())
@@ -0,0 +1,178 @@
+from __future__ import print_function, division
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import deque, OrderedDict
+
+import cv2
+
+from capture import FrameReader, SyntheticCapture
+from request_pool import RESULT_NOT_READY
+
+
+class _Stream:
+    def __init__(self, stream_id, source, prefetch_frames, max_in_flight):
+        self.stream_id = stream_id
+        self.source = source
+        # Frames of the requests in flight and the last returned result stay valid
+        self.reader = FrameReader(source, max(prefetch_frames, max_in_flight + 2), keep=max_in_flight + 1)
+        self.in_flight = deque()
+        self.finished = False
+        self.num_frames = 0
+        self.last_result_time = None
+
+    def done(self):
+        return self.finished and not self.in_flight
+
+
+class MultiStreamScheduler:
+    """Feeds the frames of several video sources into the infer requests of one executable network.
+
+    Free requests are handed out round-robin to the streams that have a decoded frame waiting, so a stream whose
+    decoder falls behind or that has ended never holds up the others, and max_in_flight_per_stream keeps a single
+    stream from occupying every request. preprocess(frame, request) fills the input blobs of the request in place.
+    get() returns the next finished result of any stream, streams take turns as well, and the results of one stream
+    always come in frame order. As with AsyncRequestPool the returned outputs and frame are only valid until the
+    next get().
+    """
+
+    def __init__(self, exec_net, sources, preprocess, prefetch_frames=8, max_in_flight_per_stream=None):
+        self.exec_net = exec_net
+        self.preprocess = preprocess
+        num_requests = len(exec_net.requests)
+        self.max_in_flight_per_stream = num_requests if max_in_flight_per_stream is None else \
+            min(max_in_flight_per_stream, num_requests)
+        self.streams = [_Stream(stream_id, source, prefetch_frames, self.max_in_flight_per_stream)
+                        for stream_id, source in enumerate(sources)]
+        self._free = deque(range(num_requests))
+        self._next_submit = 0
+        self._next_result = 0
+        self.start_time = time.time()
+
+    def _submit_ready_frames(self):
+        num_streams = len(self.streams)
+        idle = 0
+        while self._free and idle < num_streams:
+            stream = self.streams[self._next_submit]
+            self._next_submit = (self._next_submit + 1) % num_streams
+            if stream.finished or len(stream.in_flight) >= self.max_in_flight_per_stream or not stream.reader.ready():
+                idle += 1
+                continue
+            idle = 0
+            ret, frame = stream.reader.read()
+            if not ret:
+                stream.finished = True
+                continue
+            request_id = self._free.popleft()
+            self.preprocess(frame, self.exec_net.requests[request_id])
+            self.exec_net.start_async(request_id=request_id, inputs=None)
+            stream.in_flight.append((request_id, stream.reader.frame_index, frame))
+
+    def _wait(self, poll_interval):
+        heads = [stream.in_flight[0][0] for stream in self.streams if stream.in_flight]
+        if not heads:
+            # Every request is free, wait for the decoders
+            time.sleep(poll_interval)
+            return
+        # Any stream head will do. Without free requests nothing can be submitted anyway, otherwise come back soon to
+        # check the decoders
+        request = self.exec_net.requests[heads[0]]
+        request.wait(-1 if not self._free else int(poll_interval * 1000) or 1)
+
+    def get(self, poll_interval=0.002):
+        # Returns (stream_id, frame_index, frame, outputs), outputs is None when the request failed. None once every
+        # stream has ended
+        num_streams = len(self.streams)
+        while True:
+            self._submit_ready_frames()
+            for _ in range(num_streams):
+                stream = self.streams[self._next_result]
+                self._next_result = (self._next_result + 1) % num_streams
+                if not stream.in_flight:
+                    continue
+                request_id, frame_index, frame = stream.in_flight[0]
+                request = self.exec_net.requests[request_id]
+                status = request.wait(0)
+                if status == RESULT_NOT_READY:
+                    continue
+                stream.in_flight.popleft()
+                self._free.append(request_id)
+                stream.num_frames += 1
+                stream.last_result_time = time.time()
+                return stream.stream_id, frame_index, frame, request.outputs if status == 0 else None
+            if all(stream.done() for stream in self.streams):
+                return None
+            self._wait(poll_interval)
+
+    def stats(self):
+        # Frames and FPS of every stream since the scheduler was created, plus the aggregate of all streams
+        result = OrderedDict()
+        for stream in self.streams:
+            elapsed = (stream.last_result_time or self.start_time) - self.start_time
+            result[stream.stream_id] = dict(frames=stream.num_frames,
+                                            fps=stream.num_frames / elapsed if elapsed else 0.0)
+        end_times = [stream.last_result_time for stream in self.streams if stream.last_result_time]
+        elapsed = max(end_times) - self.start_time if end_times else 0
+        num_frames = sum(stream.num_frames for stream in self.streams)
+        result['total'] = dict(frames=num_frames, fps=num_frames / elapsed if elapsed else 0.0)
+        return result
+
+    def release(self):
+        for stream in self.streams:
+            stream.reader.release()
+
+
+def write_synthetic_video(path, num_frames, width=640, height=360, fps=30.0):
+    capture = SyntheticCapture(num_frames, width, height, fps)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+    while True:
+        ret, frame = capture.read()
+        if not ret:
+            break
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def benchmark(num_streams=4, num_frames=120, num_requests=4, infer_time=0.01, slow_decode_time=0.05):
+    # Several synthetic video files of different lengths plus one slowly decoding camera-like stream share one stub
+    # network; checks per-stream frame order and prints per-stream and aggregate FPS
+    from preprocess import FramePreprocessor
+    from stub_engine import FakeExecutableNetwork
+
+    shape = (1, 3, 256, 448)
+    exec_net = FakeExecutableNetwork({'out': (1, 4, 256, 448)}, num_requests=num_requests, infer_time=infer_time,
+                                     input_shapes={'data': shape})
+    frame_preprocessor = FramePreprocessor(shape)
+
+    def preprocess(frame, request):
+        frame_preprocessor(frame, request.inputs['data'])
+
+    video_dir = tempfile.mkdtemp()
+    try:
+        sources = [write_synthetic_video(os.path.join(video_dir, 'stream_{}.avi'.format(i)),
+                                         num_frames * (i + 1) // num_streams) for i in range(num_streams)]
+        sources.append(SyntheticCapture(num_frames // 4, 640, 360, decode_time=slow_decode_time))
+        scheduler = MultiStreamScheduler(exec_net, sources, preprocess)
+        next_index = [0] * len(sources)
+        while True:
+            result = scheduler.get()
+            if result is None:
+                break
+            stream_id, frame_index, frame, outputs = result
+            assert frame_index == next_index[stream_id], "Results of stream {} are out of order".format(stream_id)
+            next_index[stream_id] += 1
+        scheduler.release()
+    finally:
+        shutil.rmtree(video_dir)
+
+    print("{:>8} {:>8} {:>10}".format("stream", "frames", "FPS"))
+    for stream_id, stats in scheduler.stats().items():
+        print("{:>8} {:>8} {:>10.1f}".format(stream_id, stats['frames'], stats['fps']))
+
+
+if __name__ == '__main__':
+    sys.exit(benchmark() or 0)
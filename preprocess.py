@@ -0,0 +1,35 @@
+from __future__ import print_function, division
+
+import cv2
+import numpy as np
+
+
+class FramePreprocessor:
+    """Resizes BGR frames to the network input size and writes them as planar CHW data into an NCHW tensor.
+
+    The resize goes into a reusable HWC buffer and cv2.split writes its channels into reusable planes, which are then
+    copied (and converted to the tensor type) contiguously, so nothing is allocated per frame. Pass the input blob of
+    an infer request as `out` to fill it in place (this is what the Inference Engine does with an `inputs` dict in
+    start_async/infer); without `out` one of num_slots preallocated tensors is used round-robin, which keeps a tensor
+    intact for num_slots - 1 further calls.
+    """
+
+    def __init__(self, shape, num_slots=1, dtype=np.uint8):
+        self.shape = tuple(shape)
+        n, c, h, w = self.shape
+        self._resized = np.empty((h, w, c), dtype=np.uint8)
+        self._planes = list(np.empty((c, h, w), dtype=np.uint8))
+        self._tensors = [np.empty(self.shape, dtype=dtype) for _ in range(num_slots)]
+        self._slot = 0
+
+    def __call__(self, frame, out=None, batch_index=0):
+        n, c, h, w = self.shape
+        resized = cv2.resize(frame, (w, h), dst=self._resized)
+        if out is None:
+            out = self._tensors[self._slot]
+            self._slot = (self._slot + 1) % len(self._tensors)
+        # Change data layout from HWC to CHW
+        planes = cv2.split(resized, self._planes)
+        for channel, plane in enumerate(planes):
+            np.copyto(out[batch_index, channel], plane, casting='unsafe')
+        return out
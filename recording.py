@@ -0,0 +1,418 @@
+"""
+Record and replay of raw network outputs, to work on the post-processing without running inference.
+
+Record mode runs a pipeline (road, yolo or face) over a video and appends the output blobs of every frame to a data
+file, blob after blob; a JSON Lines index next to it (<recording>.index) keys them by source and frame index and also
+keeps the input/output shapes and layer params of the networks. Face frames additionally record the outputs of every
+landmark inference the frame needed. Replay mode memory-maps the data file and hands the recorded blobs to the same
+stage post-processing (stages.py) as the demos, with no plugin at all, so thresholds, NMS, segmentation colouring or
+landmark drawing can be changed and benchmarked at disk speed. Both modes can write the results in the format of the
+headless demos; replaying with unchanged parameters reproduces the results of the recording byte for byte.
+
+Recordings are append-only: recording another video (or the same one again) into an existing recording adds its
+frames, the latest record of a frame wins. Index records pointing past the end of the data file, e.g. after a crash,
+are ignored.
+
+    python recording.py record road|yolo|face <video> <recording> [result_file]
+    python recording.py replay road|yolo|face <recording> <video> [result_file]
+    python recording.py benchmark    record against replay of the stub pipelines
+"""
+from __future__ import print_function, division
+
+import json
+import os
+import sys
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+from capture import FrameReader
+from model_cache import NetworkInfo
+from request_pool import AsyncRequestPool
+
+num_requests = 4
+prefetch_frames = 8
+# Blobs start at multiples of this many bytes in the data file
+BLOB_ALIGNMENT = 64
+# Recorded networks of every pipeline, in the order the stages load them
+NETWORKS = OrderedDict([('road', ('road',)), ('yolo', ('yolo',)), ('face', ('face', 'landmark'))])
+result_extensions = dict(road='.rle', yolo='.jsonl', face='.jsonl')
+
+
+# ------------------------------------------------------- Storage ------------------------------------------------------
+class OutputRecorder:
+    """Appends output blobs to the data file `path` and their index records to path + '.index'.
+
+    write(source, frame_index, outputs) takes {network name: [outputs of every inference, each {blob name: array}]}.
+    add_network(name, net) records the shapes and layer params of a network (see model_cache.NetworkInfo).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._data = open(path, 'ab')
+        self._index = open(path + '.index', 'a')
+        # Records of earlier runs reaching beyond the current end of the data file were cut off by a crash, the data
+        # appended now must not be read as theirs
+        self._index.write(json.dumps(dict(data_size=self._data.tell())) + '\n')
+        self.num_frames = 0
+
+    def add_network(self, name, net):
+        self._index.write(json.dumps(dict(network=name, info=NetworkInfo.describe(net))) + '\n')
+
+    def _write_blob(self, blob):
+        blob = np.ascontiguousarray(blob)
+        offset = self._data.tell()
+        padding = -offset % BLOB_ALIGNMENT
+        if padding:
+            self._data.write(b'\0' * padding)
+            offset += padding
+        self._data.write(blob.data)
+        return [blob.dtype.str, list(blob.shape), offset]
+
+    def write(self, source, frame_index, outputs):
+        record = {name: [{blob_name: self._write_blob(blob) for blob_name, blob in call.items()} for call in calls]
+                  for name, calls in outputs.items()}
+        self._index.write(json.dumps(dict(source=source, frame=frame_index, outputs=record)) + '\n')
+        self.num_frames += 1
+
+    def close(self):
+        # The data goes to disk before the index that refers to it
+        self._data.close()
+        self._index.close()
+
+
+class OutputReplay:
+    """Recorded outputs of `path`, read through a memory map of the data file.
+
+    outputs(source, frame_index) returns {network name: [{blob name: array}, ...]} in the order of inference; the
+    arrays are read-only views of the memory map, nothing is copied. network(name) returns the recorded network as a
+    NetworkInfo, which the stage builders accept in place of an IENetwork.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        size = os.path.getsize(path)
+        self._data = np.memmap(path, dtype=np.uint8, mode='r') if size else np.empty(0, dtype=np.uint8)
+        self._networks = dict()
+        self._frames = dict()
+        with open(path + '.index', 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if 'network' in record:
+                    self._networks[record['network']] = record['info']
+                elif 'data_size' in record:
+                    self._drop_beyond(record['data_size'])
+                else:
+                    self._frames.setdefault(record['source'], dict())[record['frame']] = record['outputs']
+        self._drop_beyond(size)
+
+    @staticmethod
+    def _end(outputs):
+        return max([offset + np.dtype(dtype).itemsize * int(np.prod(shape))
+                    for calls in outputs.values() for call in calls for dtype, shape, offset in call.values()] or [0])
+
+    def _drop_beyond(self, size):
+        for frames in self._frames.values():
+            for frame_index in [i for i, outputs in frames.items() if self._end(outputs) > size]:
+                del frames[frame_index]
+
+    def sources(self):
+        return sorted(self._frames)
+
+    def frames(self, source):
+        return sorted(self._frames.get(source, ()))
+
+    def network(self, name):
+        return NetworkInfo(**self._networks[name])
+
+    def _blob(self, dtype, shape, offset):
+        dtype = np.dtype(dtype)
+        return self._data[offset:offset + dtype.itemsize * int(np.prod(shape))].view(dtype).reshape(shape)
+
+    def outputs(self, source, frame_index):
+        return {name: [{blob_name: self._blob(*blob) for blob_name, blob in call.items()} for call in calls]
+                for name, calls in self._frames[source][frame_index].items()}
+
+    def __len__(self):
+        return sum(len(frames) for frames in self._frames.values())
+
+
+# ------------------------------------------------- Recording networks -------------------------------------------------
+class _RecordingRequest:
+    # Infer request whose synchronous infer() calls keep a copy of their outputs; outputs of asynchronous requests are
+    # recorded by the driver when it collects them
+    def __init__(self, request, calls):
+        self._request = request
+        self._calls = calls
+        self.inputs = request.inputs
+
+    @property
+    def outputs(self):
+        return self._request.outputs
+
+    def async_infer(self, inputs=None):
+        self._request.async_infer(inputs)
+
+    def wait(self, timeout=None):
+        return self._request.wait(timeout)
+
+    def infer(self, inputs=None):
+        self._request.infer(inputs)
+        self._calls.append({name: np.array(blob) for name, blob in self._request.outputs.items()})
+
+
+class _RecordingNetwork:
+    def __init__(self, exec_net):
+        self._exec_net = exec_net
+        self.calls = list()
+        self.requests = [_RecordingRequest(request, self.calls) for request in exec_net.requests]
+
+    def start_async(self, request_id, inputs=None):
+        self._exec_net.start_async(request_id=request_id, inputs=inputs)
+
+    def take(self):
+        calls = list(self.calls)
+        del self.calls[:]
+        return calls
+
+
+class RecordingPlugin:
+    # Wraps a plugin for the stage builders; the networks they load are named after `names` in load order and
+    # recorded with the recorder
+    def __init__(self, plugin, recorder, names):
+        self.plugin = plugin
+        self.recorder = recorder
+        self.names = names
+        self.loaded = list()
+
+    def load(self, network, num_requests=1):
+        self.recorder.add_network(self.names[len(self.loaded)], network)
+        exec_net = _RecordingNetwork(self.plugin.load(network=network, num_requests=num_requests))
+        self.loaded.append(exec_net)
+        return exec_net
+
+
+# --------------------------------------------------- Replay networks --------------------------------------------------
+class _ReplayRequest:
+    def __init__(self, exec_net, input_shapes):
+        self._exec_net = exec_net
+        self.inputs = {name: np.zeros(shape, dtype=np.float32) for name, shape in input_shapes.items()}
+        self.outputs = dict()
+
+    def async_infer(self, inputs=None):
+        if not self._exec_net.pending:
+            raise RuntimeError("The recording has no further outputs for this frame, the post-processing runs more "
+                               "inferences than were recorded")
+        self.outputs = self._exec_net.pending.popleft()
+
+    def wait(self, timeout=None):
+        return 0
+
+    def infer(self, inputs=None):
+        self.async_infer(inputs)
+
+
+class ReplayNetwork:
+    # Stands in for an executable network: every inference returns the next outputs handed to feed()
+    def __init__(self, net, num_requests=1):
+        self.pending = deque()
+        input_shapes = {name: port.shape for name, port in net.inputs.items()}
+        self.requests = [_ReplayRequest(self, input_shapes) for _ in range(num_requests)]
+
+    def feed(self, calls):
+        self.pending.clear()
+        self.pending.extend(calls)
+
+    def start_async(self, request_id, inputs=None):
+        self.requests[request_id].async_infer(inputs)
+
+
+class ReplayPlugin:
+    def __init__(self):
+        self.loaded = list()
+
+    def load(self, network, num_requests=1):
+        exec_net = ReplayNetwork(network, num_requests)
+        self.loaded.append(exec_net)
+        return exec_net
+
+
+# ------------------------------------------------------- Pipelines ----------------------------------------------------
+def load_networks(pipeline, stub):
+    # Plugin, networks (in NETWORKS order) and labels of a pipeline; the stub networks need no OpenVINO installation
+    if stub:
+        import benchmark
+        from stub_engine import FakeIEPlugin
+        builders = dict(road=benchmark.road_network, yolo=benchmark.yolo_network, face=benchmark.face_network,
+                        landmark=benchmark.landmark_network)
+        return FakeIEPlugin(), [builders[name]() for name in NETWORKS[pipeline]], None
+
+    from openvino.inference_engine import IENetwork, IEPlugin
+    import face
+    import road
+    import yoloV3
+    models = dict(road=(road.model_xml, road.model_bin), yolo=(yoloV3.yolo_model_xml, yoloV3.yolo_model_bin),
+                  face=(face.model_xml, face.model_bin), landmark=(face.landmark_xml, face.landmark_bin))
+    plugin = IEPlugin(device=yoloV3.device if pipeline == 'yolo' else 'CPU', plugin_dirs=road.plugin_dir)
+    plugin.add_cpu_extension(road.cpu_extension)
+    return plugin, [IENetwork(model=models[name][0], weights=models[name][1]) for name in NETWORKS[pipeline]], \
+        read_labels() if pipeline == 'yolo' else None
+
+
+def read_labels():
+    import yoloV3
+    with open(yoloV3.labels, 'r') as f:
+        return [x.strip() for x in f]
+
+
+def make_stage(pipeline, plugin, nets, labels_map=None, **params):
+    # params are handed to the stage builder, e.g. prob_threshold or iou_threshold of the YOLO stage
+    from stages import road_stage, yolo_stage, face_stage
+    if pipeline == 'road':
+        return road_stage(plugin, nets[0], num_requests, **params)
+    if pipeline == 'yolo':
+        return yolo_stage(plugin, nets[0], num_requests, labels_map, **params)
+    return face_stage(plugin, nets[0], nets[1], num_requests, **params)
+
+
+def make_writer(pipeline, path, labels_map=None):
+    # Writes results in the format of the headless demos; returns write(frame_index, result) and close()
+    from face_utils import face_records
+    from result_writer import JsonLinesWriter, MaskWriter
+    if pipeline == 'road':
+        writer = MaskWriter(path)
+        return writer.write, writer.close
+    writer = JsonLinesWriter(path)
+    if pipeline == 'yolo':
+        return lambda frame_index, objects: writer.write(
+            frame_index, objects=objects.to_dicts(with_labels=True, labels_map=labels_map)), writer.close
+    return lambda frame_index, faces: writer.write(frame_index, faces=face_records(faces)), writer.close
+
+
+# ------------------------------------------------------- Drivers ------------------------------------------------------
+def record(pipeline, source, path, result_file=None, stub=False, **params):
+    plugin, nets, labels_map = load_networks(pipeline, stub)
+    recorder = OutputRecorder(path)
+    plugin = RecordingPlugin(plugin, recorder, NETWORKS[pipeline])
+    stage = make_stage(pipeline, plugin, nets, labels_map, **params)
+    main_name, sync_names = NETWORKS[pipeline][0], NETWORKS[pipeline][1:]
+    write, close = make_writer(pipeline, result_file, labels_map) if result_file else (None, None)
+    reader = FrameReader(source, prefetch_frames, keep=num_requests + 1)
+    pool = AsyncRequestPool(stage.exec_net)
+    end_of_stream = False
+    try:
+        while True:
+            if not end_of_stream and not pool.full():
+                ret, frame = reader.read()
+                if ret:
+                    stage.preprocess(frame, pool.next_request())
+                    pool.submit(None, (reader.frame_index, frame))
+                else:
+                    end_of_stream = True
+            if pool.empty():
+                break
+            if not end_of_stream and not pool.full():
+                continue
+            _, outputs, (frame_index, frame) = pool.get()
+            if outputs is None:
+                continue
+            result = stage.postprocess(outputs, frame)
+            calls = {main_name: [outputs]}
+            calls.update((name, exec_net.take()) for name, exec_net in zip(sync_names, plugin.loaded[1:]))
+            recorder.write(source, frame_index, calls)
+            if write:
+                write(frame_index, result)
+    finally:
+        reader.release()
+        recorder.close()
+        if close:
+            close()
+    return recorder.num_frames
+
+
+def replay(pipeline, path, source, result_file=None, labels_map=None, **params):
+    # Decodes the recorded frames of source and runs the stage post-processing on their recorded outputs
+    recording = OutputReplay(path)
+    plugin = ReplayPlugin()
+    names = NETWORKS[pipeline]
+    stage = make_stage(pipeline, plugin, [recording.network(name) for name in names], labels_map, **params)
+    write, close = make_writer(pipeline, result_file, labels_map) if result_file else (None, None)
+    frame_indices = recording.frames(source)
+    reader = FrameReader(source, prefetch_frames)
+    num_frames = 0
+    try:
+        for frame_index in frame_indices:
+            while reader.frame_index < frame_index:
+                ret, frame = reader.read()
+                if not ret:
+                    return num_frames
+            calls = recording.outputs(source, frame_index)
+            for name, exec_net in zip(names[1:], plugin.loaded[1:]):
+                exec_net.feed(calls[name])
+            result = stage.postprocess(calls[names[0]][0], frame)
+            if write:
+                write(frame_index, result)
+            num_frames += 1
+    finally:
+        reader.release()
+        if close:
+            close()
+    return num_frames
+
+
+# ----------------------------------------------------- Benchmark ------------------------------------------------------
+def benchmark(num_frames=60):
+    # Every stub pipeline is recorded once and replayed; replay has to reproduce the results of the recording
+    import shutil
+    import tempfile
+
+    from multistream import write_synthetic_video
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        video_path = write_synthetic_video(os.path.join(work_dir, 'video.avi'), num_frames, 1280, 720)
+        print("{:>8} {:>12} {:>12} {:>10} {:>14}".format("pipeline", "record FPS", "replay FPS", "speedup",
+                                                          "recording MiB"))
+        for pipeline in NETWORKS:
+            path = os.path.join(work_dir, pipeline + '.outputs')
+            recorded_file = os.path.join(work_dir, 'recorded' + result_extensions[pipeline])
+            replayed_file = os.path.join(work_dir, 'replayed' + result_extensions[pipeline])
+            start_time = time.time()
+            frames = record(pipeline, video_path, path, recorded_file, stub=True)
+            record_fps = frames / (time.time() - start_time)
+            start_time = time.time()
+            replayed = replay(pipeline, path, video_path, replayed_file)
+            replay_fps = replayed / (time.time() - start_time)
+            assert replayed == frames
+            with open(recorded_file, 'rb') as recorded, open(replayed_file, 'rb') as replayed:
+                assert recorded.read() == replayed.read(), "Replay does not reproduce the recorded results"
+            print("{:>8} {:>12.1f} {:>12.1f} {:>9.1f}x {:>14.1f}".format(
+                pipeline, record_fps, replay_fps, replay_fps / record_fps, os.path.getsize(path) / 2 ** 20))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        return benchmark()
+    if len(sys.argv) < 5 or sys.argv[1] not in ('record', 'replay') or sys.argv[2] not in NETWORKS:
+        print(__doc__)
+        return 1
+    mode, pipeline = sys.argv[1:3]
+    result_file = sys.argv[5] if len(sys.argv) > 5 else None
+    start_time = time.time()
+    if mode == 'record':
+        num_frames = record(pipeline, sys.argv[3], sys.argv[4], result_file)
+    else:
+        labels_map = read_labels() if pipeline == 'yolo' else None
+        num_frames = replay(pipeline, sys.argv[3], sys.argv[4], result_file, labels_map)
+    print("{} {} frames in {:.3f} s".format("Recorded" if mode == 'record' else "Replayed", num_frames,
+                                             time.time() - start_time))
+
+
+if __name__ == '__main__':
+    sys.exit(main() or 0)
@@ -0,0 +1,229 @@
+"""
+Render stage of the demos: annotation, display and video encoding on a thread of their own.
+
+The inference loop hands (frame, result) pairs to RenderStage.submit() and goes on with the next frame; drawing,
+cv2.imshow/cv2.waitKey or encoding into an output video happen on the render thread. Frames are copied into the
+buffers of the stage, so the caller may reuse its frame buffers right away.
+
+    python render_stage.py    YOLOv3 stub pipeline writing an annotated video, rendering in the loop against offloaded
+"""
+from __future__ import print_function, division
+
+import queue
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+POLICIES = ('drop', 'block')
+
+
+class RenderStage:
+    """Renders frames on a background thread and shows them in `window` or writes them to the video file `output`.
+
+    render(frame, result) annotates a frame (it may draw into it) and returns the frame to output. At most max_queue
+    frames wait for the render thread; when all are taken, policy 'drop' drops the submitted frame (counted in
+    `dropped`, for display, which only needs the newest frames) and 'block' waits for the render thread (for output
+    videos, which need every frame); None picks 'block' with an output video and 'drop' otherwise. Results must not
+    be modified after submit(). Keys pressed in the window are returned by key(). render_time is the time the last
+    frame took to render and output, an exception raised on the render thread is raised again by the next submit()
+    or close().
+    """
+
+    def __init__(self, render, window=None, output=None, fps=25.0, fourcc='MJPG', max_queue=4, policy=None,
+                 wait_key=1):
+        if policy is None:
+            policy = 'block' if output is not None else 'drop'
+        assert policy in POLICIES, "policy should be one of {}".format(POLICIES)
+        self.render = render
+        self.window = window
+        self.output = output
+        self.fps = fps
+        self.fourcc = fourcc
+        self.policy = policy
+        self.wait_key = wait_key
+        self.rendered = 0
+        self.dropped = 0
+        self.render_time = 0.0
+        self.total_render_time = 0.0
+        self.error = None
+        self._writer = None
+        self._key = -1
+        # One buffer more than can wait, for the frame being rendered
+        self._buffers = [None] * (max_queue + 1)
+        self._free = queue.Queue()
+        for slot in range(len(self._buffers)):
+            self._free.put(slot)
+        self._ready = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _raise(self):
+        if self.error is not None:
+            raise self.error
+
+    def _take_slot(self):
+        if self.policy == 'drop':
+            try:
+                return self._free.get_nowait()
+            except queue.Empty:
+                return None
+        while True:
+            try:
+                return self._free.get(timeout=0.1)
+            except queue.Empty:
+                self._raise()
+
+    def submit(self, frame, result=None):
+        # Returns False when the frame was dropped
+        self._raise()
+        slot = self._take_slot()
+        if slot is None:
+            self.dropped += 1
+            return False
+        buffer = self._buffers[slot]
+        if buffer is None or buffer.shape != frame.shape:
+            buffer = self._buffers[slot] = np.empty_like(frame)
+        np.copyto(buffer, frame)
+        self._ready.put((slot, result))
+        return True
+
+    def key(self):
+        # Last key pressed since the previous call, -1 for none
+        key, self._key = self._key, -1
+        return key
+
+    def _write(self, frame):
+        if self._writer is None:
+            self._size = (frame.shape[1], frame.shape[0])
+            self._writer = cv2.VideoWriter(self.output, cv2.VideoWriter_fourcc(*self.fourcc), self.fps, self._size)
+            if not self._writer.isOpened():
+                raise RuntimeError("Cannot open {} for writing".format(self.output))
+        if (frame.shape[1], frame.shape[0]) != self._size:
+            frame = cv2.resize(frame, self._size)
+        self._writer.write(frame)
+
+    def _run(self):
+        # HighGUI is not thread-safe on every backend: the window is created, updated and destroyed on this thread only
+        try:
+            self._render_frames()
+        finally:
+            if self.window is not None:
+                cv2.destroyAllWindows()
+                cv2.waitKey(1)
+
+    def _render_frames(self):
+        while True:
+            item = self._ready.get()
+            if item is None:
+                break
+            slot, result = item
+            start_time = time.time()
+            try:
+                frame = self.render(self._buffers[slot], result)
+                if self.output is not None:
+                    self._write(frame)
+                if self.window is not None:
+                    cv2.imshow(self.window, frame)
+                    key = cv2.waitKey(self.wait_key)
+                    if key != -1:
+                        self._key = key
+            except Exception as e:
+                self.error = e
+                self._free.put(slot)
+                break
+            self._free.put(slot)
+            self.render_time = time.time() - start_time
+            self.total_render_time += self.render_time
+            self.rendered += 1
+
+    def close(self):
+        # Renders the frames still waiting and closes the window on the render thread, then releases the video file
+        self._ready.put(None)
+        self._thread.join()
+        if self._writer is not None:
+            self._writer.release()
+        self._raise()
+
+    def summary(self):
+        mean = self.total_render_time / self.rendered if self.rendered else 0.0
+        return "{} frames rendered, {} dropped, mean {:.2f} ms".format(self.rendered, self.dropped, mean * 1e3)
+
+
+# ----------------------------------------------------- Benchmark ------------------------------------------------------
+def benchmark(num_frames=120, num_requests=4):
+    # The YOLOv3 stub pipeline writes an annotated 1280x720 video; the loop either draws and encodes every frame
+    # itself or hands the frames to the render thread (blocking, so both videos have every frame). Loop time
+    # is the time the inference loop spends outside of waiting for results
+    import os
+    import shutil
+    import tempfile
+
+    import benchmark as stub_models
+    from capture import FrameReader, SyntheticCapture
+    from request_pool import AsyncRequestPool
+    from stub_engine import FakeIEPlugin
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        print("{:<10} {:>8} {:>14} {:>14} {:>8}".format("rendering", "FPS", "loop ms/frame", "video frames", "dropped"))
+        for offload in (False, True):
+            exec_net, preprocess, postprocess, render = stub_models.yolo_pipeline(FakeIEPlugin())
+
+            def annotate(frame, objects):
+                render(frame, objects)
+                cv2.putText(frame, "{} objects".format(len(objects)), (15, 15), cv2.FONT_HERSHEY_COMPLEX, 0.5,
+                            (200, 10, 10), 1)
+                return frame
+
+            path = os.path.join(work_dir, 'offload.avi' if offload else 'inline.avi')
+            stage = RenderStage(annotate, output=path) if offload else None
+            writer = None
+            cap = FrameReader(SyntheticCapture(num_frames, 1280, 720), 8, keep=num_requests + 1)
+            pool = AsyncRequestPool(exec_net)
+            end_of_stream = False
+            loop_time = 0.0
+            start_time = time.time()
+            while True:
+                if not end_of_stream and not pool.full():
+                    ret, frame = cap.read()
+                    if ret:
+                        preprocess(frame, pool.next_request())
+                        pool.submit(None, frame)
+                    else:
+                        end_of_stream = True
+                if pool.empty():
+                    break
+                if not end_of_stream and not pool.full():
+                    continue
+                _, outputs, frame = pool.get()
+                busy_start = time.time()
+                objects = postprocess(outputs, frame)
+                if offload:
+                    stage.submit(frame, objects)
+                else:
+                    if writer is None:
+                        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 25.0,
+                                                 (frame.shape[1], frame.shape[0]))
+                    writer.write(annotate(frame, objects))
+                loop_time += time.time() - busy_start
+            if offload:
+                stage.close()
+            else:
+                writer.release()
+            fps = num_frames / (time.time() - start_time)
+            cap.release()
+            check = cv2.VideoCapture(path)
+            written = int(check.get(cv2.CAP_PROP_FRAME_COUNT))
+            check.release()
+            print("{:<10} {:>8.1f} {:>14.2f} {:>14} {:>8}".format(
+                "offloaded" if offload else "in loop", fps, loop_time / num_frames * 1e3, written,
+                stage.dropped if offload else 0))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    sys.exit(benchmark() or 0)
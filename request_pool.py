@@ -0,0 +1,84 @@
+from __future__ import print_function, division
+
+import sys
+import time
+from collections import deque
+
+# Status returned by InferRequest.wait() while the request is still running
+RESULT_NOT_READY = -9
+
+
+class AsyncRequestPool:
+    """Keeps up to max_in_flight infer requests of an executable network busy.
+
+    Results are handed back in submission order and a request slot is reused as soon as its result has been taken.
+    The outputs returned by get() belong to that slot, so they are only valid until the next submit().
+    Lowering max_in_flight (e.g. switching to sync mode) takes effect once the extra requests have been collected.
+    """
+
+    def __init__(self, exec_net, max_in_flight=None):
+        self.exec_net = exec_net
+        self.num_requests = len(exec_net.requests)
+        self.max_in_flight = self.num_requests if max_in_flight is None else min(max_in_flight, self.num_requests)
+        self._free = deque(range(self.num_requests))
+        self._in_flight = deque()
+
+    def __len__(self):
+        return len(self._in_flight)
+
+    def full(self):
+        return len(self._in_flight) >= self.max_in_flight
+
+    def empty(self):
+        return not self._in_flight
+
+    def ready(self, timeout=0):
+        # Whether the oldest request has finished, waiting at most timeout milliseconds
+        request_id, _ = self._in_flight[0]
+        return self.exec_net.requests[request_id].wait(timeout) != RESULT_NOT_READY
+
+    def next_request(self):
+        # Infer request the next submit() starts; its input blobs can be filled in place and submitted with inputs=None
+        return self.exec_net.requests[self._free[0]]
+
+    def submit(self, inputs, userdata=None):
+        if self.full():
+            raise RuntimeError("All {} infer requests are busy, collect a result first".format(self.max_in_flight))
+        request_id = self._free.popleft()
+        self.exec_net.start_async(request_id=request_id, inputs=inputs)
+        self._in_flight.append((request_id, userdata))
+        return request_id
+
+    def get(self):
+        # Waits for the oldest request; outputs is None when the request did not finish successfully
+        request_id, userdata = self._in_flight.popleft()
+        request = self.exec_net.requests[request_id]
+        status = request.wait(-1)
+        self._free.append(request_id)
+        return request_id, request.outputs if status == 0 else None, userdata
+
+
+def benchmark(depths=(1, 2, 4, 8), num_frames=200, infer_time=0.02, parallel=4):
+    # Throughput of the pool against a stub network whose device runs `parallel` requests at once
+    from stub_engine import FakeExecutableNetwork
+
+    print("{:>6} {:>10}".format("depth", "FPS"))
+    for depth in depths:
+        exec_net = FakeExecutableNetwork(num_requests=depth, infer_time=infer_time, parallel=parallel)
+        pool = AsyncRequestPool(exec_net)
+        frame_id = 0
+        expected_id = 0
+        start_time = time.time()
+        while frame_id < num_frames or not pool.empty():
+            if frame_id < num_frames and not pool.full():
+                pool.submit(None, frame_id)
+                frame_id += 1
+                continue
+            _, _, result_id = pool.get()
+            assert result_id == expected_id, "Results are out of order"
+            expected_id += 1
+        print("{:>6} {:>10.1f}".format(depth, num_frames / (time.time() - start_time)))
+
+
+if __name__ == '__main__':
+    sys.exit(benchmark() or 0)
@@ -0,0 +1,72 @@
+from __future__ import print_function, division
+
+import json
+import struct
+
+import numpy as np
+
+
+class JsonLinesWriter:
+    # One JSON object per processed frame, e.g. {"frame": 12, "objects": [...]}
+    def __init__(self, path):
+        self._file = open(path, 'w')
+
+    def write(self, frame_index, **fields):
+        record = dict(frame=frame_index)
+        record.update(fields)
+        self._file.write(json.dumps(record) + '\n')
+
+    def close(self):
+        self._file.close()
+
+
+def read_json_lines(path):
+    with open(path, 'r') as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def rle_encode(class_map):
+    # Runs over the row-major flattened map: values[i] is repeated lengths[i] times
+    flat = class_map.ravel()
+    starts = np.concatenate(([0], np.flatnonzero(flat[1:] != flat[:-1]) + 1))
+    lengths = np.diff(np.append(starts, flat.size))
+    return flat[starts].astype(np.uint8), lengths.astype(np.uint32)
+
+
+def rle_decode(values, lengths, shape):
+    return np.repeat(values, lengths).reshape(shape)
+
+
+# frame index, height, width, number of runs
+_MASK_HEADER = struct.Struct('<IHHI')
+
+
+class MaskWriter:
+    # Binary file of run-length encoded class maps. Every record is a header followed by the uint8 run values and the
+    # uint32 run lengths
+    def __init__(self, path):
+        self._file = open(path, 'wb')
+
+    def write(self, frame_index, class_map):
+        values, lengths = rle_encode(class_map)
+        h, w = class_map.shape
+        self._file.write(_MASK_HEADER.pack(frame_index, h, w, len(values)))
+        self._file.write(values.tobytes())
+        self._file.write(lengths.tobytes())
+
+    def close(self):
+        self._file.close()
+
+
+def read_masks(path):
+    # Yields (frame index, class map) for every record written by MaskWriter
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(_MASK_HEADER.size)
+            if len(header) < _MASK_HEADER.size:
+                return
+            frame_index, h, w, num_runs = _MASK_HEADER.unpack(header)
+            values = np.frombuffer(f.read(num_runs), dtype=np.uint8)
+            lengths = np.frombuffer(f.read(4 * num_runs), dtype=np.uint32)
+            yield frame_index, rle_decode(values, lengths, (h, w))
@@ -1,18 +1,93 @@
 ﻿import sys
-import numpy as np
 import cv2
 import time
 import logging as log
-from openvino.inference_engine import IENetwork, IEPlugin
+from collections import deque
+from openvino.inference_engine import IEPlugin
+
+from capture import FrameReader
+from model_cache import NetworkCache, UnsupportedLayersError
+from motion_gate import MotionGate
+from multistream import MultiStreamScheduler
+from preprocess import FramePreprocessor
+from render_stage import RenderStage
+from request_pool import AsyncRequestPool
+from result_writer import MaskWriter
+from road_utils import RoadPostprocessor
+from telemetry import Telemetry
 
 cpu_extension = "./models/cpu_extension.dll"
 plugin_dir = r"C:\Program Files (x86)\IntelSWTools\openvino\deployment_tools\inference_engine\bin\intel64\Release"
 
 model_xml = "./models/road-segmentation-adas-0001.xml"
 model_bin = "./models/road-segmentation-adas-0001.bin"
+# 网络加载缓存目录, 按模型文件哈希、设备和扩展库缓存层检查结果(设备支持时也缓存编译好的网络), None表示不缓存
+model_cache_dir = "./model_cache"
 
 use_CPU = True
 code = r"C:\Users\lin\Videos\ruanjianbei.mp4"
+num_requests = 4
+prefetch_frames = 8
+# 显示分辨率相对原图的比例, 分割结果直接在该分辨率上叠加
+output_scale = 0.5
+# 无界面模式: 不绘制不显示, 每帧的类别图以游程编码写入mask_file
+headless = False
+mask_file = "./road_masks.rle"
+# 渲染线程: 叠加、显示或写视频在单独的线程上进行, 不占用推理循环; output_video非空时标注后的画面写入该视频文件, 不显示
+output_video = None
+# 渲染线程跟不上时: 'drop'丢弃新的帧, 'block'等待; None表示写视频时等待(每帧都写入), 显示时丢弃
+render_policy = None
+render_queue = 4
+# 运动门限: 缩小后的灰度图与上次推理的帧平均相差不到motion_threshold个灰度级时不推理, 沿用上次的结果, 0表示每帧
+# 都推理; 至少每motion_refresh_every帧推理一次
+motion_threshold = 0
+motion_refresh_every = 30
+# 多路模式: 视频文件路径或摄像头编号的列表, 非空时代替code, 所有视频共用一个已加载的网络
+sources = []
+stream_mask_file = "./road_masks_{}.rle"
+# 运行指标: metrics_port非空时在该端口提供Prometheus文本格式的/metrics, metrics_file非空时每metrics_interval秒写一次JSON
+metrics_port = None
+metrics_file = None
+metrics_interval = 5.0
+
+
+def road_multistream(exec_net, input_blob, out_blob, shape):
+    frame_preprocessor = FramePreprocessor(shape)
+    postprocess = RoadPostprocessor(output_scale)
+
+    def preprocess(frame, request):
+        frame_preprocessor(frame, request.inputs[input_blob])
+
+    scheduler = MultiStreamScheduler(exec_net, sources, preprocess, prefetch_frames)
+    mask_writers = [MaskWriter(stream_mask_file.format(i)) for i in range(len(sources))] if headless else None
+    log.info("Starting inference of {} streams...".format(len(sources)))
+    while True:
+        # 各路视频轮流取得空闲的推理请求, 每一路的结果按帧顺序返回
+        result = scheduler.get()
+        if result is None:
+            break
+        stream_id, frame_index, frame, outputs = result
+        if outputs is None:
+            continue
+        if headless:
+            mask_writers[stream_id].write(frame_index, postprocess.class_map(outputs[out_blob]))
+            continue
+        mask = postprocess.colorize(postprocess.class_map(outputs[out_blob]))
+        frame = postprocess.blend(frame, mask)
+        cv2.imshow("road segmentation demo {}".format(stream_id), frame)
+        key = cv2.waitKey(1)
+        if key == 27:
+            break
+
+    for stream_id, stats in scheduler.stats().items():
+        log.info("Stream {}: {} frames, FPS: {:.3f}".format(stream_id, stats['frames'], stats['fps']))
+    scheduler.release()
+    if headless:
+        for mask_writer in mask_writers:
+            mask_writer.close()
+    else:
+        cv2.destroyAllWindows()
+
 
 def road_segementation_demo():
     log.basicConfig(format="[ %(levelname)s ] %(message)s", level=log.INFO, stream=sys.stdout)
@@ -27,115 +102,163 @@ def road_segementation_demo():
     else:
         plugin = IEPlugin(device="GPU")
 
-    # Read IR
-    log.info("Reading IR...")
-    net = IENetwork(model=model_xml, weights=model_bin)
-
-    if plugin.device == "CPU":
-        supported_layers = plugin.get_supported_layers(net)
-        not_supported_layers = [l for l in net.layers.keys() if l not in supported_layers]
-        if len(not_supported_layers) != 0:
-            log.error("Following layers are not supported by the plugin for specified device {}:\n {}".
-                      format(plugin.device, ', '.join(not_supported_layers)))
-            log.error("Please try to specify cpu extensions library path in demo's command line parameters using -l "
-                      "or --cpu_extension command line argument")
-            sys.exit(1)
+    # Read IR and load it to the plugin, a warm start skips the layer check
+    log.info("Loading IR to the plugin...")
+    cache = NetworkCache(plugin, model_cache_dir, cpu_extension if use_CPU else None)
+    try:
+        exec_net, net = cache.load(model_xml, model_bin, num_requests)
+    except UnsupportedLayersError as e:
+        log.error(str(e))
+        log.error("Please try to specify cpu extensions library path in demo's command line parameters using -l "
+                  "or --cpu_extension command line argument")
+        sys.exit(1)
+    log.info(cache.report())
     assert len(net.inputs.keys()) == 1, "Demo supports only single input topologies"
     assert len(net.outputs) == 1, "Demo supports only single output topologies"
     input_blob = next(iter(net.inputs))
     out_blob = next(iter(net.outputs))
-    log.info("Loading IR to the plugin...")
-    exec_net = plugin.load(network=net, num_requests=2)
     # Read and pre-process input image
     n, c, h, w = net.inputs[input_blob].shape
     del net
+    if sources:
+        road_multistream(exec_net, input_blob, out_blob, (n, c, h, w))
+        del exec_net
+        del plugin
+        return
 
-    cap = cv2.VideoCapture(code)
-
-    cur_request_id = 0
-    next_request_id = 1
+    # 不推理的帧不占用推理请求, 等待处理的帧最多为推理请求数的两倍
+    max_pending = 2 * num_requests
+    # 后台线程解码, 推理循环只从环形缓冲区取帧
+    cap = FrameReader(code, max(prefetch_frames, max_pending + 2), keep=max_pending + 1)
 
     log.info("Starting inference in async mode...")
     log.info("To switch between sync and async modes press Tab button")
     log.info("To stop the demo execution press Esc button")
     is_async_mode = True
-    render_time = 0
-    ret, frame = cap.read()
+    end_of_stream = False
+    pool = AsyncRequestPool(exec_net, num_requests if is_async_mode else 1)
+    preprocess = FramePreprocessor((n, c, h, w))
+    postprocess = RoadPostprocessor(output_scale)
+    mask_writer = MaskWriter(mask_file) if headless else None
+    painter = RoadPostprocessor(output_scale)
+
+    def render(frame, result):
+        # 在渲染线程上执行
+        mask, messages = result
+        if mask is None:
+            return cv2.resize(frame, (0, 0), fx=output_scale, fy=output_scale)
+
+        # 显示mask
+        if output_video is None:
+            cv2.imshow("mask", mask)
+
+        # 叠加输出结果
+        frame = painter.blend(frame, mask)
+
+        inf_time_message, render_time_message, async_mode_message = messages
+        cv2.putText(frame, inf_time_message, (15, 15), cv2.FONT_HERSHEY_COMPLEX, 0.5, (200, 10, 10), 1)
+        cv2.putText(frame, render_time_message, (15, 30), cv2.FONT_HERSHEY_COMPLEX, 0.5, (10, 10, 200), 1)
+        cv2.putText(frame, async_mode_message, (10, int(frame.shape[0] - 20)), cv2.FONT_HERSHEY_COMPLEX, 0.5,
+                    (10, 10, 200), 1)
+        return frame
+
+    renderer = None if headless else RenderStage(render, None if output_video else "road segmentation demo",
+                                                 output_video, cap.get(cv2.CAP_PROP_FPS) or 25.0,
+                                                 max_queue=render_queue, policy=render_policy)
+    gate = MotionGate(motion_threshold, motion_refresh_every)
+    telemetry = Telemetry('road').export(metrics_port, metrics_file, metrics_interval)
+    telemetry.watch('dropped', lambda: cap.dropped)
+    telemetry.watch('reused', lambda: gate.skipped)
+    if renderer is not None:
+        telemetry.watch('dropped', lambda: renderer.dropped)
+    pending = deque()
+    class_map = None
+    mask = None
+    messages = None
+    cur_request_id = None
+    num_frames = 0
+    run_start = time.time()
+    last_result_time = None
 
     print("To close the application, press 'CTRL+C' or any key with focus on the output window")
-    while cap.isOpened():
-        if is_async_mode:
+    while True:
+        # 异步模式下保持多个推理请求同时执行, 同步模式下只有一个
+        if not end_of_stream and not pool.full() and len(pending) < max_pending:
+            capture_start = time.time()
             ret, next_frame = cap.read()
-        else:
-            ret, frame = cap.read()
-        if not ret:
+            telemetry.observe('capture', time.time() - capture_start)
+            if ret:
+                # 与上次推理的帧相比几乎没有变化时不推理
+                infer = gate.changed(next_frame)
+                if infer:
+                    # 缩放后直接写入下一个推理请求的输入blob
+                    preprocess_start = time.time()
+                    preprocess(next_frame, pool.next_request().inputs[input_blob])
+                    telemetry.observe('preprocess', time.time() - preprocess_start)
+                    pool.submit(None)
+                pending.append((infer, next_frame, cap.frame_index, time.time()))
+            else:
+                end_of_stream = True
+        if not pending:
             break
-        initial_w = cap.get(3)
-        initial_h = cap.get(4)
-
-        # 开启同步或者异步执行模式
-        inf_start = time.time()
-        if is_async_mode:
-            in_frame = cv2.resize(next_frame, (w, h))
-            in_frame = in_frame.transpose((2, 0, 1))  # Change data layout from HWC to CHW
-            in_frame = in_frame.reshape((n, c, h, w))
-            exec_net.start_async(request_id=next_request_id, inputs={input_blob: in_frame})
-        else:
-            in_frame = cv2.resize(frame, (w, h))
-            in_frame = in_frame.transpose((2, 0, 1))  # Change data layout from HWC to CHW
-            in_frame = in_frame.reshape((n, c, h, w))
-            exec_net.start_async(request_id=cur_request_id, inputs={input_blob: in_frame})
-        if exec_net.requests[cur_request_id].wait(-1) == 0:
-            # 获取网络输出
-            res = exec_net.requests[cur_request_id].outputs[out_blob]
-
-            # 解析道路分割结果
-            res = np.squeeze(res, 0)
-            res = res.transpose(1, 2, 0)  # HWC
-            res = np.argmax(res, 2)
-            hh, ww = res.shape
-            # BG、road、curb、mark
-            mask = np.zeros((hh, ww, 3), dtype=np.uint8)
-            mask[np.where(res > 0)] = (0, 255, 255) # 黄色, 路
-            mask[np.where(res > 1)] = (255, 0, 255) # 紫红色, 车道线
-
-            # 显示mask
-            cv2.imshow("mask", mask)
+        if not end_of_stream and not pool.full() and len(pending) < max_pending:
+            continue
 
-            # 叠加输出结果
-            mask = cv2.resize(mask, dsize=(frame.shape[1], frame.shape[0]))
-            frame = cv2.addWeighted(mask, 0.3, frame, 0.7, 0)
+        # 按顺序处理最早的帧, 推理的帧按提交顺序取回推理结果, 其余帧沿用上次的结果
+        infer, frame, frame_index, inf_start = pending.popleft()
+        num_frames += 1
+        telemetry.count('frames')
+        if infer:
+            wait_start = time.time()
+            cur_request_id, outputs, _ = pool.get()
+            result_time = time.time()
+            telemetry.observe('queue_wait', result_time - wait_start)
+            telemetry.observe('inference', result_time - inf_start)
+            gate.record(result_time - inf_start)
+            # 获取网络输出, 解析道路分割结果
+            class_map = postprocess.class_map(outputs[out_blob]) if outputs is not None else None
+            telemetry.observe('postprocess', time.time() - result_time)
+        output_start = time.time()
+        if headless:
+            if class_map is not None:
+                mask_writer.write(frame_index, class_map)
+            telemetry.observe('render', time.time() - output_start)
+            continue
+        if class_map is not None:
+            if infer:
+                # 类别图和着色的缓冲区下一帧复用, 交给渲染线程的mask需要复制
+                mask = postprocess.colorize(class_map).copy()
 
             inf_end = time.time()
             det_time = inf_end - inf_start
+            # FPS按相邻两帧结果的时间间隔计算
+            fps = 1 / (inf_end - last_result_time) if last_result_time else 0
+            last_result_time = inf_end
             # Draw performance stats
-            inf_time_message = "Inference time: {:.3f} ms, FPS:{:.3f}".format(det_time * 1000,
-                                                                              1000 / (det_time * 1000 + 1))
-            render_time_message = "OpenCV rendering time: {:.3f} ms".format(render_time * 1000)
+            inf_time_message = "Inference time: {:.3f} ms, FPS:{:.3f}".format(det_time * 1000, fps)
+            render_time_message = "OpenCV rendering time: {:.3f} ms".format(renderer.render_time * 1000)
             async_mode_message = "Async mode is on. Processing request {}".format(cur_request_id) if is_async_mode else \
                 "Async mode is off. Processing request {}".format(cur_request_id)
+            messages = inf_time_message, render_time_message, async_mode_message
 
-            cv2.putText(frame, inf_time_message, (15, 15), cv2.FONT_HERSHEY_COMPLEX, 0.5, (200, 10, 10), 1)
-            cv2.putText(frame, render_time_message, (15, 30), cv2.FONT_HERSHEY_COMPLEX, 0.5, (10, 10, 200), 1)
-            cv2.putText(frame, async_mode_message, (10, int(initial_h - 20)), cv2.FONT_HERSHEY_COMPLEX, 0.5,
-                        (10, 10, 200), 1)
-
-        #
-        render_start = time.time()
-        frame = cv2.resize(frame, (0, 0), fx=0.5, fy=0.5)
-        cv2.imshow("road segmentation demo", frame)
-        render_end = time.time()
-        render_time = render_end - render_start
+        # 叠加、显示或写视频交给渲染线程
+        renderer.submit(frame, (mask, messages) if class_map is not None else (None, None))
+        telemetry.observe('render', time.time() - output_start)
 
-        if is_async_mode:
-            cur_request_id, next_request_id = next_request_id, cur_request_id
-            frame = next_frame
-
-        key = cv2.waitKey(1)
+        key = renderer.key()
         if key == 27:
             break
 
-    cv2.destroyAllWindows()
+    log.info("Processed {} frames in {:.3f} s".format(num_frames, time.time() - run_start))
+    log.info("Motion gate: {}".format(gate.summary()))
+    log.info("Telemetry: {}".format(telemetry.summary()))
+    telemetry.close()
+    cap.release()
+    if headless:
+        mask_writer.close()
+    else:
+        renderer.close()
+        log.info("Render: {}".format(renderer.summary()))
 
     del exec_net
     del plugin
@@ -0,0 +1,54 @@
+import cv2
+import numpy as np
+
+# BG、road、curb、mark 各类别的颜色: 黄色为路, 紫红色为路沿和车道线
+ROAD_COLORS = np.array([(0, 0, 0), (0, 255, 255), (255, 0, 255), (255, 0, 255)], dtype=np.uint8)
+
+
+class RoadPostprocessor:
+    """道路分割后处理, 缓冲区在各帧之间复用.
+
+    class_map()在网络输出的CHW布局上逐通道比较得到uint8类别图(0: BG, 1: road, 2: curb, 3: mark), 只需要类别的
+    使用者可以跳过着色; colorize()用一次查表完成着色; blend()按output_scale缩放后的分辨率叠加.
+    返回的数组都是复用的缓冲区, 需要保留到下一帧时请自行复制.
+    """
+
+    def __init__(self, output_scale=1.0, alpha=0.3, colors=ROAD_COLORS):
+        self.output_scale = output_scale
+        self.alpha = alpha
+        self.colors = colors
+        self._buffers = dict()
+
+    def _buffer(self, name, shape, dtype=np.uint8):
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape:
+            buf = self._buffers[name] = np.empty(shape, dtype=dtype)
+        return buf
+
+    def class_map(self, res):
+        # 与np.argmax相同, 最大值相等时取较小的类别
+        scores = res[0]
+        _, hh, ww = scores.shape
+        class_map = self._buffer('class_map', (hh, ww))
+        best = self._buffer('best', (hh, ww), scores.dtype)
+        greater = self._buffer('greater', (hh, ww), bool)
+        class_map.fill(0)
+        np.copyto(best, scores[0])
+        for k in range(1, scores.shape[0]):
+            np.greater(scores[k], best, out=greater)
+            class_map[greater] = k
+            np.maximum(best, scores[k], out=best)
+        return class_map
+
+    def colorize(self, class_map):
+        mask = self._buffer('mask', class_map.shape + (3,))
+        return np.take(self.colors, class_map, axis=0, out=mask)
+
+    def blend(self, frame, mask):
+        # 叠加输出结果, 在输出分辨率上完成, 缩小显示时不必在原图分辨率上叠加
+        fh, fw = frame.shape[:2]
+        ow, oh = int(round(fw * self.output_scale)), int(round(fh * self.output_scale))
+        if (ow, oh) != (fw, fh):
+            frame = cv2.resize(frame, (ow, oh), dst=self._buffer('frame', (oh, ow, 3)))
+        mask = cv2.resize(mask, (ow, oh), dst=self._buffer('resized_mask', (oh, ow, 3)))
+        return cv2.addWeighted(mask, self.alpha, frame, 1 - self.alpha, 0, dst=self._buffer('blended', (oh, ow, 3)))
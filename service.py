@@ -0,0 +1,413 @@
+"""
+Local inference service for the YOLOv3, road segmentation and face models.
+
+The models are loaded once and shared by every client. Frames are posted as encoded images (JPEG, PNG, ...) over
+HTTP/1.1, on a TCP port or on a Unix socket, and the results come back as JSON:
+
+    POST /v1/yolo    {"objects": [{"xmin": .., "ymin": .., "xmax": .., "ymax": .., "class_id": .., "confidence": ..,
+                                   "label": ..}, ...]}
+    POST /v1/road    {"shape": [h, w], "values": [...], "lengths": [...]}, the run-length encoded class map
+                     (see result_writer.rle_decode)
+    POST /v1/face    {"faces": [{"box": [xmin, ymin, xmax, ymax], "landmarks": [[x, y], ...] or null}, ...]}
+    GET  /v1/stats   requests, batches and mean batch size of every model
+
+Concurrent requests for a model are grouped into dynamic batches: a batch starts as soon as it holds max_batch_size
+frames, or max_wait seconds after its first frame arrived, whichever comes first.
+
+    python service.py                   serve the models configured in road.py, yoloV3.py and face.py
+    python service.py benchmark [model] load test on the stub engine, dynamic batching against one frame per request
+"""
+from __future__ import print_function, division
+
+import asyncio
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from face_utils import landmarks_to_frame, has_landmarks
+from result_writer import rle_encode
+from road_utils import RoadPostprocessor
+from stages import road_stage, yolo_stage, face_stage
+
+host = '127.0.0.1'
+port = 8500
+# Serve on this Unix socket instead of host:port (not available on Windows)
+unix_socket = None
+# Network batch size of every model, 1 disables batching
+max_batch_size = 8
+# Longest time the first frame of a batch waits for more frames, in seconds
+max_wait = 0.005
+# Batches of one model that run at the same time
+num_requests = 2
+
+
+class BatchModel:
+    """The stage of a network loaded with a batch of max_batch_size frames (see stages.Stage).
+
+    infer(request_id, frames) writes the frames into the first images of the batch, runs the request synchronously and
+    returns one JSON serializable result per frame. It is called from executor threads, each request by one thread at
+    a time. make_postprocess() is called once per request and returns postprocess(outputs, batch_index, frame), so
+    postprocessors that reuse buffers are never shared between threads.
+    """
+
+    def __init__(self, stage, make_postprocess):
+        self.stage = stage
+        self.exec_net = stage.exec_net
+        self.max_batch_size = next(iter(self.exec_net.requests[0].inputs.values())).shape[0]
+        self.num_requests = len(self.exec_net.requests)
+        self._postprocessors = [make_postprocess() for _ in self.exec_net.requests]
+
+    def infer(self, request_id, frames):
+        request = self.exec_net.requests[request_id]
+        for i, frame in enumerate(frames):
+            self.stage.preprocess(frame, request, i)
+        # A partial batch leaves the remaining images of the previous batch in place, their results are ignored
+        request.infer()
+        postprocess = self._postprocessors[request_id]
+        return [postprocess(request.outputs, i, frame) for i, frame in enumerate(frames)]
+
+
+def yolo_model(plugin, net, max_batch_size=8, num_requests=2, labels_map=None, prob_threshold=0.5,
+               iou_threshold=0.5, class_agnostic=False, top_k=None):
+    net.batch_size = max_batch_size
+    stage = yolo_stage(plugin, net, num_requests, labels_map, prob_threshold, iou_threshold, class_agnostic, top_k)
+
+    def postprocess(outputs, batch_index, frame):
+        objects = stage.postprocess({name: blob[batch_index:batch_index + 1] for name, blob in outputs.items()}, frame)
+        return dict(objects=objects.to_dicts(with_labels=True, labels_map=labels_map))
+
+    return BatchModel(stage, lambda: postprocess)
+
+
+def road_model(plugin, net, max_batch_size=8, num_requests=2):
+    out_blob = next(iter(net.outputs))
+    net.batch_size = max_batch_size
+    stage = road_stage(plugin, net, num_requests)
+
+    def make_postprocess():
+        # A class map buffer per request instead of the shared one of the stage, requests are postprocessed in
+        # parallel
+        road_postprocessor = RoadPostprocessor()
+
+        def postprocess(outputs, batch_index, frame):
+            class_map = road_postprocessor.class_map(outputs[out_blob][batch_index:batch_index + 1])
+            values, lengths = rle_encode(class_map)
+            return dict(shape=list(class_map.shape), values=values.tolist(), lengths=lengths.tolist())
+
+        return postprocess
+
+    return BatchModel(stage, make_postprocess)
+
+
+def face_model(plugin, net, landmark_net, max_batch_size=8, num_requests=2, landmark_batch_size=4):
+    out_blob = next(iter(net.outputs))
+    net.batch_size = max_batch_size
+    # The landmark network has a single request, the stage lets one batch at a time use it
+    stage = face_stage(plugin, net, landmark_net, num_requests, landmark_batch_size)
+
+    def postprocess(outputs, batch_index, frame):
+        # DetectionOutput puts the detections of all images into one list, the first column is the image index
+        detections = outputs[out_blob][0][0]
+        faces = stage.postprocess({out_blob: detections[detections[:, 0] == batch_index][None, None]}, frame)
+        points = landmarks_to_frame(faces.boxes, faces.landmarks).tolist()
+        return dict(faces=[dict(box=box, landmarks=landmarks if known else None) for box, landmarks, known in
+                           zip(faces.boxes.tolist(), points, has_landmarks(faces).tolist())])
+
+    return BatchModel(stage, lambda: postprocess)
+
+
+class DynamicBatcher:
+    """Groups the frames submitted to one BatchModel into batches.
+
+    infer(frame) is awaited by the request handlers. run() waits for a free infer request and the first queued frame,
+    then collects further frames until the batch is full or max_wait has passed since the first one, and hands the
+    batch to the executor; up to num_requests batches run at the same time.
+    """
+
+    def __init__(self, model, executor, max_wait=0.005):
+        self.model = model
+        self.executor = executor
+        self.max_wait = max_wait
+        self.requests = 0
+        self.batches = 0
+        self._queue = asyncio.Queue()
+        self._free = asyncio.Queue()
+        for request_id in range(model.num_requests):
+            self._free.put_nowait(request_id)
+        self._getter = None
+
+    async def infer(self, frame):
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((frame, future))
+        return await future
+
+    async def _next(self, timeout=None):
+        # A get that timed out stays pending for the next batch instead of being cancelled, so no frame gets lost
+        if self._getter is None:
+            self._getter = asyncio.ensure_future(self._queue.get())
+        done, _ = await asyncio.wait({self._getter}, timeout=timeout)
+        if not done:
+            return None
+        item = self._getter.result()
+        self._getter = None
+        return item
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                request_id = await self._free.get()
+                batch = [await self._next()]
+                deadline = loop.time() + self.max_wait
+                while len(batch) < self.model.max_batch_size:
+                    if not self._queue.empty():
+                        batch.append(self._queue.get_nowait())
+                        continue
+                    timeout = deadline - loop.time()
+                    item = await self._next(timeout) if timeout > 0 else None
+                    if item is None:
+                        break
+                    batch.append(item)
+                self.requests += len(batch)
+                self.batches += 1
+                asyncio.ensure_future(self._infer(request_id, batch))
+        finally:
+            if self._getter is not None:
+                self._getter.cancel()
+
+    async def _infer(self, request_id, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self.executor, self.model.infer, request_id,
+                                                 [frame for frame, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._free.put_nowait(request_id)
+
+    def stats(self):
+        return dict(requests=self.requests, batches=self.batches, max_batch_size=self.model.max_batch_size,
+                    mean_batch_size=self.requests / self.batches if self.batches else 0.0)
+
+
+async def read_message(reader):
+    # One HTTP/1.1 request or response: (start line, lower-case headers, body), None when the connection closed
+    start_line = await reader.readline()
+    if not start_line:
+        return None
+    headers = dict()
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return start_line.decode('latin-1').strip(), headers, body
+
+
+class InferenceService:
+    """Serves a dict of BatchModels by name, see the module docstring for the HTTP interface.
+
+    start() creates a DynamicBatcher per model and returns the asyncio server; close() stops the batchers and the
+    executor once the server is closed.
+    """
+
+    def __init__(self, models, max_wait=0.005):
+        self.models = models
+        self.max_wait = max_wait
+        self.executor = ThreadPoolExecutor(max_workers=sum(model.num_requests for model in models.values()))
+        self.batchers = dict()
+        self._tasks = list()
+
+    async def start(self, host='127.0.0.1', port=8500, unix_socket=None):
+        self.batchers = {name: DynamicBatcher(model, self.executor, self.max_wait)
+                         for name, model in self.models.items()}
+        self._tasks = [asyncio.ensure_future(batcher.run()) for batcher in self.batchers.values()]
+        if unix_socket:
+            return await asyncio.start_unix_server(self._handle, unix_socket)
+        return await asyncio.start_server(self._handle, host, port)
+
+    def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self.executor.shutdown()
+
+    def stats(self):
+        return {name: batcher.stats() for name, batcher in self.batchers.items()}
+
+    async def _respond(self, method, path, body):
+        if path == '/v1/stats':
+            return 200, self.stats()
+        name = path[len('/v1/'):] if path.startswith('/v1/') else None
+        if name not in self.batchers:
+            return 404, dict(error="Unknown path {}".format(path))
+        if method != 'POST':
+            return 405, dict(error="Frames have to be POSTed")
+        loop = asyncio.get_running_loop()
+        frame = await loop.run_in_executor(None, cv2.imdecode, np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            return 400, dict(error="The body is not an image")
+        try:
+            return 200, await self.batchers[name].infer(frame)
+        except Exception as e:
+            return 500, dict(error=str(e))
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                message = await read_message(reader)
+                if message is None:
+                    break
+                start_line, headers, body = message
+                method, path = start_line.split(' ')[:2]
+                status, payload = await self._respond(method, path, body)
+                data = json.dumps(payload).encode()
+                writer.write("HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n\r\n".format(
+                    status, _REASONS[status], len(data)).encode('latin-1') + data)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+def build_models(plugin):
+    from openvino.inference_engine import IENetwork
+    import face
+    import road
+    import yoloV3
+
+    with open(yoloV3.labels, 'r') as f:
+        labels_map = [x.strip() for x in f]
+    return dict(
+        yolo=yolo_model(plugin, IENetwork(model=yoloV3.yolo_model_xml, weights=yoloV3.yolo_model_bin),
+                        max_batch_size, num_requests, labels_map, iou_threshold=yoloV3.iou_threshold,
+                        class_agnostic=yoloV3.class_agnostic_nms, top_k=yoloV3.nms_top_k),
+        road=road_model(plugin, IENetwork(model=road.model_xml, weights=road.model_bin), max_batch_size,
+                        num_requests),
+        face=face_model(plugin, IENetwork(model=face.model_xml, weights=face.model_bin),
+                        IENetwork(model=face.landmark_xml, weights=face.landmark_bin), max_batch_size, num_requests,
+                        face.landmark_batch_size),
+    )
+
+
+async def serve(models):
+    service = InferenceService(models, max_wait)
+    server = await service.start(host, port, unix_socket)
+    print("Serving {} on {}".format(', '.join(models), unix_socket or "http://{}:{}".format(host, port)))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+def main():
+    from openvino.inference_engine import IEPlugin
+    import road
+
+    plugin = IEPlugin(device="CPU", plugin_dirs=road.plugin_dir)
+    plugin.add_cpu_extension(road.cpu_extension)
+    asyncio.run(serve(build_models(plugin)))
+
+
+# ----------------------------------------------------- Benchmark ------------------------------------------------------
+def stub_model(name, max_batch_size, num_requests=2, batch_ratio=0.25):
+    # Benchmark stub networks whose outputs follow the batch size of the input (see benchmark.py); every further frame
+    # of a batch costs batch_ratio of a single inference
+    import benchmark as stub_models
+    from stub_engine import FakeIEPlugin
+
+    plugin = FakeIEPlugin()
+    net = dict(yolo=stub_models.yolo_network, road=stub_models.road_network, face=stub_models.face_network)[name]()
+    single_outputs = net.outputs_fn
+
+    def face_outputs_fn(inputs):
+        # DetectionOutput lists the detections of all images in one blob, tagged with the image index
+        batch_size = next(iter(inputs.values())).shape[0]
+        outputs = single_outputs(inputs)
+        detections = np.repeat(outputs['detection_out'], batch_size, axis=2)
+        detections[0, 0, :, 0] = np.repeat(np.arange(batch_size), outputs['detection_out'].shape[2])
+        return dict(detection_out=detections)
+
+    if name == 'face':
+        net.outputs_fn = face_outputs_fn
+    net.batch_time = net.infer_time * batch_ratio
+    if name == 'yolo':
+        return yolo_model(plugin, net, max_batch_size, num_requests)
+    if name == 'road':
+        return road_model(plugin, net, max_batch_size, num_requests)
+    return face_model(plugin, net, stub_models.landmark_network(), max_batch_size, num_requests)
+
+
+async def _client(port, path, body, num_requests, latencies):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    head = "POST {} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: image/jpeg\r\nContent-Length: {}\r\n\r\n".format(
+        path, len(body)).encode('latin-1')
+    try:
+        for _ in range(num_requests):
+            start_time = time.time()
+            writer.write(head + body)
+            await writer.drain()
+            status_line, _, payload = await read_message(reader)
+            assert status_line.split(' ')[1] == '200', payload
+            latencies.append(time.time() - start_time)
+    finally:
+        writer.close()
+
+
+async def _load_test(model, port, body, num_clients, requests_per_client):
+    latencies = list()
+    start_time = time.time()
+    await asyncio.gather(*[_client(port, '/v1/' + model, body, requests_per_client, latencies)
+                           for _ in range(num_clients)])
+    return time.time() - start_time, latencies
+
+
+def benchmark(model='yolo', num_clients=16, requests_per_client=10, batch_size=8, wait=0.01):
+    # Many concurrent localhost clients posting the same JPEG frame, one frame per inference against dynamic batches
+    from capture import SyntheticCapture
+
+    _, frame = SyntheticCapture(1, 640, 360).read()
+    body = cv2.imencode('.jpg', frame)[1].tobytes()
+
+    async def run(network_batch_size):
+        service = InferenceService({model: stub_model(model, network_batch_size)}, wait)
+        server = await service.start('127.0.0.1', 0)
+        test_port = server.sockets[0].getsockname()[1]
+        elapsed, latencies = await _load_test(model, test_port, body, num_clients, requests_per_client)
+        stats = service.stats()[model]
+        server.close()
+        await server.wait_closed()
+        service.close()
+        return elapsed, latencies, stats
+
+    print("{} clients x {} requests to /v1/{}".format(num_clients, requests_per_client, model))
+    print("{:>24} {:>10} {:>12} {:>12} {:>12}".format("", "req/s", "p50 ms", "p99 ms", "mean batch"))
+    for label, network_batch_size in (("one frame per inference", 1), ("dynamic batching", batch_size)):
+        elapsed, latencies, stats = asyncio.run(run(network_batch_size))
+        p50, p99 = np.percentile(latencies, (50, 99)) * 1e3
+        print("{:>24} {:>10.1f} {:>12.1f} {:>12.1f} {:>12.2f}".format(
+            label, len(latencies) / elapsed, p50, p99, stats['mean_batch_size']))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        sys.exit(benchmark(*sys.argv[2:3]) or 0)
+    sys.exit(main() or 0)
@@ -0,0 +1,136 @@
+from __future__ import print_function, division
+
+import queue
+import threading
+
+from face_utils import detect_faces, draw_faces
+from preprocess import FramePreprocessor
+from request_pool import AsyncRequestPool
+from road_utils import RoadPostprocessor
+from yolo_parser import detect_objects, draw_objects
+
+
+class Stage:
+    """One model of a pipeline: its executable network and the demo logic around it.
+
+    preprocess(frame, request, batch_index=0) fills the input blobs of an infer request (image batch_index of a
+    batched network), postprocess(outputs, frame) turns the outputs of one image of a finished request into a result
+    that stays valid after the request is reused, and render(frame, result) draws the result and returns the frame to
+    draw on next. preprocess and postprocess may run on several threads at once, each request on one thread at a
+    time. run() drives the stage on its own thread with its own AsyncRequestPool.
+    """
+
+    def __init__(self, name, exec_net, preprocess, postprocess, render):
+        self.name = name
+        self.exec_net = exec_net
+        self.preprocess = preprocess
+        self.postprocess = postprocess
+        self.render = render
+
+    def run(self, frames, results):
+        # Takes (frame index, frame) from the frames queue until None and puts (name, frame index, result) into
+        # results in frame order; an exception is handed over as (name, None, exception)
+        try:
+            pool = AsyncRequestPool(self.exec_net)
+            end_of_stream = False
+            while True:
+                item = False
+                if not end_of_stream and not pool.full():
+                    try:
+                        # Nothing to collect, wait for the next frame; otherwise only take frames already waiting
+                        item = frames.get(block=pool.empty())
+                    except queue.Empty:
+                        pass
+                    if item is None:
+                        end_of_stream = True
+                    elif item:
+                        frame_index, frame = item
+                        self.preprocess(frame, pool.next_request())
+                        pool.submit(None, (frame_index, frame))
+                        continue
+                if pool.empty():
+                    if end_of_stream:
+                        break
+                    continue
+                _, outputs, (frame_index, frame) = pool.get()
+                results.put((self.name, frame_index, self.postprocess(outputs, frame) if outputs is not None else None))
+        except Exception as e:
+            results.put((self.name, None, e))
+
+    def start(self, frames, results):
+        thread = threading.Thread(target=self.run, args=(frames, results), daemon=True)
+        thread.start()
+        return thread
+
+
+def request_preprocessor(exec_net, input_blob):
+    # preprocess(frame, request, batch_index) with a FramePreprocessor, and its buffers, per infer request
+    preprocessors = {id(request): FramePreprocessor(request.inputs[input_blob].shape) for request in exec_net.requests}
+
+    def preprocess(frame, request, batch_index=0):
+        preprocessors[id(request)](frame, request.inputs[input_blob], batch_index)
+
+    return preprocess
+
+
+def road_stage(plugin, net, num_requests=4, output_scale=1.0):
+    input_blob = next(iter(net.inputs))
+    out_blob = next(iter(net.outputs))
+    exec_net = plugin.load(network=net, num_requests=num_requests)
+    preprocess = request_preprocessor(exec_net, input_blob)
+    # The class map buffer is reused, postprocess runs on one thread at a time
+    postprocess_lock = threading.Lock()
+    road_postprocessor = RoadPostprocessor(output_scale)
+
+    def postprocess(outputs, frame):
+        with postprocess_lock:
+            return road_postprocessor.class_map(outputs[out_blob]).copy()
+
+    def render(frame, class_map):
+        return road_postprocessor.blend(frame, road_postprocessor.colorize(class_map))
+
+    return Stage('road', exec_net, preprocess, postprocess, render)
+
+
+def yolo_stage(plugin, net, num_requests=4, labels_map=None, prob_threshold=0.5, iou_threshold=0.5,
+               class_agnostic=False, top_k=None):
+    input_blob = next(iter(net.inputs))
+    shape = net.inputs[input_blob].shape
+    layers_params = {layer_name: net.layers[layer_name].params for layer_name in net.outputs}
+    exec_net = plugin.load(network=net, num_requests=num_requests)
+    preprocess = request_preprocessor(exec_net, input_blob)
+
+    def postprocess(outputs, frame):
+        return detect_objects(outputs, layers_params, shape[2:], frame.shape[:-1], prob_threshold, iou_threshold,
+                              class_agnostic, top_k)
+
+    def render(frame, objects):
+        draw_objects(frame, objects, labels_map)
+        return frame
+
+    return Stage('yolo', exec_net, preprocess, postprocess, render)
+
+
+def face_stage(plugin, net, landmark_net, num_requests=4, landmark_batch_size=4):
+    input_blob = next(iter(net.inputs))
+    out_blob = next(iter(net.outputs))
+    lm_input_blob = next(iter(landmark_net.inputs))
+    lm_output_blob = next(iter(landmark_net.outputs))
+    exec_net = plugin.load(network=net, num_requests=num_requests)
+    preprocess = request_preprocessor(exec_net, input_blob)
+    landmark_net.batch_size = landmark_batch_size
+    lm_exec_net = plugin.load(network=landmark_net)
+    lm_preprocess = FramePreprocessor(landmark_net.inputs[lm_input_blob].shape)
+    # The landmark network has a single request, postprocess runs on one thread at a time
+    postprocess_lock = threading.Lock()
+
+    def postprocess(outputs, frame):
+        with postprocess_lock:
+            return detect_faces(outputs[out_blob], frame, lm_exec_net, lm_input_blob, lm_output_blob,
+                                lm_preprocess)
+
+    def render(frame, faces):
+        draw_faces(frame, faces)
+        return frame
+
+    return Stage('face', exec_net, preprocess, postprocess, render)
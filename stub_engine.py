@@ -0,0 +1,218 @@
+from __future__ import print_function, division
+
+import pickle
+import threading
+import time
+
+import numpy as np
+
+# Status codes returned by InferRequest.wait() of the Inference Engine python API
+OK = 0
+RESULT_NOT_READY = -9
+
+# outputs_fn of exported networks; functions and closures cannot be pickled, so an export only keeps a reference and
+# an import in another process falls back to the pseudo-random outputs
+_exported_outputs_fns = dict()
+
+
+def batched_outputs(outputs_fn):
+    # Makes outputs_fn of a single image network follow the batch size of the inputs. The outputs of every image are
+    # rolled along their last axis by the mean of a subsample of its input, so that images with different contents
+    # get different results and a batch split up in the wrong order gives wrong results
+    def outputs(inputs):
+        blobs = outputs_fn(inputs)
+        if not inputs:
+            return blobs
+        shifts = [int(image[:, ::8, ::8].mean()) for image in next(iter(inputs.values()))]
+        return {name: np.concatenate([np.roll(blob, shift, axis=-1) for shift in shifts])
+                for name, blob in blobs.items()}
+
+    return outputs
+
+
+class FakeInferRequest:
+    # Mimics openvino.inference_engine.InferRequest: inference runs on its own thread and sleeps for infer_time
+    def __init__(self, exec_net):
+        self._exec_net = exec_net
+        self.inputs = {name: np.zeros(shape, dtype=np.float32) for name, shape in exec_net.input_shapes.items()}
+        self.outputs = dict()
+        self._done = threading.Event()
+        self._done.set()
+
+    def _run(self):
+        with self._exec_net.device_slots:
+            time.sleep(self._exec_net.cost(self.inputs))
+            self.outputs = self._exec_net.outputs_fn(self.inputs)
+        self._done.set()
+
+    def async_infer(self, inputs=None):
+        self._done.wait()
+        self._done.clear()
+        # Same as the Inference Engine: given inputs are copied into the request input blobs
+        for name, data in (inputs or {}).items():
+            if name in self.inputs:
+                self.inputs[name][:] = data
+            else:
+                self.inputs[name] = data
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def infer(self, inputs=None):
+        self.async_infer(inputs)
+        self.wait(-1)
+
+    def wait(self, timeout=None):
+        if timeout is None or timeout < 0:
+            self._done.wait()
+        elif not self._done.wait(timeout / 1000):
+            return RESULT_NOT_READY
+        return OK
+
+
+class FakeExecutableNetwork:
+    """Stand-in for the object returned by IEPlugin.load().
+
+    infer_time is the simulated inference latency in seconds, batch_time is added for every further frame of a batch,
+    parallel caps how many requests the simulated device runs at once (None means every request gets its own core).
+    outputs_fn(inputs) builds the output blobs; by default deterministic pseudo-random blobs of output_shapes are
+    returned. Every request owns FP32 input blobs of input_shapes. Networks on the same device share device_slots,
+    the semaphore capping the requests running at once.
+    """
+
+    def __init__(self, output_shapes=None, num_requests=1, infer_time=0.01, parallel=None, outputs_fn=None, seed=0,
+                 input_shapes=None, batch_time=0.0, device_slots=None):
+        self.output_shapes = dict(output_shapes or {'out': (1, 1)})
+        self.input_shapes = dict(input_shapes or {})
+        self.infer_time = infer_time
+        self.batch_time = batch_time
+        self.device_slots = device_slots or threading.BoundedSemaphore(parallel or num_requests)
+        self.outputs_fn = outputs_fn or self._random_outputs
+        rng = np.random.RandomState(seed)
+        self._blobs = {name: rng.uniform(0, 1, size=shape).astype(np.float32)
+                       for name, shape in self.output_shapes.items()}
+        self.requests = [FakeInferRequest(self) for _ in range(num_requests)]
+        self.exportable = True
+        self._config = dict(output_shapes=self.output_shapes, infer_time=infer_time, parallel=parallel, seed=seed,
+                            input_shapes=self.input_shapes, batch_time=batch_time)
+        self._outputs_fn = outputs_fn
+
+    def export(self, path):
+        # Same as ExecutableNetwork.export() of the devices that support it
+        if not self.exportable:
+            raise RuntimeError("The device does not support exporting compiled networks")
+        config = dict(self._config, outputs_fn=None)
+        if self._outputs_fn is not None:
+            config['outputs_fn'] = id(self._outputs_fn)
+            _exported_outputs_fns[id(self._outputs_fn)] = self._outputs_fn
+        with open(path, 'wb') as f:
+            pickle.dump(config, f)
+
+    def _random_outputs(self, inputs):
+        return {name: blob.copy() for name, blob in self._blobs.items()}
+
+    def cost(self, inputs):
+        batch_size = next(iter(inputs.values())).shape[0] if inputs else 1
+        return self.infer_time + self.batch_time * (batch_size - 1)
+
+    def start_async(self, request_id, inputs=None):
+        self.requests[request_id].async_infer(inputs)
+
+    def infer(self, inputs=None):
+        self.requests[0].infer(inputs)
+        return self.requests[0].outputs
+
+
+class _PortInfo:
+    def __init__(self, shape):
+        self.shape = list(shape)
+
+
+class _LayerInfo:
+    def __init__(self, params):
+        self.params = dict(params)
+
+
+class FakeIENetwork:
+    """Stand-in for IENetwork built from blob shapes instead of IR files.
+
+    inputs/outputs map blob names to NCHW shapes, layer_params gives the IR params of named layers (e.g. the YOLO
+    region layers). infer_time, batch_time and outputs_fn are handed to the executable network created by
+    FakeIEPlugin.load(). reshape(input_shapes) is supported when reshape_fn(input_shapes) builds the network for
+    other input shapes, the network then takes over its shapes, timings and outputs.
+    """
+
+    def __init__(self, inputs, outputs, layer_params=None, infer_time=0.01, outputs_fn=None, batch_time=0.0,
+                 reshape_fn=None):
+        self.inputs = {name: _PortInfo(shape) for name, shape in inputs.items()}
+        self.outputs = {name: _PortInfo(shape) for name, shape in outputs.items()}
+        self.layers = {name: _LayerInfo((layer_params or {}).get(name, {}))
+                       for name in list(self.inputs) + list(self.outputs)}
+        self.infer_time = infer_time
+        self.batch_time = batch_time
+        self.outputs_fn = outputs_fn
+        self.reshape_fn = reshape_fn
+        self._batch_size = self.inputs[next(iter(self.inputs))].shape[0]
+
+    @property
+    def batch_size(self):
+        return self._batch_size
+
+    @batch_size.setter
+    def batch_size(self, batch_size):
+        self._batch_size = batch_size
+        for port in list(self.inputs.values()) + list(self.outputs.values()):
+            port.shape[0] = batch_size
+
+    def reshape(self, input_shapes):
+        # Same as IENetwork.reshape(): new input shapes, the output shapes follow
+        if self.reshape_fn is None:
+            raise RuntimeError("The network cannot be reshaped")
+        net = self.reshape_fn({name: tuple(shape) for name, shape in input_shapes.items()})
+        self.inputs = net.inputs
+        self.outputs = net.outputs
+        self.layers = net.layers
+        self.infer_time = net.infer_time
+        self.batch_time = net.batch_time
+        self.outputs_fn = net.outputs_fn
+        self._batch_size = self.inputs[next(iter(self.inputs))].shape[0]
+
+
+class FakeIEPlugin:
+    # Stand-in for IEPlugin; every layer is supported (after layer_check_time seconds) and load() returns a
+    # FakeExecutableNetwork after compile_time. With exportable the networks can be exported and brought back by
+    # import_network() in import_time. With parallel all networks of the plugin run at most parallel requests at once
+    def __init__(self, device='CPU', plugin_dirs=None, parallel=None, compile_time=0.0, import_time=0.0,
+                 exportable=True, layer_check_time=0.0):
+        self.device = device
+        self.parallel = parallel
+        self.compile_time = compile_time
+        self.import_time = import_time
+        self.exportable = exportable
+        self.layer_check_time = layer_check_time
+        self.device_slots = threading.BoundedSemaphore(parallel) if parallel else None
+
+    def add_cpu_extension(self, extension_path):
+        pass
+
+    def get_supported_layers(self, network):
+        time.sleep(self.layer_check_time)
+        return set(network.layers)
+
+    def load(self, network, num_requests=1):
+        input_shapes = {name: tuple(port.shape) for name, port in network.inputs.items()}
+        output_shapes = {name: tuple(port.shape) for name, port in network.outputs.items()}
+        time.sleep(self.compile_time)
+        exec_net = FakeExecutableNetwork(output_shapes, num_requests=num_requests, infer_time=network.infer_time,
+                                         parallel=self.parallel, outputs_fn=network.outputs_fn,
+                                         input_shapes=input_shapes, batch_time=network.batch_time,
+                                         device_slots=self.device_slots)
+        exec_net.exportable = self.exportable
+        return exec_net
+
+    def import_network(self, path, num_requests=1):
+        with open(path, 'rb') as f:
+            config = pickle.load(f)
+        time.sleep(self.import_time)
+        if self.parallel is not None:
+            config['parallel'] = self.parallel
+        config['outputs_fn'] = _exported_outputs_fns.get(config['outputs_fn'])
+        return FakeExecutableNetwork(num_requests=num_requests, device_slots=self.device_slots, **config)
@@ -0,0 +1,224 @@
+"""
+Runtime telemetry of the demos: per-stage latency histograms and frame counters.
+
+Every demo records the time a frame spends in each stage:
+
+    capture      waiting for the next decoded frame
+    preprocess   resizing into the input blob
+    queue_wait   blocked in the main loop on the result of the oldest request
+    inference    from submitting a frame until its result is collected
+    postprocess  parsing the outputs (plus landmarks for faces)
+    render       handing the frame to the render thread, or writing the result file in headless mode
+
+and counts frames, detections, dropped frames (stale frames overwritten by the capture, over the latency budget or
+not rendered because the render thread fell behind) and reused frames (not inferred, see MotionGate). The data is
+served in the Prometheus text format on http://host:port/metrics (JSON on /metrics.json) and/or dumped as JSON to a
+file every few seconds.
+
+    python telemetry.py    measure the recording overhead
+"""
+from __future__ import print_function, division
+
+import bisect
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+STAGES = ('capture', 'preprocess', 'queue_wait', 'inference', 'postprocess', 'render')
+COUNTERS = ('frames', 'detections', 'dropped', 'reused')
+# Upper bounds of the histogram buckets in seconds, 100 us to 10 s
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.0075, 0.01, 0.015, 0.02, 0.03, 0.05, 0.075, 0.1, 0.15,
+           0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    # Fixed buckets, observe() is a bisect and two additions; the last count is the +Inf bucket
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        # Linear interpolation inside the bucket, as histogram_quantile() in Prometheus
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, bucket_count in enumerate(self.counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+
+class Telemetry:
+    """Stage histograms and counters of one demo, exported under the label demo=name.
+
+    observe(stage, seconds) and count(name, n) are called from the main loop and take well under a microsecond.
+    watch(name, fn) adds fn() to a counter whenever it is exported, for counts other objects keep anyway (e.g. the
+    dropped frames of a FrameReader). export() starts the HTTP endpoint and the periodic JSON dump, close() stops them
+    and writes the final dump. Exports read the live histograms without locking, a scrape during an observation may
+    see its count before its sum.
+    """
+
+    def __init__(self, name, buckets=BUCKETS):
+        self.name = name
+        self.histograms = OrderedDict((stage, Histogram(buckets)) for stage in STAGES)
+        self.counters = OrderedDict((counter, 0) for counter in COUNTERS)
+        self._watched = dict()
+        self._server = None
+        self._dump_path = None
+        self._stop = threading.Event()
+        self._dump_thread = None
+
+    def observe(self, stage, seconds):
+        self.histograms[stage].observe(seconds)
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def watch(self, name, fn):
+        self._watched.setdefault(name, list()).append(fn)
+
+    def counter(self, name):
+        return self.counters[name] + sum(fn() for fn in self._watched.get(name, ()))
+
+    def snapshot(self):
+        stages = OrderedDict()
+        for stage, histogram in self.histograms.items():
+            if not histogram.count:
+                continue
+            stages[stage] = OrderedDict([
+                ('count', histogram.count),
+                ('mean_ms', 1e3 * histogram.sum / histogram.count),
+                ('p50_ms', 1e3 * histogram.quantile(0.5)),
+                ('p90_ms', 1e3 * histogram.quantile(0.9)),
+                ('p99_ms', 1e3 * histogram.quantile(0.99)),
+            ])
+        return OrderedDict([('demo', self.name), ('time', time.time()), ('stages', stages),
+                            ('counters', OrderedDict((name, self.counter(name)) for name in self.counters))])
+
+    def prometheus(self):
+        label = 'demo="{}"'.format(self.name)
+        lines = ["# HELP demo_stage_seconds Time a frame spent in each pipeline stage",
+                 "# TYPE demo_stage_seconds histogram"]
+        for stage, histogram in self.histograms.items():
+            labels = '{},stage="{}"'.format(label, stage)
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                cumulative += bucket_count
+                lines.append('demo_stage_seconds_bucket{{{},le="{}"}} {}'.format(labels, bound, cumulative))
+            lines.append('demo_stage_seconds_sum{{{}}} {!r}'.format(labels, histogram.sum))
+            lines.append('demo_stage_seconds_count{{{}}} {}'.format(labels, cumulative))
+        for name in self.counters:
+            lines.append("# TYPE demo_{}_total counter".format(name))
+            lines.append('demo_{}_total{{{}}} {}'.format(name, label, self.counter(name)))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        stages = ', '.join("{} {:.2f} ms".format(stage, 1e3 * histogram.sum / histogram.count)
+                           for stage, histogram in self.histograms.items() if histogram.count)
+        counters = ', '.join("{} {}".format(name, self.counter(name)) for name in self.counters)
+        return "{}; mean {}".format(counters, stages or "-")
+
+    def write_dump(self, path):
+        # Written next to the target and renamed, readers never see a partial file
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp_path, path)
+
+    def _dump_loop(self, interval):
+        while not self._stop.wait(interval):
+            self.write_dump(self._dump_path)
+
+    def export(self, port=None, path=None, interval=5.0, host='127.0.0.1'):
+        if port is not None:
+            from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+            telemetry = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path == '/metrics':
+                        body, content_type = telemetry.prometheus().encode(), 'text/plain; version=0.0.4'
+                    elif self.path == '/metrics.json':
+                        body, content_type = json.dumps(telemetry.snapshot()).encode(), 'application/json'
+                    else:
+                        self.send_error(404)
+                        return
+                    self.send_response(200)
+                    self.send_header('Content-Type', content_type)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass
+
+            self._server = ThreadingHTTPServer((host, port), Handler)
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        if path is not None:
+            self._dump_path = path
+            self._dump_thread = threading.Thread(target=self._dump_loop, args=(interval,), daemon=True)
+            self._dump_thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._dump_thread is not None:
+            self._dump_thread.join()
+            self.write_dump(self._dump_path)
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def benchmark(num_calls=200000, fps=30.0):
+    # Cost of the instrumentation of one frame (every stage observed once, frames and detections counted) against
+    # the frame time at fps and against the time.time() calls the demos need anyway
+    telemetry = Telemetry('benchmark')
+    values = [(i % 1000) * 1e-4 for i in range(1000)]
+
+    start_time = time.perf_counter()
+    for i in range(num_calls):
+        telemetry.observe('inference', values[i % 1000])
+    observe_time = (time.perf_counter() - start_time) / num_calls
+
+    start_time = time.perf_counter()
+    for i in range(num_calls):
+        telemetry.count('frames')
+    count_time = (time.perf_counter() - start_time) / num_calls
+
+    start_time = time.perf_counter()
+    for i in range(num_calls):
+        time.time()
+    clock_time = (time.perf_counter() - start_time) / num_calls
+
+    start_time = time.perf_counter()
+    for _ in range(100):
+        telemetry.prometheus()
+    scrape_time = (time.perf_counter() - start_time) / 100
+
+    per_frame = len(STAGES) * (observe_time + clock_time) + 2 * count_time
+    print("observe():           {:.0f} ns".format(observe_time * 1e9))
+    print("count():             {:.0f} ns".format(count_time * 1e9))
+    print("time.time():         {:.0f} ns".format(clock_time * 1e9))
+    print("per frame:           {:.1f} us, {:.3%} of a frame at {:.0f} FPS".format(
+        per_frame * 1e6, per_frame * fps, fps))
+    print("Prometheus scrape:   {:.2f} ms".format(scrape_time * 1e3))
+
+
+if __name__ == '__main__':
+    sys.exit(benchmark() or 0)
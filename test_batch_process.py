@@ -0,0 +1,103 @@
+from __future__ import print_function, division
+
+import os
+
+import cv2
+
+import batch_process
+from capture import SyntheticCapture
+
+
+def test_last_shard_reads_to_the_end(monkeypatch):
+    monkeypatch.setattr(batch_process, 'frame_count', lambda path: 101)
+    shards = batch_process.make_shards('video.avi', 'out.jsonl', 'yolo', 2)
+    assert [(start, end) for _, start, end, _, _ in shards] == [(0, 25), (25, 50), (50, 75), (75, None)]
+
+
+def test_unknown_frame_count_is_one_shard(monkeypatch):
+    for count in (0, -1):
+        monkeypatch.setattr(batch_process, 'frame_count', lambda path: count)
+        assert batch_process.make_shards('video.avi', 'out.jsonl', 'yolo', 4) == \
+            [('video.avi', 0, None, None, 'out.jsonl')]
+
+
+def test_batch_size_does_not_change_results(tmp_path):
+    # The stub outputs of every image depend on its input (see stub_engine.batched_outputs), so frames mixed up
+    # inside a batch change the results
+    from multistream import write_synthetic_video
+
+    video_path = write_synthetic_video(str(tmp_path / 'video.avi'), 13)
+    results = list()
+    for batch in (1, 4):
+        output_path = str(tmp_path / 'yolo_{}.jsonl'.format(batch))
+        assert batch_process.process('yolo', video_path, output_path, 1, stub=True, batch=batch) == 13
+        with open(output_path, 'rb') as f:
+            results.append(f.read())
+    assert results[0] == results[1]
+
+
+def write_mpeg4_video(path, num_frames):
+    # MPEG-4 part 2 with the default group of pictures of 12 frames, seeks have to start decoding at a keyframe
+    capture = SyntheticCapture(num_frames, 320, 240)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), 30.0, (320, 240))
+    while True:
+        ret, frame = capture.read()
+        if not ret:
+            break
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def test_shard_boundaries_on_encoded_video(tmp_path):
+    # Shards starting between keyframes together give the results of one pass over the whole video
+    video_path = write_mpeg4_video(str(tmp_path / 'video.mp4'), 50)
+    batch_process._init_worker('yolo', True, 1)
+
+    def run(shards, name):
+        for i, (source, start, end, _, output_path) in enumerate(shards):
+            part_path = str(tmp_path / '{}_{}.part'.format(name, i))
+            batch_process.process_shard((source, start, end, part_path, output_path))
+            yield part_path
+
+    reference, = run([(video_path, 0, None, None, None)], 'whole')
+    shards = batch_process.make_shards(video_path, None, 'yolo', 3)
+    assert [start for _, start, _, _, _ in shards] == [0, 8, 16, 25, 33, 41]
+    parts = list(run(shards, 'shard'))
+    with open(reference, 'rb') as f:
+        expected = f.read()
+    merged = b''.join(open(part_path, 'rb').read() for part_path in parts)
+    assert merged == expected
+    assert all(os.path.getsize(part_path) for part_path in parts)
+
+
+class SeekingCapture:
+    # Seeks land `offset` frames off the frame asked for
+    opened = list()
+
+    def __init__(self, source, offset):
+        self.offset = offset
+        self.position = 0
+        self.opened.append(self)
+
+    def set(self, prop, value):
+        self.position = value + self.offset
+
+    def get(self, prop):
+        return self.position
+
+    def grab(self):
+        self.position += 1
+        return True
+
+    def release(self):
+        pass
+
+
+def test_seek_off_the_start_frame(monkeypatch):
+    for offset in (-5, 0, 3):
+        SeekingCapture.opened = list()
+        monkeypatch.setattr(cv2, 'VideoCapture', lambda source: SeekingCapture(source, offset))
+        assert batch_process.open_at('video.mp4', 25).position == 25
+        # Landing past the start frame decodes again from the first frame
+        assert len(SeekingCapture.opened) == (2 if offset > 0 else 1)
@@ -0,0 +1,106 @@
+from __future__ import print_function, division
+
+import threading
+import time
+
+import cv2
+
+from capture import FrameReader, SyntheticCapture
+
+
+def frame_number(frame):
+    # SyntheticCapture fills frame i with gray level 3 * i outside of its box
+    return int(frame[0, 0, 0]) // 3
+
+
+def test_frames_in_order():
+    cap = FrameReader(SyntheticCapture(40, 64, 48), buffer_size=4)
+    for i in range(40):
+        ret, frame = cap.read()
+        assert ret
+        assert cap.frame_index == i
+        assert frame_number(frame) == i
+    # End of stream stays signalled
+    assert cap.read() == (False, None)
+    assert cap.read() == (False, None)
+    cap.release()
+    assert not cap._thread.is_alive()
+
+
+def test_kept_frames_are_not_overwritten():
+    keep = 3
+    cap = FrameReader(SyntheticCapture(30, 64, 48), buffer_size=keep + 2, keep=keep)
+    held = list()
+    for i in range(30):
+        ret, frame = cap.read()
+        assert ret
+        held = (held + [(i, frame)])[-keep:]
+        # Give the decoder time to fill every buffer it may use
+        time.sleep(0.005)
+        for index, kept in held:
+            assert frame_number(kept) == index
+    cap.release()
+
+
+def test_release_stops_a_waiting_decoder():
+    # The decoder waits for free buffers as nothing is read
+    cap = FrameReader(SyntheticCapture(100, 64, 48), buffer_size=3)
+    time.sleep(0.05)
+    assert cap._thread.is_alive()
+    cap.release()
+    assert not cap._thread.is_alive()
+
+
+def test_live_source_drops_old_frames():
+    num_frames = 60
+    cap = FrameReader(SyntheticCapture(num_frames, 64, 48, decode_time=0.001), buffer_size=4, live=True)
+    indices = list()
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        assert frame_number(frame) == cap.frame_index
+        indices.append(cap.frame_index)
+        # A slow consumer
+        time.sleep(0.01)
+    cap.release()
+    assert not cap._thread.is_alive()
+    assert indices == sorted(set(indices))
+    assert cap.dropped > 0
+    assert len(indices) + cap.dropped == num_frames
+
+
+class ExclusiveCapture(SyntheticCapture):
+    # Fails when two threads use the capture at once
+    def __init__(self, *args, **kwargs):
+        SyntheticCapture.__init__(self, *args, **kwargs)
+        self._busy = threading.Lock()
+        self.overlaps = 0
+
+    def _exclusive(self, call, *args):
+        if not self._busy.acquire(False):
+            self.overlaps += 1
+            return call(*args)
+        try:
+            return call(*args)
+        finally:
+            self._busy.release()
+
+    def read(self, image=None):
+        return self._exclusive(SyntheticCapture.read, self, image)
+
+    def get(self, prop_id):
+        return self._exclusive(SyntheticCapture.get, self, prop_id)
+
+
+def test_properties_while_decoding():
+    source = ExclusiveCapture(200, 64, 48, fps=25.0, decode_time=0.001)
+    cap = FrameReader(source, buffer_size=4)
+    for _ in range(200):
+        assert cap.get(cv2.CAP_PROP_FRAME_COUNT) == 200
+        assert cap.get(cv2.CAP_PROP_FPS) == 25.0
+        assert (cap.get(cv2.CAP_PROP_FRAME_WIDTH), cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) == (64, 48)
+        assert cap.get(cv2.CAP_PROP_POS_FRAMES) > cap.frame_index
+        assert cap.read()[0]
+    cap.release()
+    assert source.overlaps == 0
@@ -0,0 +1,60 @@
+from __future__ import print_function, division
+
+import numpy as np
+import pytest
+
+from detections import Detections
+from nms import filter_objects, nms, pairwise_filter
+
+
+def random_objects(seed, n=300, classes=4):
+    # Boxes clustered around a few centers, so that most of them overlap some other box
+    rng = np.random.RandomState(seed)
+    centers = rng.uniform(0, 1000, size=(n // 10, 2))[rng.randint(0, n // 10, size=n)] + rng.normal(0, 10, (n, 2))
+    sizes = rng.uniform(20, 120, size=(n, 2))
+    return [dict(xmin=int(cx - w / 2), ymin=int(cy - h / 2), xmax=int(cx + w / 2), ymax=int(cy + h / 2),
+                 class_id=int(rng.randint(classes)), confidence=float(rng.uniform(0.5, 1)))
+            for (cx, cy), (w, h) in zip(centers, sizes)]
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+@pytest.mark.parametrize('class_agnostic', [False, True])
+@pytest.mark.parametrize('iou_threshold', [0.3, 0.5, 0.7])
+def test_matches_pairwise_pass(seed, class_agnostic, iou_threshold):
+    objects = random_objects(seed)
+    kept = filter_objects(Detections.from_dicts(objects), iou_threshold, class_agnostic)
+    survivors = pairwise_filter(objects, iou_threshold, class_agnostic)
+    assert 0 < len(survivors) < len(objects)
+    assert kept.to_dicts() == Detections.from_dicts([objects[i] for i in survivors]).to_dicts()
+
+
+def test_class_aware_and_agnostic():
+    boxes = [(0, 0, 100, 100), (5, 5, 105, 105), (0, 0, 100, 100), (300, 300, 400, 400)]
+    scores = [0.9, 0.8, 0.7, 0.6]
+    class_ids = [1, 2, 1, 2]
+    # Per class the box of class 2 survives the box of class 1 it overlaps, its duplicate of class 1 does not
+    assert nms(boxes, scores, class_ids).tolist() == [0, 1, 3]
+    assert nms(boxes, scores).tolist() == [0, 3]
+    objects = Detections.from_arrays(*np.array(boxes).T, class_id=class_ids, confidence=scores)
+    assert filter_objects(objects).class_id.tolist() == [1, 2, 2]
+    assert filter_objects(objects, class_agnostic=True).class_id.tolist() == [1, 2]
+
+
+def test_top_k():
+    boxes = [(i * 200, 0, i * 200 + 100, 100) for i in range(5)]
+    scores = [0.5, 0.9, 0.7, 0.6, 0.8]
+    assert nms(boxes, scores).tolist() == [1, 4, 2, 3, 0]
+    assert nms(boxes, scores, top_k=2).tolist() == [1, 4]
+    assert nms(boxes, scores, top_k=10).tolist() == [1, 4, 2, 3, 0]
+    # Suppressed boxes do not count
+    boxes[4] = boxes[1]
+    assert nms(boxes, scores, top_k=2).tolist() == [1, 2]
+    objects = random_objects(3)
+    kept = filter_objects(Detections.from_dicts(objects), top_k=5)
+    assert kept.to_dicts() == filter_objects(Detections.from_dicts(objects))[:5].to_dicts()
+
+
+def test_empty():
+    assert nms(np.zeros((0, 4)), np.zeros(0)).tolist() == []
+    assert nms(np.zeros((0, 4)), np.zeros(0), np.zeros(0, dtype=np.int64)).tolist() == []
+    assert len(filter_objects(Detections.empty())) == 0
@@ -0,0 +1,57 @@
+from __future__ import print_function, division
+
+import cv2
+import numpy as np
+import pytest
+
+from preprocess import FramePreprocessor
+
+FRAME_SIZES = [(720, 1280), (360, 640), (1080, 1920), (97, 131)]
+# Input shapes of the road, face, landmark and YOLOv3 networks
+NET_SHAPES = [(1, 3, 512, 896), (1, 3, 384, 672), (1, 3, 48, 48), (1, 3, 416, 416)]
+
+
+def reference(frame, shape):
+    # Preprocessing of the original demos
+    n, c, h, w = shape
+    in_frame = cv2.resize(frame, (w, h))
+    in_frame = in_frame.transpose((2, 0, 1))
+    return in_frame.reshape((n, c, h, w))
+
+
+def random_frame(frame_size, seed):
+    return np.random.RandomState(seed).randint(0, 256, size=frame_size + (3,), dtype=np.uint8)
+
+
+@pytest.mark.parametrize('frame_size', FRAME_SIZES)
+@pytest.mark.parametrize('shape', NET_SHAPES)
+def test_request_blob_matches_reference(frame_size, shape):
+    # Written in place into the FP32 input blob of an infer request
+    preprocess = FramePreprocessor(shape)
+    blob = np.zeros(shape, dtype=np.float32)
+    for seed in range(2):
+        frame = random_frame(frame_size, seed)
+        assert preprocess(frame, blob) is blob
+        np.testing.assert_array_equal(blob, reference(frame, shape).astype(np.float32))
+
+
+@pytest.mark.parametrize('shape', NET_SHAPES)
+def test_own_tensors_match_reference(shape):
+    preprocess = FramePreprocessor(shape, num_slots=2)
+    frames = [random_frame((360, 640), seed) for seed in range(3)]
+    tensors = [preprocess(frame) for frame in frames]
+    # Round-robin slots: the previous tensor stays intact, the one before is reused
+    np.testing.assert_array_equal(tensors[1], reference(frames[1], shape))
+    np.testing.assert_array_equal(tensors[2], reference(frames[2], shape))
+    assert tensors[0] is tensors[2]
+
+
+def test_batch_index():
+    shape = (4, 3, 48, 48)
+    preprocess = FramePreprocessor(shape)
+    blob = np.zeros(shape, dtype=np.float32)
+    frames = [random_frame((97, 131), seed) for seed in range(4)]
+    for batch_index, frame in enumerate(frames):
+        preprocess(frame, blob, batch_index)
+    for batch_index, frame in enumerate(frames):
+        np.testing.assert_array_equal(blob[batch_index], reference(frame, (1,) + shape[1:])[0])
@@ -0,0 +1,58 @@
+from __future__ import print_function, division
+
+import os
+
+import pytest
+
+import recording
+from multistream import write_synthetic_video
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('pipeline', ['road', 'yolo', 'face'])
+def test_replay_reproduces_results(tmp_path, pipeline):
+    video_path = write_synthetic_video(str(tmp_path / 'video.avi'), 12)
+    path = str(tmp_path / 'outputs')
+    recorded_file = str(tmp_path / ('recorded' + recording.result_extensions[pipeline]))
+    replayed_file = str(tmp_path / ('replayed' + recording.result_extensions[pipeline]))
+    assert recording.record(pipeline, video_path, path, recorded_file, stub=True) == 12
+    assert recording.replay(pipeline, path, video_path, replayed_file) == 12
+    assert read(recorded_file) == read(replayed_file)
+
+
+def test_truncated_data_file(tmp_path):
+    # A crash cut the data file short: frames whose blobs reach past its end are dropped, the frames before replay
+    video_path = write_synthetic_video(str(tmp_path / 'video.avi'), 12)
+    path = str(tmp_path / 'outputs')
+    recorded_file = str(tmp_path / 'recorded.jsonl')
+    replayed_file = str(tmp_path / 'replayed.jsonl')
+    recording.record('yolo', video_path, path, recorded_file, stub=True)
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) // 2)
+    frames = recording.OutputReplay(path).frames(video_path)
+    assert 0 < len(frames) < 12
+    assert frames == list(range(len(frames)))
+    assert recording.replay('yolo', path, video_path, replayed_file) == len(frames)
+    assert read(replayed_file).splitlines() == read(recorded_file).splitlines()[:len(frames)]
+
+
+def test_record_again_keeps_the_latest_frame(tmp_path):
+    # The same source recorded twice, the second time with other content and fewer frames
+    video_path = str(tmp_path / 'video.avi')
+    path = str(tmp_path / 'outputs')
+    write_synthetic_video(video_path, 12)
+    recording.record('yolo', video_path, path, str(tmp_path / 'first.jsonl'), stub=True)
+    write_synthetic_video(video_path, 8, 320, 180)
+    recording.record('yolo', video_path, path, str(tmp_path / 'second.jsonl'), stub=True)
+    first, second = read(str(tmp_path / 'first.jsonl')), read(str(tmp_path / 'second.jsonl'))
+    assert first.splitlines()[:8] != second.splitlines()
+
+    replay = recording.OutputReplay(path)
+    assert replay.frames(video_path) == list(range(12))
+    replayed_file = str(tmp_path / 'replayed.jsonl')
+    assert recording.replay('yolo', path, video_path, replayed_file) == 8
+    assert read(replayed_file) == second
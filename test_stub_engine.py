@@ -0,0 +1,16 @@
+from __future__ import print_function, division
+
+import numpy as np
+
+from stub_engine import batched_outputs
+
+
+def test_batched_outputs_follow_each_image():
+    outputs_fn = batched_outputs(lambda inputs: {'out': np.arange(64, dtype=np.float32).reshape(1, 1, 8, 8)})
+    images = np.stack([np.full((3, 16, 16), value, dtype=np.float32) for value in (0, 1, 2)])
+    batch = outputs_fn({'data': images})['out']
+    assert batch.shape == (3, 1, 8, 8)
+    for i in range(3):
+        np.testing.assert_array_equal(batch[i:i + 1], outputs_fn({'data': images[i:i + 1]})['out'])
+    assert not np.array_equal(batch[0], batch[1])
+    assert not np.array_equal(batch[1], batch[2])
@@ -0,0 +1,109 @@
+from __future__ import print_function, division
+
+from math import exp
+
+import numpy as np
+import pytest
+
+from yolo_parser import YoloV3Params, parse_yolo_region
+
+
+# ------------------------------------------ Per-cell loop of the original demo ----------------------------------------
+def entry_index(side, coord, classes, location, entry):
+    side_power_2 = side ** 2
+    n = location // side_power_2
+    loc = location % side_power_2
+    return int(side_power_2 * (n * (coord + classes + 1) + entry) + loc)
+
+
+def scale_bbox(x, y, h, w, class_id, confidence, h_scale, w_scale):
+    xmin = int((x - w / 2) * w_scale)
+    ymin = int((y - h / 2) * h_scale)
+    xmax = int(xmin + w * w_scale)
+    ymax = int(ymin + h * h_scale)
+    return dict(xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax, class_id=class_id, confidence=confidence)
+
+
+def loop_parse_yolo_region(blob, resized_image_shape, original_im_shape, params, threshold):
+    orig_im_h, orig_im_w = original_im_shape
+    resized_image_h, resized_image_w = resized_image_shape
+    objects = list()
+    predictions = blob.flatten()
+    side_square = params.side * params.side
+    for i in range(side_square):
+        row = i // params.side
+        col = i % params.side
+        for n in range(params.num):
+            obj_index = entry_index(params.side, params.coords, params.classes, n * side_square + i, params.coords)
+            scale = predictions[obj_index]
+            if scale < threshold:
+                continue
+            box_index = entry_index(params.side, params.coords, params.classes, n * side_square + i, 0)
+            x = (col + predictions[box_index + 0 * side_square]) / params.side * resized_image_w
+            y = (row + predictions[box_index + 1 * side_square]) / params.side * resized_image_h
+            try:
+                w_exp = exp(predictions[box_index + 2 * side_square])
+                h_exp = exp(predictions[box_index + 3 * side_square])
+            except OverflowError:
+                continue
+            w = w_exp * params.anchors[params.anchor_offset + 2 * n]
+            h = h_exp * params.anchors[params.anchor_offset + 2 * n + 1]
+            for j in range(params.classes):
+                class_index = entry_index(params.side, params.coords, params.classes, n * side_square + i,
+                                          params.coords + 1 + j)
+                confidence = scale * predictions[class_index]
+                if confidence < threshold:
+                    continue
+                objects.append(scale_bbox(x=x, y=y, h=h, w=w, class_id=j, confidence=confidence,
+                                          h_scale=orig_im_h / resized_image_h, w_scale=orig_im_w / resized_image_w))
+    return objects
+
+
+# ---------------------------------------------------- Synthetic blobs -------------------------------------------------
+def region_blob(side, seed, num_objects=20, overflow=0, num=3, classes=80):
+    # Low scores everywhere, num_objects confident cells with one or two likely classes; overflow cells get a width
+    # or height logit exp() cannot represent
+    rng = np.random.RandomState(seed)
+    channels = 5 + classes
+    blob = rng.uniform(-2, 0.4, size=(1, num * channels, side, side)).astype(np.float32)
+    for _ in range(num_objects):
+        n, row, col = rng.randint(num), rng.randint(side), rng.randint(side)
+        blob[0, n * channels + 4, row, col] = rng.uniform(0.5, 1.0)
+        blob[0, n * channels + 5 + rng.randint(classes, size=2), row, col] = rng.uniform(0.5, 1.0, size=2)
+    for _ in range(overflow):
+        n, row, col = rng.randint(num), rng.randint(side), rng.randint(side)
+        blob[0, n * channels + 4, row, col] = 0.9
+        blob[0, n * channels + 5 + rng.randint(classes), row, col] = 0.9
+        blob[0, n * channels + 2 + rng.randint(2), row, col] = 1000.0
+    return blob
+
+
+def assert_same(blob, side, threshold=0.5, resized=(416, 416), original=(720, 1280)):
+    params = YoloV3Params({}, side)
+    expected = loop_parse_yolo_region(blob, resized, original, params, threshold)
+    objects = parse_yolo_region(blob, resized, original, params, threshold).to_dicts()
+    assert len(objects) == len(expected)
+    for obj, ref in zip(objects, expected):
+        for name in ('xmin', 'ymin', 'xmax', 'ymax', 'class_id', 'confidence'):
+            assert obj[name] == ref[name], (name, obj, ref)
+    return expected
+
+
+@pytest.mark.parametrize('side', [13, 26, 52])
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_matches_loop(side, seed):
+    assert assert_same(region_blob(side, seed), side)
+
+
+@pytest.mark.parametrize('side', [13, 26, 52])
+def test_overflowing_exp_is_dropped(side):
+    blob = region_blob(side, 3, num_objects=5, overflow=4)
+    assert blob.max() > np.log(np.finfo(np.float64).max)
+    assert assert_same(blob, side)
+
+
+def test_no_cell_above_threshold():
+    blob = region_blob(13, 4, num_objects=0)
+    assert assert_same(blob, 13) == []
+    assert len(parse_yolo_region(blob, (416, 416), (720, 1280), YoloV3Params({}, 13), 0.5)) == 0
+
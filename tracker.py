@@ -0,0 +1,267 @@
+from __future__ import print_function, division
+
+import sys
+import time
+from collections import deque
+
+import numpy as np
+
+from detections import Detections
+from nms import box_iou
+
+
+class KalmanBoxTrack:
+    # Constant velocity Kalman filter over box centre and size, the state is (cx, cy, w, h, vcx, vcy, vw, vh)
+    F = np.eye(8) + np.eye(8, k=4)
+    H = np.eye(4, 8)
+
+    def __init__(self, track_id, box, class_id, confidence, process_noise=1.0, measurement_noise=10.0):
+        self.track_id = track_id
+        self.class_id = class_id
+        self.confidence = confidence
+        self.x = np.zeros(8)
+        self.x[:4] = self._measurement(box)
+        # Velocities are unknown until the second detection
+        self.P = np.diag([10.0] * 4 + [1e3] * 4)
+        self.Q = np.diag([process_noise] * 4 + [process_noise / 10] * 4)
+        self.R = np.eye(4) * measurement_noise
+        self.age = 0
+        self.misses = 0
+
+    @staticmethod
+    def _measurement(box):
+        xmin, ymin, xmax, ymax = box
+        return np.array([(xmin + xmax) / 2, (ymin + ymax) / 2, xmax - xmin, ymax - ymin], dtype=np.float64)
+
+    def predict(self):
+        self.x = self.F.dot(self.x)
+        self.x[2:4] = np.maximum(self.x[2:4], 1)
+        self.P = self.F.dot(self.P).dot(self.F.T) + self.Q
+        self.age += 1
+
+    def update(self, box, confidence):
+        residual = self._measurement(box) - self.H.dot(self.x)
+        s = self.H.dot(self.P).dot(self.H.T) + self.R
+        gain = self.P.dot(self.H.T).dot(np.linalg.inv(s))
+        self.x = self.x + gain.dot(residual)
+        self.P = (np.eye(8) - gain.dot(self.H)).dot(self.P)
+        self.confidence = confidence
+        self.age = 0
+        self.misses = 0
+
+    def box(self):
+        cx, cy, w, h = self.x[:4]
+        return np.array([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2])
+
+
+class BoxTracker:
+    """Keeps detections alive between detector runs.
+
+    update(objects) takes the Detections of a frame the detector ran on, associates them with the tracks by IoU within
+    the same class and corrects the Kalman filters; predict() moves the tracks one frame ahead for frames without
+    detection. Both return the tracked Detections with a stable track_id. A track missed by max_age detector runs in a
+    row is dropped; its confidence decays by confidence_decay for every frame without detection.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_age=2, confidence_decay=0.95):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.confidence_decay = confidence_decay
+        self.tracks = list()
+        self._next_id = 0
+
+    def _objects(self):
+        # Tracks that missed the last detection are kept for association only
+        visible = [track for track in self.tracks if not track.misses]
+        boxes = np.trunc(np.array([track.box() for track in visible]).reshape(-1, 4))
+        return Detections.from_arrays(boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3],
+                                      [track.class_id for track in visible], self._confidences(visible),
+                                      track_id=[track.track_id for track in visible])
+
+    def _confidences(self, tracks):
+        return [track.confidence * self.confidence_decay ** track.age for track in tracks]
+
+    def confidence(self):
+        # Lowest confidence of the visible tracks, the detector should run again when it gets too low
+        confidences = self._confidences([track for track in self.tracks if not track.misses])
+        return min(confidences) if confidences else 1.0
+
+    def predict(self):
+        for track in self.tracks:
+            track.predict()
+        return self._objects()
+
+    def update(self, objects):
+        for track in self.tracks:
+            track.predict()
+        # Greedy association, the pair with the highest IoU first
+        pairs = list()
+        boxes = objects.boxes.astype(np.float64)
+        class_ids = objects.class_id.tolist()
+        confidences = objects.confidence.tolist()
+        if self.tracks and len(objects):
+            track_boxes = np.array([track.box() for track in self.tracks])
+            for j, box in enumerate(boxes):
+                ious = box_iou(box, track_boxes)
+                for i in np.flatnonzero(ious >= self.iou_threshold):
+                    if self.tracks[i].class_id == class_ids[j]:
+                        pairs.append((ious[i], i, j))
+        pairs.sort(key=lambda pair: -pair[0])
+        matched_tracks = set()
+        matched_objects = set()
+        for _, i, j in pairs:
+            if i in matched_tracks or j in matched_objects:
+                continue
+            self.tracks[i].update(boxes[j], confidences[j])
+            matched_tracks.add(i)
+            matched_objects.add(j)
+        for i, track in enumerate(self.tracks):
+            if i not in matched_tracks:
+                track.misses += 1
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_age]
+        for j in range(len(objects)):
+            if j not in matched_objects:
+                self.tracks.append(KalmanBoxTrack(self._next_id, boxes[j], class_ids[j], confidences[j]))
+                self._next_id += 1
+        return self._objects()
+
+
+# --------------------------------------------------- Benchmark clip ---------------------------------------------------
+class TrafficClip:
+    # cv2.VideoCapture look-alike: colored "vehicles" drive across a black road at constant speeds
+    vehicles = [((0, 0, 255), (40, 300), (6, 0), (160, 90)), ((0, 255, 0), (900, 420), (-8, 1), (200, 110)),
+                ((255, 0, 0), (300, 150), (3, 2), (120, 70)), ((255, 255, 0), (1100, 80), (-5, 3), (140, 80))]
+
+    def __init__(self, num_frames=150, width=1280, height=720):
+        self.num_frames = num_frames
+        self.width = width
+        self.height = height
+        self._index = 0
+
+    def read(self, image=None):
+        if self._index >= self.num_frames:
+            return False, None
+        if image is None or image.shape != (self.height, self.width, 3):
+            image = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        image[:] = 0
+        for color, (x, y), (vx, vy), (w, h) in self.vehicles:
+            x, y = x + vx * self._index, y + vy * self._index
+            image[max(y, 0):max(y + h, 0), max(x, 0):max(x + w, 0)] = color
+        self._index += 1
+        return True, image
+
+    def get(self, prop_id):
+        return 0
+
+    def isOpened(self):
+        return True
+
+    def release(self):
+        pass
+
+
+def traffic_detector_fn(side=13, input_size=416, anchor=(116.0, 90.0), class_id=2):
+    # Stub YOLOv3 outputs: the vehicles found in the input tensor are encoded into one region blob
+    import cv2
+
+    def outputs_fn(inputs):
+        tensor = next(iter(inputs.values()))[0]
+        blob = np.zeros((1, 255, side, side), dtype=np.float32)
+        mask = (tensor.max(axis=0) > 127).astype(np.uint8)
+        num_labels, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+        for x, y, w, h, area in stats[1:num_labels]:
+            cx, cy = (x + w / 2) / input_size * side, (y + h / 2) / input_size * side
+            col, row = min(int(cx), side - 1), min(int(cy), side - 1)
+            blob[0, 0:4, row, col] = (cx - col, cy - row, np.log(w / anchor[0]), np.log(h / anchor[1]))
+            blob[0, 4, row, col] = 0.9
+            blob[0, 5 + class_id, row, col] = 0.95
+        return {'detector/yolo-v3/Conv_{}/BiasAdd/YoloRegion'.format(side): blob}
+
+    return outputs_fn
+
+
+def track_clip(detect_every, num_frames=150, num_requests=4, infer_time=0.08, min_track_confidence=0.0):
+    # Same submission scheme as yoloV3.main in tracking mode, returns the objects of every frame and the run time
+    from capture import FrameReader
+    from preprocess import FramePreprocessor
+    from request_pool import AsyncRequestPool
+    from stub_engine import FakeExecutableNetwork
+    from yolo_parser import detect_objects
+
+    outputs_fn = traffic_detector_fn()
+    layer_name = next(iter(outputs_fn({'inputs': np.zeros((1, 3, 416, 416), dtype=np.float32)})))
+    exec_net = FakeExecutableNetwork({layer_name: (1, 255, 13, 13)}, num_requests=num_requests,
+                                     infer_time=infer_time, outputs_fn=outputs_fn,
+                                     input_shapes={'inputs': (1, 3, 416, 416)})
+    preprocess = FramePreprocessor((1, 3, 416, 416))
+    tracker = BoxTracker() if detect_every > 1 else None
+    max_pending = num_requests * detect_every
+    cap = FrameReader(TrafficClip(num_frames), max_pending + 2, keep=max_pending + 1)
+    pool = AsyncRequestPool(exec_net)
+    pending = deque()
+    last_detection = None
+    end_of_stream = False
+    results = list()
+    start_time = time.time()
+    while True:
+        if not end_of_stream and not pool.full() and len(pending) < max_pending:
+            ret, frame = cap.read()
+            if ret:
+                detect = tracker is None or last_detection is None or \
+                    cap.frame_index - last_detection >= detect_every or tracker.confidence() < min_track_confidence
+                if detect:
+                    last_detection = cap.frame_index
+                    preprocess(frame, pool.next_request().inputs['inputs'])
+                    pool.submit(None)
+                pending.append((detect, frame))
+            else:
+                end_of_stream = True
+        if not pending:
+            break
+        if not end_of_stream and not pool.full() and len(pending) < max_pending:
+            continue
+        detect, frame = pending.popleft()
+        if detect:
+            _, outputs, _ = pool.get()
+            objects = detect_objects(outputs, {layer_name: {}}, (416, 416), frame.shape[:-1])
+            if tracker is not None:
+                objects = tracker.update(objects)
+        else:
+            objects = tracker.predict()
+        results.append(objects)
+    elapsed = time.time() - start_time
+    cap.release()
+    return results, elapsed
+
+
+def agreement(reference, objects, iou_threshold=0.5):
+    # F1 score of the objects of one frame against the every-frame detections, matched greedily by IoU
+    if not len(reference) and not len(objects):
+        return 1.0
+    matched = 0
+    remaining = list(objects.boxes.astype(np.float64))
+    for ref in reference.boxes.astype(np.float64):
+        if not remaining:
+            break
+        ious = box_iou(ref, np.array(remaining))
+        best = int(np.argmax(ious))
+        if ious[best] >= iou_threshold:
+            matched += 1
+            del remaining[best]
+    return 2 * matched / (len(reference) + len(objects))
+
+
+def benchmark(intervals=(1, 2, 3, 5, 10), num_frames=150):
+    # Effective FPS and agreement with every-frame detection on the synthetic traffic clip, stub detector at 80 ms
+    reference, elapsed = track_clip(1, num_frames)
+    print("{:>8} {:>10} {:>12} {:>10}".format("every K", "FPS", "agreement", "IDs"))
+    for detect_every in intervals:
+        results, elapsed = track_clip(detect_every, num_frames)
+        score = np.mean([agreement(ref, objects) for ref, objects in zip(reference, results)])
+        ids = len(set(track_id for objects in results for track_id in objects.track_id.tolist())) \
+            if detect_every > 1 else '-'
+        print("{:>8} {:>10.1f} {:>12.3f} {:>10}".format(detect_every, num_frames / elapsed, score, ids))
+
+
+if __name__ == '__main__':
+    sys.exit(benchmark() or 0)
@@ -18,115 +18,72 @@ from __future__ import print_function, division
 
 import os
 import sys
-from math import exp as exp
+from collections import deque
 from time import time
 
 import cv2
-from openvino.inference_engine import IENetwork, IEPlugin
+from openvino.inference_engine import IEPlugin
+
+from adaptive_resolution import ResolutionController, SizedNetworks
+from capture import FrameReader
+from detections import Detections
+from model_cache import NetworkCache, UnsupportedLayersError
+from motion_gate import MotionGate
+from preprocess import FramePreprocessor
+from render_stage import RenderStage
+from request_pool import AsyncRequestPool
+from result_writer import JsonLinesWriter
+from telemetry import Telemetry
+from tracker import BoxTracker
+from yolo_parser import detect_objects, draw_objects
 
 yolo_model_xml = './models/frozen_yolo_v3.xml'
 yolo_model_bin = './models/frozen_yolo_v3.bin'
+# Cache of network loads keyed by the model file hashes, device and extension library: the layer check result and,
+# where the device can export it, the compiled network. None disables the cache
+model_cache_dir = './model_cache'
 device = 'CPU'
 plugin_dir = r"C:\Program Files (x86)\IntelSWTools\openvino\deployment_tools\inference_engine\bin\intel64\Release"
 cpu_extension = "./models/cpu_extension.dll"
 labels = './models/coco.names'
 code = r"C:\Users\lin\Videos\ruanjianbei.mp4"
-
-
-class YoloV3Params:
-    # ------------------------------------------- Extracting layer parameters ------------------------------------------
-    # Magic numbers are copied from yolo samples
-    def __init__(self, param, side):
-        self.num = 3 if 'num' not in param else len(param['mask'].split(',')) if 'mask' in param else int(param['num'])
-        self.coords = 4 if 'coords' not in param else int(param['coords'])
-        self.classes = 80 if 'classes' not in param else int(param['classes'])
-        self.anchors = [10.0, 13.0, 16.0, 30.0, 33.0, 23.0, 30.0, 61.0, 62.0, 45.0, 59.0, 119.0, 116.0, 90.0, 156.0,
-                        198.0,
-                        373.0, 326.0] if 'anchors' not in param else [float(a) for a in param['anchors'].split(',')]
-        self.side = side
-        if self.side == 13:
-            self.anchor_offset = 2 * 6
-        elif self.side == 26:
-            self.anchor_offset = 2 * 3
-        elif self.side == 52:
-            self.anchor_offset = 2 * 0
-        else:
-            assert False, "Invalid output size. Only 13, 26 and 52 sizes are supported for output spatial dimensions"
-
-
-def entry_index(side, coord, classes, location, entry):
-    side_power_2 = side ** 2
-    n = location // side_power_2
-    loc = location % side_power_2
-    return int(side_power_2 * (n * (coord + classes + 1) + entry) + loc)
-
-
-def scale_bbox(x, y, h, w, class_id, confidence, h_scale, w_scale):
-    xmin = int((x - w / 2) * w_scale)
-    ymin = int((y - h / 2) * h_scale)
-    xmax = int(xmin + w * w_scale)
-    ymax = int(ymin + h * h_scale)
-    return dict(xmin=xmin, xmax=xmax, ymin=ymin, ymax=ymax, class_id=class_id, confidence=confidence)
-
-
-def parse_yolo_region(blob, resized_image_shape, original_im_shape, params, threshold):
-    # ------------------------------------------ Validating output parameters ------------------------------------------
-    _, _, out_blob_h, out_blob_w = blob.shape
-    assert out_blob_w == out_blob_h, "Invalid size of output blob. It sould be in NCHW layout and height should " \
-                                     "be equal to width. Current height = {}, current width = {}" \
-                                     "".format(out_blob_h, out_blob_w)
-
-    # ------------------------------------------ Extracting layer parameters -------------------------------------------
-    orig_im_h, orig_im_w = original_im_shape
-    resized_image_h, resized_image_w = resized_image_shape
-    objects = list()
-    predictions = blob.flatten()
-    side_square = params.side * params.side
-
-    # ------------------------------------------- Parsing YOLO Region output -------------------------------------------
-    for i in range(side_square):
-        row = i // params.side
-        col = i % params.side
-        for n in range(params.num):
-            obj_index = entry_index(params.side, params.coords, params.classes, n * side_square + i, params.coords)
-            scale = predictions[obj_index]
-            if scale < threshold:
-                continue
-            box_index = entry_index(params.side, params.coords, params.classes, n * side_square + i, 0)
-            x = (col + predictions[box_index + 0 * side_square]) / params.side * resized_image_w
-            y = (row + predictions[box_index + 1 * side_square]) / params.side * resized_image_h
-            # Value for exp is very big number in some cases so following construction is using here
-            try:
-                w_exp = exp(predictions[box_index + 2 * side_square])
-                h_exp = exp(predictions[box_index + 3 * side_square])
-            except OverflowError:
-                continue
-            w = w_exp * params.anchors[params.anchor_offset + 2 * n]
-            h = h_exp * params.anchors[params.anchor_offset + 2 * n + 1]
-            for j in range(params.classes):
-                class_index = entry_index(params.side, params.coords, params.classes, n * side_square + i,
-                                          params.coords + 1 + j)
-                confidence = scale * predictions[class_index]
-                if confidence < threshold:
-                    continue
-                objects.append(scale_bbox(x=x, y=y, h=h, w=w, class_id=j, confidence=confidence,
-                                          h_scale=orig_im_h / resized_image_h, w_scale=orig_im_w / resized_image_w))
-    return objects
-
-
-def intersection_over_union(box_1, box_2):
-    width_of_overlap_area = min(box_1['xmax'], box_2['xmax']) - max(box_1['xmin'], box_2['xmin'])
-    height_of_overlap_area = min(box_1['ymax'], box_2['ymax']) - max(box_1['ymin'], box_2['ymin'])
-    if width_of_overlap_area < 0 or height_of_overlap_area < 0:
-        area_of_overlap = 0
-    else:
-        area_of_overlap = width_of_overlap_area * height_of_overlap_area
-    box_1_area = (box_1['ymax'] - box_1['ymin']) * (box_1['xmax'] - box_1['xmin'])
-    box_2_area = (box_2['ymax'] - box_2['ymin']) * (box_2['xmax'] - box_2['xmin'])
-    area_of_union = box_1_area + box_2_area - area_of_overlap
-    if area_of_union == 0:
-        return 0
-    return area_of_overlap / area_of_union
+iou_threshold = 0.5
+class_agnostic_nms = False
+nms_top_k = None
+num_requests = 4
+prefetch_frames = 8
+# Headless mode skips drawing and display and streams the detections of every frame to result_file as JSON Lines
+headless = False
+result_file = './detections.jsonl'
+# Render thread: drawing and display or video encoding run on a thread of their own instead of the inference loop.
+# With output_video set the annotated frames are written to that file instead of being shown
+output_video = None
+# When the render thread falls behind: 'drop' drops frames, 'block' waits; None blocks when writing a video (every
+# frame is written) and drops when displaying
+render_policy = None
+render_queue = 4
+# Tracking mode: the detector only runs every detect_every frames, or earlier once the lowest track confidence drops
+# below min_track_confidence, and tracked boxes with stable IDs fill the frames in between. 1 detects on every frame
+detect_every = 1
+min_track_confidence = 0.3
+# Motion gating: a frame whose downscaled grayscale version differs from the last inferred frame by less than
+# motion_threshold gray levels on average is not inferred and reuses the last results; 0 infers every frame. At least
+# every motion_refresh_every-th frame is inferred
+motion_threshold = 0
+motion_refresh_every = 30
+# Adaptive resolution: with input_sizes set (multiples of 32, e.g. (320, 416, 608)) the network is reshaped to each
+# size when it is first needed and the size is picked as the video goes: the largest one reaching target_fps, one size
+# up when the detections average dense_objects or more, one size down at sparse_objects or fewer (None ignores the
+# criterion). None always infers at the input size of the IR
+input_sizes = None
+target_fps = None
+dense_objects = None
+sparse_objects = None
+# Telemetry: with metrics_port set the stage histograms and counters are served in the Prometheus text format on
+# /metrics, with metrics_file set they are dumped as JSON every metrics_interval seconds
+metrics_port = None
+metrics_file = None
+metrics_interval = 5.0
 
 
 def main():
@@ -135,34 +92,29 @@ def main():
     if cpu_extension and 'CPU' in device:
         plugin.add_cpu_extension(cpu_extension)
 
-    # -------------------- 2. Reading the IR generated by the Model Optimizer (.xml and .bin files) --------------------
+    # ----------------------------- 2. Reading the IR and loading it to the plugin (cached) ----------------------------
+    # A warm start skips the check for layers the CPU extension has to support, and the compile where possible.
+    # Default batch_size is 1
     print("Loading network files:\n\t{}\n\t{}".format(yolo_model_xml, yolo_model_bin))
-    yolo_net = IENetwork(model=yolo_model_xml, weights=yolo_model_bin)
-
-    # ---------------------------------- 3. Load CPU extension for support specific layer ------------------------------
-    if plugin.device == "CPU":
-        supported_layers = plugin.get_supported_layers(yolo_net)
-        not_supported_layers = [l for l in yolo_net.layers.keys() if l not in supported_layers]
-        if len(not_supported_layers) != 0:
-            print("Following layers are not supported by the plugin for specified device {}:\n {}".
-                  format(plugin.device, ', '.join(not_supported_layers)))
-            print("Please try to specify cpu extensions library path in sample's command line parameters using -l "
-                  "or --cpu_extension command line argument")
-            sys.exit(1)
+    cache = NetworkCache(plugin, model_cache_dir, cpu_extension if 'CPU' in device else None)
+    # Every input size gets an executable network of its own, loaded (and cached) the first time it is used
+    networks = SizedNetworks(cache, yolo_model_xml, yolo_model_bin, num_requests, batch_size=1)
+    try:
+        _, yolo_net = networks.get()
+    except UnsupportedLayersError as e:
+        print(e)
+        print("Please try to specify cpu extensions library path in sample's command line parameters using -l "
+              "or --cpu_extension command line argument")
+        sys.exit(1)
+    print(cache.report())
 
     assert len(yolo_net.inputs.keys()) == 1, "Sample supports only YOLO V3 based single input topologies"
     assert len(yolo_net.outputs) == 3, "Sample supports only YOLO V3 based triple output topologies"
 
-    # ---------------------------------------------- 4. Preparing inputs -----------------------------------------------
+    # ---------------------------------------------- 3. Preparing inputs -----------------------------------------------
     print("Preparing inputs")
     input_blob = next(iter(yolo_net.inputs))
 
-    #  Defaulf batch_size is 1
-    yolo_net.batch_size = 1
-
-    # Read and pre-process input images
-    y_n, y_c, y_h, y_w = yolo_net.inputs[input_blob].shape
-
     if labels:
         with open(labels, 'r') as f:
             labels_map = [x.strip() for x in f]
@@ -172,133 +124,182 @@ def main():
     input_stream = code
 
     is_async_mode = True
-    cap = cv2.VideoCapture(input_stream)
+    # Frames waiting for their turn, tracked and gated frames take no infer request
+    max_pending = 2 * num_requests * detect_every
+    # Frames are decoded on a background thread, the buffers of the pending frames stay intact
+    cap = FrameReader(input_stream, max(prefetch_frames, max_pending + 2), keep=max_pending + 1)
     number_input_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     number_input_frames = 1 if number_input_frames != -1 and number_input_frames < 0 else number_input_frames
 
     wait_key_code = 1
 
     # Number of frames in picture is 1 and this will be read in cycle. Sync mode is default value for this case
-    if number_input_frames != 1:
-        ret, frame = cap.read()
-    else:
+    if number_input_frames == 1:
         is_async_mode = False
         wait_key_code = 0
 
-    # ----------------------------------------- 5. Loading model to the plugin -----------------------------------------
-    print("Loading model to the plugin")
-    exec_net = plugin.load(network=yolo_net, num_requests=2)
+    models = dict()
+
+    def model(size):
+        # Request pool, output layer params, input size and preprocessor of the network at size
+        if size not in models:
+            exec_net, net = networks.get(size)
+            shape = net.inputs[input_blob].shape
+            models[size] = (AsyncRequestPool(exec_net, num_requests if is_async_mode else 1),
+                            {layer_name: net.layers[layer_name].params for layer_name in net.outputs},
+                            tuple(shape[2:]), FramePreprocessor(shape))
+        return models[size]
+
+    controller = ResolutionController(input_sizes, networks.native_size if networks.native_size in input_sizes else
+                                      None, target_fps, dense_objects, sparse_objects) if input_sizes else None
+    size = networks.native_size if controller is None else controller.size
+    pool, _, _, preprocess = model(size)
 
-    cur_request_id = 0
-    next_request_id = 1
-    render_time = 0
     parsing_time = 0
+    end_of_stream = False
+    result_writer = JsonLinesWriter(result_file) if headless else None
+    tracker = BoxTracker() if detect_every > 1 else None
+    gate = MotionGate(motion_threshold, motion_refresh_every)
+    telemetry = Telemetry('yolo').export(metrics_port, metrics_file, metrics_interval)
+    telemetry.watch('dropped', lambda: cap.dropped)
+    telemetry.watch('reused', lambda: gate.skipped)
+
+    def render(frame, result):
+        # Runs on the render thread
+        objects, messages = result
+        draw_objects(frame, objects, labels_map)
 
-    # ----------------------------------------------- 6. Doing inference -----------------------------------------------
+        # Draw performance stats over frame
+        inf_time_message, render_time_message, async_mode_message, parsing_message = messages
+        cv2.putText(frame, inf_time_message, (15, 15), cv2.FONT_HERSHEY_COMPLEX, 0.5, (200, 10, 10), 1)
+        cv2.putText(frame, render_time_message, (15, 45), cv2.FONT_HERSHEY_COMPLEX, 0.5, (10, 10, 200), 1)
+        cv2.putText(frame, async_mode_message, (10, int(frame.shape[0] - 20)), cv2.FONT_HERSHEY_COMPLEX, 0.5,
+                    (10, 10, 200), 1)
+        cv2.putText(frame, parsing_message, (15, 30), cv2.FONT_HERSHEY_COMPLEX, 0.5, (10, 10, 200), 1)
+        return frame
+
+    renderer = None if headless else RenderStage(render, None if output_video else "DetectionResults", output_video,
+                                                 cap.get(cv2.CAP_PROP_FPS) or 25.0, max_queue=render_queue,
+                                                 policy=render_policy, wait_key=wait_key_code)
+    if renderer is not None:
+        telemetry.watch('dropped', lambda: renderer.dropped)
+    objects = Detections.empty()
+    pending = deque()
+    last_detection = None
+    cur_request_id = None
+    num_frames = 0
+    run_start = time()
+    last_result = (run_start, 0)
+
+    # ----------------------------------------------- 4. Doing inference -----------------------------------------------
     print("To close the application, press 'CTRL+C' or any key with focus on the output window")
-    while cap.isOpened():
-        # Here is the first asynchronous point: in the Async mode, we capture frame to populate the NEXT infer request
-        # in the regular mode, we capture frame to the CURRENT infer request
-        if is_async_mode:
+    while True:
+        # Here is the asynchronous point: in the Async mode up to num_requests frames are populated into infer
+        # requests before the oldest result is collected, in the regular mode only one request is in flight
+        if not end_of_stream and not pool.full() and len(pending) < max_pending:
+            capture_start = time()
             ret, next_frame = cap.read()
-        else:
-            ret, frame = cap.read()
-
-        if not ret:
+            telemetry.observe('capture', time() - capture_start)
+            if ret:
+                # In tracking mode the tracker state lags behind by the pending frames
+                detect = tracker is None or last_detection is None or \
+                    cap.frame_index - last_detection >= detect_every or tracker.confidence() < min_track_confidence
+                # A frame hardly changed since the last inferred one reuses the last results
+                action = 'track' if not detect else 'detect' if gate.changed(next_frame) else 'reuse'
+                if action == 'detect':
+                    last_detection = cap.frame_index
+                    # resize input_frame to network size, straight into the input blob of the next infer request
+                    preprocess_start = time()
+                    preprocess(next_frame, pool.next_request().inputs[input_blob])
+                    telemetry.observe('preprocess', time() - preprocess_start)
+
+                    # Start inference
+                    pool.submit(None)
+                pending.append((action, next_frame, cap.frame_index, time(), size))
+            else:
+                end_of_stream = True
+        if not pending:
             break
-
-        if is_async_mode:
-            request_id = next_request_id
-            in_frame = cv2.resize(next_frame, (y_w, y_h))
-        else:
-            request_id = cur_request_id
-            in_frame = cv2.resize(frame, (y_w, y_h))
-
-        # resize input_frame to network size
-        in_frame = in_frame.transpose((2, 0, 1))  # Change data layout from HWC to CHW
-        in_frame = in_frame.reshape((y_n, y_c, y_h, y_w))
-
-        # Start inference
-        start_time = time()
-        exec_net.start_async(request_id=request_id, inputs={input_blob: in_frame})
-        det_time = time() - start_time
-
-        # Collecting object detection results
-        objects = list()
-        if exec_net.requests[cur_request_id].wait(-1) == 0:
-            output = exec_net.requests[cur_request_id].outputs
-
-            start_time = time()
-            for layer_name, out_blob in output.items():
-                layer_params = YoloV3Params(yolo_net.layers[layer_name].params, out_blob.shape[2])
-                # print("Layer {} parameters: ".format(layer_name))
-                objects += parse_yolo_region(out_blob, in_frame.shape[2:],
-                                             frame.shape[:-1], layer_params,
-                                             0.5)
-            parsing_time = time() - start_time
-
-        # Filtering overlapping boxes with respect to the --iou_threshold CLI parameter
-        for i in range(len(objects)):
-            if objects[i]['confidence'] == 0:
-                continue
-            for j in range(i + 1, len(objects)):
-                if intersection_over_union(objects[i], objects[j]) > 0.5:
-                    objects[j]['confidence'] = 0
-
-        # Drawing objects with respect to the --prob_threshold CLI parameter
-        objects = [obj for obj in objects if obj['confidence'] >= 0.5]
-
-        origin_im_size = frame.shape[:-1]
-        for obj in objects:
-            # Validation bbox of detected object
-            if obj['xmax'] > origin_im_size[1] or obj['ymax'] > origin_im_size[0] or obj['xmin'] < 0 or obj['ymin'] < 0:
-                continue
-            color = (int(min(obj['class_id'] * 2, 255)),min(obj['class_id'] * 7, 255), min(obj['class_id'] * 5, 255))
-            det_label = labels_map[obj['class_id']] if labels_map and len(labels_map) >= obj['class_id'] else \
-                str(obj['class_id'])
-
-            if det_label == 'car':
-                color = (0, 0, 255)
-
-            cv2.rectangle(frame, (obj['xmin'], obj['ymin']), (obj['xmax'], obj['ymax']), color, 2)
-            cv2.putText(frame,
-                        det_label,
-                        (obj['xmin'], obj['ymin'] - 7), cv2.FONT_HERSHEY_COMPLEX, 0.6, color, 1)
-
-        # Draw performance stats over frame
+        if not end_of_stream and not pool.full() and len(pending) < max_pending:
+            continue
+
+        action, frame, frame_index, submit_time, frame_size = pending.popleft()
+        num_frames += 1
+        telemetry.count('frames')
+        if action == 'detect':
+            # Collecting object detection results in the order the frames were submitted; after a change of size the
+            # requests of the previous size drain while the frames of the new size are already being inferred
+            frame_pool, layers_params, (y_h, y_w), _ = model(frame_size)
+            wait_start = time()
+            cur_request_id, output, _ = frame_pool.get()
+            result_time = time()
+            det_time = result_time - submit_time
+            telemetry.observe('queue_wait', result_time - wait_start)
+            telemetry.observe('inference', det_time)
+            objects = Detections.empty()
+            if output is not None:
+                # Parsing, filtering overlapping boxes with respect to the iou_threshold parameter and dropping boxes
+                # under the --prob_threshold CLI parameter
+                start_time = time()
+                objects = detect_objects(output, layers_params, (y_h, y_w), frame.shape[:-1], 0.5, iou_threshold,
+                                         class_agnostic_nms, nms_top_k)
+                parsing_time = time() - start_time
+            telemetry.count('detections', len(objects))
+            if tracker is not None:
+                objects = tracker.update(objects)
+            telemetry.observe('postprocess', time() - result_time)
+            gate.record(time() - submit_time)
+            if controller is not None:
+                # Time per output frame since the previous detection, tracked and reused frames included
+                controller.record(frame_size, (result_time - last_result[0]) / (num_frames - last_result[1]),
+                                  len(objects))
+                last_result = (result_time, num_frames)
+                size = controller.size
+                pool, _, _, preprocess = model(size)
+        elif action == 'track':
+            objects = tracker.predict()
+
+        output_start = time()
+        if headless:
+            result_writer.write(frame_index, objects=objects.to_dicts(with_labels=True, labels_map=labels_map))
+            telemetry.observe('render', time() - output_start)
+            continue
+
+        # Drawing and display or video encoding are handed to the render thread
         inf_time_message = "Inference time: N\A for async mode" if is_async_mode else \
             "Inference time: {:.3f} ms".format(det_time * 1e3)
-        render_time_message = "OpenCV rendering time: {:.3f} ms".format(render_time * 1e3)
+        render_time_message = "OpenCV rendering time: {:.3f} ms".format(renderer.render_time * 1e3)
         async_mode_message = "Async mode is on. Processing request {}".format(cur_request_id) if is_async_mode else \
             "Async mode is off. Processing request {}".format(cur_request_id)
         parsing_message = "YOLO parsing time is {:.3f}".format(parsing_time * 1e3)
+        renderer.submit(frame, (objects, (inf_time_message, render_time_message, async_mode_message, parsing_message)))
+        telemetry.observe('render', time() - output_start)
 
-        cv2.putText(frame, inf_time_message, (15, 15), cv2.FONT_HERSHEY_COMPLEX, 0.5, (200, 10, 10), 1)
-        cv2.putText(frame, render_time_message, (15, 45), cv2.FONT_HERSHEY_COMPLEX, 0.5, (10, 10, 200), 1)
-        cv2.putText(frame, async_mode_message, (10, int(origin_im_size[0] - 20)), cv2.FONT_HERSHEY_COMPLEX, 0.5,
-                    (10, 10, 200), 1)
-        cv2.putText(frame, parsing_message, (15, 30), cv2.FONT_HERSHEY_COMPLEX, 0.5, (10, 10, 200), 1)
-
-        start_time = time()
-        cv2.imshow("DetectionResults", frame)
-        render_time = time() - start_time
-
-        if is_async_mode:
-            cur_request_id, next_request_id = next_request_id, cur_request_id
-            frame = next_frame
-
-        key = cv2.waitKey(wait_key_code)
+        key = renderer.key()
 
         # Tab key
         if key == 27:
             break
         # ESC key
         if key == 9:
-            exec_net.requests[cur_request_id].wait()
             is_async_mode = not is_async_mode
+            for model_pool, _, _, _ in models.values():
+                model_pool.max_in_flight = num_requests if is_async_mode else 1
             print("Switched to {} mode".format("async" if is_async_mode else "sync"))
 
-    cv2.destroyAllWindows()
+    print("Processed {} frames in {:.3f} s".format(num_frames, time() - run_start))
+    print("Motion gate: {}".format(gate.summary()))
+    if controller is not None:
+        print("Input resolution: {}".format(controller.summary()))
+        print(cache.report())
+    print("Telemetry: {}".format(telemetry.summary()))
+    telemetry.close()
+    cap.release()
+    if headless:
+        result_writer.close()
+    else:
+        renderer.close()
+        print("Render: {}".format(renderer.summary()))
 
 
 if __name__ == '__main__':
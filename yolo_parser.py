@@ -0,0 +1,149 @@
+"""
+ Copyright (C) 2018-2019 Intel Corporation
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+      http://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+"""
+from __future__ import print_function, division
+
+import cv2
+import numpy as np
+
+from detections import Detections
+from nms import filter_objects
+
+
+class YoloV3Params:
+    # ------------------------------------------- Extracting layer parameters ------------------------------------------
+    # Magic numbers are copied from yolo samples
+    def __init__(self, param, side, stride=None):
+        self.num = 3 if 'num' not in param else len(param['mask'].split(',')) if 'mask' in param else int(param['num'])
+        self.coords = 4 if 'coords' not in param else int(param['coords'])
+        self.classes = 80 if 'classes' not in param else int(param['classes'])
+        self.anchors = [10.0, 13.0, 16.0, 30.0, 33.0, 23.0, 30.0, 61.0, 62.0, 45.0, 59.0, 119.0, 116.0, 90.0, 156.0,
+                        198.0,
+                        373.0, 326.0] if 'anchors' not in param else [float(a) for a in param['anchors'].split(',')]
+        self.side = side
+        if 'mask' in param:
+            # The anchors of the layer are named by the IR
+            self.anchor_offset = 2 * int(param['mask'].split(',')[0])
+        else:
+            # Without a mask the anchors follow from the downsampling of the layer: stride 8 (the finest grid) uses
+            # the first num anchors, 16 the next and 32 the last. stride is input size / side, any multiple-of-32
+            # input size works; without it the sides of the 416x416 IR (13, 26 and 52) are assumed
+            stride = 416 / side if stride is None else stride
+            level = np.log2(stride / 8)
+            assert level in (0, 1, 2), "Invalid output size. The output side should be the input size divided by 8, " \
+                                       "16 or 32, got side {} for stride {}".format(side, stride)
+            self.anchor_offset = 2 * self.num * int(level)
+
+
+def scale_bboxes(x, y, h, w, h_scale, w_scale):
+    # Same rounding as the original per-box int() calls: truncation towards zero
+    xmin = np.trunc((x - w / 2) * w_scale)
+    ymin = np.trunc((y - h / 2) * h_scale)
+    xmax = np.trunc(xmin + w * w_scale)
+    ymax = np.trunc(ymin + h * h_scale)
+    return xmin.astype(np.int64), ymin.astype(np.int64), xmax.astype(np.int64), ymax.astype(np.int64)
+
+
+def parse_yolo_region(blob, resized_image_shape, original_im_shape, params, threshold):
+    # ------------------------------------------ Validating output parameters ------------------------------------------
+    _, _, out_blob_h, out_blob_w = blob.shape
+    assert out_blob_w == out_blob_h, "Invalid size of output blob. It sould be in NCHW layout and height should " \
+                                     "be equal to width. Current height = {}, current width = {}" \
+                                     "".format(out_blob_h, out_blob_w)
+
+    # ------------------------------------------ Extracting layer parameters -------------------------------------------
+    orig_im_h, orig_im_w = original_im_shape
+    resized_image_h, resized_image_w = resized_image_shape
+    side = params.side
+    # Region output is laid out as (anchors, coords + 1 + classes, side, side)
+    predictions = blob.reshape(params.num, params.coords + 1 + params.classes, side, side)
+
+    # ------------------------------------------- Parsing YOLO Region output -------------------------------------------
+    # Cells are visited row by row and anchors inside a cell, which keeps the box order of the per-cell loop
+    objectness = predictions[:, params.coords].transpose(1, 2, 0)
+    row, col, n = np.nonzero(objectness >= threshold)
+    if row.size == 0:
+        return Detections.empty()
+    entries = predictions[n, :, row, col].astype(np.float64)
+
+    x = (col + entries[:, 0]) / side * resized_image_w
+    y = (row + entries[:, 1]) / side * resized_image_h
+    # Value for exp is very big number in some cases, such boxes are dropped
+    with np.errstate(over='ignore'):
+        w_exp = np.exp(entries[:, 2])
+        h_exp = np.exp(entries[:, 3])
+    anchors = np.asarray(params.anchors, dtype=np.float64)
+    w = w_exp * anchors[params.anchor_offset + 2 * n]
+    h = h_exp * anchors[params.anchor_offset + 2 * n + 1]
+
+    scale = predictions[n, params.coords, row, col]
+    confidence = scale[:, None] * predictions[n, params.coords + 1:, row, col]
+    confidence[~(np.isfinite(w_exp) & np.isfinite(h_exp))] = -np.inf
+    box_id, class_id = np.nonzero(confidence >= threshold)
+
+    xmin, ymin, xmax, ymax = scale_bboxes(x[box_id], y[box_id], h[box_id], w[box_id],
+                                          h_scale=orig_im_h / resized_image_h, w_scale=orig_im_w / resized_image_w)
+    return Detections.from_arrays(xmin, ymin, xmax, ymax, class_id, confidence[box_id, class_id])
+
+
+def parse_yolo_output(output, layers_params, resized_image_shape, original_im_shape, threshold):
+    # Boxes of all region layers; layers_params maps an output layer name to its IR layer params
+    return Detections.concatenate([
+        parse_yolo_region(out_blob, resized_image_shape, original_im_shape,
+                          YoloV3Params(layers_params[layer_name], out_blob.shape[2],
+                                       resized_image_shape[0] / out_blob.shape[2]), threshold)
+        for layer_name, out_blob in output.items()])
+
+
+def detect_objects(output, layers_params, resized_image_shape, original_im_shape, prob_threshold=0.5,
+                   iou_threshold=0.5, class_agnostic=False, top_k=None):
+    # Post-processing of the demos: boxes of all region layers, NMS, boxes under prob_threshold dropped
+    objects = parse_yolo_output(output, layers_params, resized_image_shape, original_im_shape, prob_threshold)
+    objects = filter_objects(objects, iou_threshold, class_agnostic, top_k)
+    return objects.filter(min_confidence=prob_threshold)
+
+
+def draw_objects(frame, objects, labels_map):
+    # Validation bbox of detected object, boxes leaving the frame are not drawn
+    objects = objects[objects.inside(frame.shape[1], frame.shape[0])]
+    track_ids = objects.track_id.tolist() if objects.has('track_id') else [None] * len(objects)
+    for (xmin, ymin, xmax, ymax), class_id, det_label, track_id in zip(
+            objects.boxes.tolist(), objects.class_id.tolist(), objects.labels(labels_map), track_ids):
+        color = (int(min(class_id * 2, 255)), min(class_id * 7, 255), min(class_id * 5, 255))
+
+        if det_label == 'car':
+            color = (0, 0, 255)
+        if track_id is not None:
+            det_label += ' #{}'.format(track_id)
+
+        cv2.rectangle(frame, (xmin, ymin), (xmax, ymax), color, 2)
+        cv2.putText(frame,
+                    det_label,
+                    (xmin, ymin - 7), cv2.FONT_HERSHEY_COMPLEX, 0.6, color, 1)
+
+
+def intersection_over_union(box_1, box_2):
+    width_of_overlap_area = min(box_1['xmax'], box_2['xmax']) - max(box_1['xmin'], box_2['xmin'])
+    height_of_overlap_area = min(box_1['ymax'], box_2['ymax']) - max(box_1['ymin'], box_2['ymin'])
+    if width_of_overlap_area < 0 or height_of_overlap_area < 0:
+        area_of_overlap = 0
+    else:
+        area_of_overlap = width_of_overlap_area * height_of_overlap_area
+    box_1_area = (box_1['ymax'] - box_1['ymin']) * (box_1['xmax'] - box_1['xmin'])
+    box_2_area = (box_2['ymax'] - box_2['ymin']) * (box_2['xmax'] - box_2['xmin'])
+    area_of_union = box_1_area + box_2_area - area_of_overlap
+    if area_of_union == 0:
+        return 0
+    return area_of_overlap / area_of_union